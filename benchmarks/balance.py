@@ -0,0 +1,75 @@
+"""Balance-as-of latency from checkpoints versus summing every earlier row, and the
+cost a backdated insert pays to move the later checkpoints:
+
+    python benchmarks/balance.py --rows 200000 --queries 200
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_balance_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from src.database import DatabaseManager, SessionLocal  # noqa: E402
+from src import balance, crud  # noqa: E402
+
+START = datetime.date(2015, 1, 1)
+DAYS = 10 * 365
+
+
+def full_scan(db, user_table, as_of):
+    net = func.coalesce(user_table.c.credit, 0) - func.coalesce(user_table.c.debit, 0)
+    return db.execute(select(func.coalesce(func.sum(net), 0.0)).where(user_table.c.date <= as_of)).scalar()
+
+
+def timed_us(fn, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    db = SessionLocal()
+    for start in range(0, args.rows, 50000):
+        crud.insert_transactions(db, "bench", [
+            {"reference_no": f"ref-{i:09d}", "date": START + datetime.timedelta(days=rng.randrange(DAYS)),
+             "details": "bench", "debit": rng.uniform(0, 100), "credit": rng.uniform(0, 100)}
+            for i in range(start, min(start + 50000, args.rows))
+        ])
+    user_table = DatabaseManager.get_table("bench")
+    checkpoints = balance.get_checkpoint_table("bench")
+
+    dates = [(START + datetime.timedelta(days=rng.randrange(DAYS)),) for _ in range(args.queries)]
+    scan = timed_us(lambda d: full_scan(db, user_table, d), dates)
+    checkpointed = timed_us(lambda d: balance.balance_as_of(db, user_table, checkpoints, d), dates)
+    print(f"balance as of, full scan:   {scan:9.0f} us p50")
+    print(f"balance as of, checkpoints: {checkpointed:9.0f} us p50")
+
+    def insert(date, i):
+        crud.insert_transactions(db, "bench", [
+            {"reference_no": f"new-{date}-{i}", "date": date, "details": "bench", "debit": 1.0, "credit": 0.0}
+        ])
+
+    for label, date in (("backdated (10y ago)", START), ("current month", START + datetime.timedelta(days=DAYS - 1))):
+        print(f"insert, {label:>19}: {timed_us(insert, [(date, i) for i in range(args.queries)]):9.0f} us p50")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
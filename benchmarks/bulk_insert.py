@@ -0,0 +1,67 @@
+"""Compares rows/second of the single-row and bulk transaction endpoints.
+
+Runs in-process against throwaway SQLite files, so the databases under
+``databases/`` are never touched:
+
+    python benchmarks/bulk_insert.py --rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_bulk_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{tmp_dir}/auth.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from fast_api import app  # noqa: E402
+
+
+def make_rows(n):
+    return [
+        {"date": f"2024-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}", "details": f"item-{i % 7}", "debit": i % 100, "credit": 0}
+        for i in range(n)
+    ]
+
+
+def login(client, username):
+    client.post("/signup/", json={"username": username, "password": "bench"})
+    response = client.post("/login/", json={"username": username, "password": "bench"})
+    return response.json()["access_token"]
+
+
+def bench_single(client, token, rows):
+    start = time.perf_counter()
+    for row in rows:
+        client.post("/transactions/", params={"token": token}, json=row)
+    return time.perf_counter() - start
+
+
+def bench_bulk(client, token, rows):
+    start = time.perf_counter()
+    response = client.post("/transactions/bulk", params={"token": token}, json=rows)
+    assert response.json()["inserted"] == len(rows)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    rows = make_rows(args.rows)
+
+    single = bench_single(client, login(client, "bench_single"), rows)
+    bulk = bench_bulk(client, login(client, "bench_bulk"), rows)
+
+    print(f"single-row endpoint: {args.rows / single:10.0f} rows/s ({single:.2f}s)")
+    print(f"bulk endpoint:       {args.rows / bulk:10.0f} rows/s ({bulk:.2f}s)")
+    print(f"speedup:             {single / bulk:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
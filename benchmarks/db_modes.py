@@ -0,0 +1,80 @@
+"""Compares concurrent-request throughput of the sync and async database modes.
+
+Each mode runs in its own process (DB_MODE is read at import time) against
+throwaway SQLite files, driving a create/read mix through an in-process client:
+
+    python benchmarks/db_modes.py --concurrency 32 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_load(concurrency: int, seconds: float):
+    import httpx
+    from fast_api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/signup/", json={"username": "bench", "password": "bench"})
+        response = await client.post("/login/", json={"username": "bench", "password": "bench"})
+        params = {"token": response.json()["access_token"]}
+        response = await client.post("/transactions/", params=params, json={"date": "2024-01-01", "debit": 1})
+        url = f"/transactions/{response.json()['reference_no']}"
+
+        async def worker(deadline, counts):
+            i = 0
+            while time.perf_counter() < deadline:
+                if i % 4 == 0:
+                    response = await client.post("/transactions/", params=params, json={"date": "2024-02-01", "debit": i})
+                else:
+                    response = await client.get(url, params=params)
+                counts[0] += 1
+                counts[1] += response.status_code >= 400
+                i += 1
+
+        counts = [0, 0]
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(start + seconds, counts) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"requests": counts[0], "errors": counts[1], "seconds": elapsed, "rps": counts[0] / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_load(args.concurrency, args.seconds))))
+        return
+
+    for mode in ("sync", "async"):
+        tmp_dir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            DB_MODE=mode,
+            DATABASE_URL=f"sqlite:///{tmp_dir}/transactions.db",
+            AUTH_DATABASE_URL=f"sqlite:///{tmp_dir}/auth.db",
+        )
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--concurrency", str(args.concurrency), "--seconds", str(args.seconds)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>5}: {result['rps']:8.0f} req/s ({result['requests']} requests, {result['errors']} errors, concurrency {args.concurrency})")
+
+
+if __name__ == "__main__":
+    main()
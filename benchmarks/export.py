@@ -0,0 +1,66 @@
+"""Export throughput and peak Python memory per format, against reading everything
+with ``pandas.read_sql_query`` the way analysts pulled data before:
+
+    python benchmarks/export.py --rows 200000
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_export_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+from src.database import DatabaseManager, SessionLocal, engine  # noqa: E402
+from src import crud, export  # noqa: E402
+
+
+def seed(user_name, n):
+    db = SessionLocal()
+    try:
+        for start in range(0, n, 50000):
+            crud.insert_transactions(db, user_name, [
+                {"reference_no": f"ref-{i:09d}", "date": datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+                 "details": f"details {i % 50}", "debit": float(i % 997), "credit": float(i % 89)}
+                for i in range(start, min(start + 50000, n))
+            ])
+    finally:
+        db.close()
+
+
+def measure(label, fn, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:>9}: {rows / elapsed:10.0f} rows/s  {size / 1e6:7.1f} MB out  peak {peak / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    seed("bench", args.rows)
+    user_table = DatabaseManager.get_table("bench")
+    query = user_table.select().order_by(user_table.c.date, user_table.c.reference_no)
+
+    def read_sql():
+        frame = pd.read_sql_query(f"SELECT * FROM {user_table.name} ORDER BY date, reference_no", engine)
+        return frame.memory_usage(deep=True).sum()
+
+    measure("read_sql", read_sql, args.rows)
+    for format in ("csv", "arrow", "parquet"):
+        chunks = lambda: export.stream_export(user_table, query, format)  # noqa: E731
+        measure(format, lambda: sum(len(chunk) for chunk in chunks()), args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Throughput and latency of writes with and without group commit.
+
+Runs a write-only workload at each concurrency level, once committing every request
+(WRITE_COALESCING=0) and once through the group-commit writer (WRITE_COALESCING=1):
+
+* ``--target db`` (default) issues the ``crud`` writes from asyncio clients in
+  process (on DB_MODE=async sessions), so only the database work is measured;
+* ``--target live`` drives a uvicorn server over HTTP through ``load_test.py``.
+
+    python benchmarks/group_commit.py --concurrency 1,16,128 --requests 4000
+    SQLITE_SYNCHRONOUS=FULL python benchmarks/group_commit.py --target live
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from load_test import summarize  # noqa: E402
+
+
+async def run_db_workload(concurrency: int, total_requests: int, users: int):
+    """Creates, updates and deletes (6:3:1) from ``concurrency`` clients in this process."""
+    from src import crud, group_commit
+    from src.database import get_shard
+
+    rng = random.Random(0)
+    latencies = {"create": [], "update": [], "delete": []}
+    issued = 0
+
+    async def client(index: int):
+        nonlocal issued
+        user_name = f"bench_{index % users}"
+        references = []
+        db = get_shard(user_name).AsyncSessionLocal()
+        try:
+            while issued < total_requests:
+                issued += 1
+                operation = rng.choices(("create", "update", "delete"), (6, 3, 1))[0] if references else "create"
+                start = time.perf_counter()
+                if operation == "create":
+                    reference_no = f"{index}-{issued}"
+                    await group_commit.write(db, crud.insert_transactions, user_name, [{
+                        "reference_no": reference_no, "date": datetime.date(2024, 1, 1 + issued % 28),
+                        "details": "bench", "debit": 1.0, "credit": 0.0,
+                    }])
+                    references.append(reference_no)
+                elif operation == "update":
+                    reference_no = rng.choice(references)
+                    await group_commit.write(db, crud.update_transaction, user_name, reference_no, {"debit": 2.0})
+                else:
+                    reference_no = references.pop(rng.randrange(len(references)))
+                    await group_commit.write(db, crud.delete_transaction, user_name, reference_no)
+                latencies[operation].append(time.perf_counter() - start)
+        finally:
+            await db.close()
+
+    # Create every user's tables up front so the first writes don't measure DDL
+    for index in range(min(users, concurrency)):
+        crud.insert_transactions.prepare(f"bench_{index}")
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, {}, elapsed)["total"]
+
+
+def run_in_subprocess(target: str, coalescing: bool, concurrency: int, args):
+    env = dict(os.environ, WRITE_COALESCING="1" if coalescing else "0")
+    if target == "live":
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            subprocess.run(
+                [
+                    sys.executable, os.path.join(HERE, "load_test.py"), "--target", "live",
+                    "--users", str(args.users), "--transactions", "10", "--mix", "create=6,update=3,delete=1",
+                    "--concurrency", str(concurrency), "--requests", str(args.requests), "--output", output.name,
+                ],
+                env=env, check=True, stdout=subprocess.DEVNULL,
+            )
+            return json.load(open(output.name))["total"]
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_group_commit_")
+    env["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+    # Per-request writes then run on their own connections and queue on SQLite's write lock
+    env["DB_MODE"] = "async"
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", "--concurrency", str(concurrency), "--requests", str(args.requests),
+         "--users", str(args.users)],
+        env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=("db", "live"), default="db")
+    parser.add_argument("--concurrency", default="1,16,128")
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(run_db_workload(int(args.concurrency), args.requests, args.users))))
+        return
+
+    print(f"target={args.target}, synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}, "
+          f"create:update:delete = 6:3:1")
+    print(f"{'clients':>7} {'mode':>13} {'writes/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        for coalescing in (False, True):
+            total = run_in_subprocess(args.target, coalescing, concurrency, args)
+            mode = "group commit" if coalescing else "per-request"
+            print(
+                f"{concurrency:>7} {mode:>13} {total['throughput_rps']:>9.0f} {total['p50_ms']:>8.2f} "
+                f"{total['p95_ms']:>8.2f} {total['p99_ms']:>8.2f} {total['errors']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Cost of ``Idempotency-Key`` on the insert path: a plain insert, an insert that claims
+a new key, and a replayed retry, with the key store pre-filled to different sizes:
+
+    python benchmarks/idempotency.py --keys 0,100000,1000000 --inserts 500
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_idempotency_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import SessionLocal  # noqa: E402
+from src import crud, idempotency  # noqa: E402
+
+FILL_CHUNK_SIZE = 50000
+
+
+def fill_keys(db, start: int, stop: int):
+    """Adds keys ``start..stop`` straight into the store, as if left by earlier creates."""
+    keys = idempotency.get_keys_table()
+    expires_at = int(time.time()) + idempotency.IDEMPOTENCY_KEY_TTL_SECONDS
+    response = json.dumps({"reference_no": "0" * 36})
+    for chunk in range(start, stop, FILL_CHUNK_SIZE):
+        db.execute(keys.insert(), [
+            {"username": "bench", "key": f"fill-{i:09d}", "fingerprint": "0" * 64, "response": response,
+             "expires_at": expires_at}
+            for i in range(chunk, min(chunk + FILL_CHUNK_SIZE, stop))
+        ])
+    db.commit()
+
+
+def timed_us(fn, count: int):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", default="0,100000,1000000", help="key store sizes to measure at")
+    parser.add_argument("--inserts", type=int, default=500)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    date = datetime.date(2024, 1, 1)
+    values = {"date": date, "details": "bench", "debit": 1.0, "credit": 0.0}
+    fingerprint = idempotency.fingerprint("/transactions/", values)
+    filled = 0
+    print(f"{'keys stored':>12} {'no key':>9} {'new key':>9} {'replay':>9}  (us p50)")
+    for size in sorted(int(size) for size in args.keys.split(",")):
+        fill_keys(db, filled, size)
+        filled = size
+
+        def plain(i):
+            crud.insert_transactions(db, "bench", [{"reference_no": f"plain-{size}-{i}", **values}])
+
+        def keyed(i):
+            reference_no = f"keyed-{size}-{i}"
+            crud.insert_transactions(db, "bench", [{"reference_no": reference_no, **values}],
+                                     f"key-{size}-{i}", fingerprint, {"reference_no": reference_no})
+
+        def replay(i):
+            crud.insert_transactions(db, "bench", [{"reference_no": f"replay-{size}-{i}", **values}],
+                                     f"key-{size}-{i}", fingerprint, {"reference_no": "unused"})
+
+        results = [timed_us(fn, args.inserts) for fn in (plain, keyed, replay)]
+        print(f"{size:>12} " + " ".join(f"{result:9.0f}" for result in results))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Reproducible load test: seeds users and transactions, then drives a mixed workload.
+
+The workload runs either in process through an ASGI client or over HTTP against a
+live uvicorn server (started here on throwaway SQLite files, or an existing one via
+``--url``). Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/load_test.py --users 20 --transactions 200 --concurrency 32 --requests 5000
+    python benchmarks/load_test.py --target live --concurrency 64 --output results.json
+    python benchmarks/load_test.py --target live --workers 4
+    python benchmarks/load_test.py --target live --url http://127.0.0.1:8001
+
+``--mix`` sets the relative weight of each operation, e.g. ``read=8,create=2,login=0``.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERATIONS = ("create", "read", "update", "delete", "list", "login")
+DEFAULT_MIX = "create=2,read=5,update=2,delete=1,list=1,login=0.1"
+SEED_CHUNK_SIZE = 500
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))] if samples else 0.0
+
+
+def parse_mix(text: str):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name!r} (expected one of {', '.join(OPERATIONS)})")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def random_row(rng: random.Random):
+    return {
+        "date": (datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(5 * 365))).isoformat(),
+        "details": rng.choice(("salary", "rent", "groceries", "fuel", "transfer")),
+        "debit": round(rng.uniform(0, 500), 2),
+        "credit": round(rng.uniform(0, 500), 2),
+    }
+
+
+class Workload:
+    """Shared state of a run: one token per user, and the user's reference numbers split
+    between the workers acting as that user so no two workers touch the same row."""
+
+    def __init__(self, client, users: int, transactions: int, weights: dict, seed: int):
+        self.client = client
+        self.users = [f"load_user_{i}" for i in range(users)]
+        self.transactions = transactions
+        self.operations = [name for name, weight in weights.items() if weight > 0]
+        self.weights = [weights[name] for name in self.operations]
+        self.rng = random.Random(seed)
+        self.tokens = {}
+        self.references = {}
+        self.latencies = {name: [] for name in self.operations}
+        self.errors = {name: 0 for name in self.operations}
+
+    async def login(self, user: str):
+        response = await self.client.post("/login/", json={"username": user, "password": user})
+        response.raise_for_status()
+        self.tokens[user] = response.json()["access_token"]
+
+    async def seed(self):
+        for user in self.users:
+            await self.client.post("/signup/", json={"username": user, "password": user})
+            await self.login(user)
+            references = self.references[user] = []
+            rows = [random_row(self.rng) for _ in range(self.transactions)]
+            for start in range(0, len(rows), SEED_CHUNK_SIZE):
+                response = await self.client.post(
+                    "/transactions/bulk", params={"token": self.tokens[user]}, json=rows[start:start + SEED_CHUNK_SIZE]
+                )
+                response.raise_for_status()
+                references.extend(response.json()["reference_nos"])
+
+    async def step(self, user: str, references: list):
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        params = {"token": self.tokens[user]}
+        if operation in ("read", "update", "delete") and not references:
+            operation = "create"
+
+        start = time.perf_counter()
+        if operation == "create":
+            response = await self.client.post("/transactions/", params=params, json=random_row(self.rng))
+            if response.status_code < 400:
+                references.append(response.json()["reference_no"])
+        elif operation == "read":
+            response = await self.client.get(f"/transactions/{self.rng.choice(references)}", params=params)
+        elif operation == "update":
+            url = f"/transactions/{self.rng.choice(references)}"
+            response = await self.client.put(url, params=params, json=random_row(self.rng))
+        elif operation == "delete":
+            reference_no = references.pop(self.rng.randrange(len(references)))
+            response = await self.client.delete(f"/transactions/{reference_no}", params=params)
+        elif operation == "list":
+            response = await self.client.get("/transactions/", params={**params, "limit": 50})
+        else:
+            response = await self.client.post("/login/", json={"username": user, "password": user})
+        elapsed = time.perf_counter() - start
+
+        self.latencies.setdefault(operation, []).append(elapsed)
+        if response.status_code >= 400:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    async def run(self, concurrency: int, total_requests: int, seconds: float):
+        issued = 0
+        deadline = time.perf_counter() + seconds if seconds else None
+
+        async def worker(index: int):
+            nonlocal issued
+            user = self.users[index % len(self.users)]
+            sharers = range(index % len(self.users), concurrency, len(self.users))
+            references = self.references[user][sharers.index(index)::len(sharers)]
+            while (deadline is None or time.perf_counter() < deadline) and (total_requests is None or issued < total_requests):
+                issued += 1
+                await self.step(user, references)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def summarize(latencies, errors, elapsed):
+    def stats(samples, error_count):
+        return {
+            "requests": len(samples),
+            "errors": error_count,
+            "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+
+    every_sample = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "total": stats(every_sample, sum(errors.values())),
+        "operations": {name: stats(samples, errors.get(name, 0)) for name, samples in latencies.items() if samples},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, env: dict, workers: int = 1):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "src.serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                raise SystemExit("uvicorn exited before accepting connections")
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit("uvicorn did not start within 30s")
+
+
+def throwaway_env():
+    tmp_dir = tempfile.mkdtemp(prefix="bench_load_")
+    return {
+        "DATABASE_URL": f"sqlite:///{tmp_dir}/transactions.db",
+        "AUTH_DATABASE_URL": f"sqlite:///{tmp_dir}/auth.db",
+    }
+
+
+async def run_benchmark(args, base_url: str = None):
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if base_url is None:
+        from fast_api import app
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+    else:
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60)
+
+    async with client:
+        workload = Workload(client, args.users, args.transactions, parse_mix(args.mix), args.seed)
+        seed_start = time.perf_counter()
+        await workload.seed()
+        seed_seconds = time.perf_counter() - seed_start
+        elapsed = await workload.run(args.concurrency, args.requests, args.seconds)
+
+    return {
+        "seed_seconds": seed_seconds,
+        "elapsed_seconds": elapsed,
+        **summarize(workload.latencies, workload.errors, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("asgi", "live"), default="asgi")
+    parser.add_argument("--url", help="existing server to load instead of starting one (live target only)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the server started here")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--transactions", type=int, default=100, help="transactions seeded per user")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="total requests (ignored with --seconds)")
+    parser.add_argument("--seconds", type=float, help="run for a fixed time instead of a request count")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.seconds:
+        args.requests = None
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    env_settings = {} if args.url else throwaway_env()
+    server = None
+    if args.target == "asgi":
+        os.environ.update(env_settings)
+        sys.path.insert(0, ROOT)
+        results = asyncio.run(run_benchmark(args))
+    else:
+        base_url = args.url
+        if base_url is None:
+            port = free_port()
+            server = start_server(port, dict(os.environ, **env_settings), args.workers)
+            base_url = f"http://127.0.0.1:{port}"
+        try:
+            results = asyncio.run(run_benchmark(args, base_url))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": config,
+        "settings": {
+            name: os.environ.get(name)
+            for name in (
+                "DB_MODE", "STORAGE_MODE", "SQLITE_PROFILE", "SQLITE_SYNCHRONOUS", "PASSWORD_HASH_WORKERS",
+                "METRICS_ENABLED", "WRITE_COALESCING", "WRITE_BATCH_MAX_ROWS", "WRITE_BATCH_MAX_MS",
+            )
+            if os.environ.get(name) is not None
+        },
+        **results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Measures transaction-read latency while logins are hammered.
+
+Each mode runs in its own process against throwaway SQLite files, first with bcrypt
+hashed inline on the event loop (PASSWORD_HASH_WORKERS=0) and then on the worker pool:
+
+    python benchmarks/login_load.py --logins 8 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))] if samples else 0.0
+
+
+async def run_load(logins: int, seconds: float):
+    import httpx
+    from fast_api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/signup/", json={"username": "bench", "password": "bench"})
+        response = await client.post("/login/", json={"username": "bench", "password": "bench"})
+        params = {"token": response.json()["access_token"]}
+        response = await client.post("/transactions/", params=params, json={"date": "2024-01-01", "debit": 1})
+        url = f"/transactions/{response.json()['reference_no']}"
+
+        async def reader(deadline, latencies):
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(url, params=params)
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.005)
+
+        async def login_loop(deadline, outcomes):
+            while time.perf_counter() < deadline:
+                response = await client.post("/login/", json={"username": "bench", "password": "bench"})
+                outcomes.append(response.status_code)
+
+        idle = []
+        await reader(time.perf_counter() + seconds / 2, idle)
+
+        loaded, outcomes = [], []
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(reader(deadline, loaded), *(login_loop(deadline, outcomes) for _ in range(logins)))
+
+    return {
+        "idle_p50_ms": statistics.median(idle),
+        "idle_p99_ms": percentile(idle, 99),
+        "loaded_p50_ms": statistics.median(loaded),
+        "loaded_p99_ms": percentile(loaded, 99),
+        "logins_ok": outcomes.count(200),
+        "logins_rejected": outcomes.count(503),
+    }
+
+
+def run_mode(workers: int, args):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_login_")
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        PASSWORD_HASH_WORKERS=str(workers),
+        DATABASE_URL=f"sqlite:///{tmp_dir}/transactions.db",
+        AUTH_DATABASE_URL=f"sqlite:///{tmp_dir}/auth.db",
+    )
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", "--logins", str(args.logins), "--seconds", str(args.seconds)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=8, help="Concurrent login loops")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=2, help="Hash pool size for the pooled run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_load(args.logins, args.seconds))))
+        return
+
+    for label, workers in [("inline bcrypt", 0), (f"pool of {args.workers}", args.workers)]:
+        result = run_mode(workers, args)
+        print(
+            f"{label:>14}: read p50 {result['idle_p50_ms']:.1f} -> {result['loaded_p50_ms']:.1f} ms, "
+            f"p99 {result['idle_p99_ms']:.1f} -> {result['loaded_p99_ms']:.1f} ms under load; "
+            f"logins ok={result['logins_ok']} rejected={result['logins_rejected']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
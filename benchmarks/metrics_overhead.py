@@ -0,0 +1,83 @@
+"""Cost of the metrics middleware and stage timers on a sequential CRUD loop.
+
+Runs the same create/read/update/delete cycle with METRICS_ENABLED=0 and =1, each
+in its own process against throwaway SQLite files, and reports per-request latency:
+
+    python benchmarks/metrics_overhead.py --cycles 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_crud(cycles: int):
+    import httpx
+    from fast_api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/signup/", json={"username": "bench", "password": "bench"})
+        response = await client.post("/login/", json={"username": "bench", "password": "bench"})
+        params = {"token": response.json()["access_token"]}
+
+        latencies = []
+        for i in range(cycles):
+            start = time.perf_counter()
+            response = await client.post("/transactions/", params=params, json={"date": "2024-01-01", "debit": i})
+            url = f"/transactions/{response.json()['reference_no']}"
+            await client.get(url, params=params)
+            await client.put(url, params=params, json={"date": "2024-01-02", "details": "bench", "debit": i})
+            await client.delete(url, params=params)
+            latencies.append((time.perf_counter() - start) / 4 * 1e6)
+
+        scrape = (await client.get("/metrics")).text
+
+    return {
+        "p50_us": statistics.median(latencies),
+        "mean_us": statistics.mean(latencies),
+        "series": sum(1 for line in scrape.splitlines() if line and not line.startswith("#")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cycles", type=int, default=500)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_crud(args.cycles))))
+        return
+
+    results = {}
+    for enabled in ("0", "1"):
+        tmp_dir = tempfile.mkdtemp(prefix="bench_metrics_")
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            METRICS_ENABLED=enabled,
+            DATABASE_URL=f"sqlite:///{tmp_dir}/transactions.db",
+            AUTH_DATABASE_URL=f"sqlite:///{tmp_dir}/auth.db",
+        )
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--cycles", str(args.cycles)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results[enabled] = result = json.loads(output.strip().splitlines()[-1])
+        label = "metrics on" if enabled == "1" else "metrics off"
+        print(f"{label:>11}: p50 {result['p50_us']:7.0f} us  mean {result['mean_us']:7.0f} us per request")
+
+    overhead = results["1"]["p50_us"] - results["0"]["p50_us"]
+    print(f"   overhead: {overhead:+.0f} us per request ({overhead / results['0']['p50_us']:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
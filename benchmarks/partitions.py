@@ -0,0 +1,107 @@
+"""Latency of the read and write paths for a tenant with many years of history, with
+every year in the hot table and with the closed years archived (``src.archive``):
+
+    python benchmarks/partitions.py --years 20 --rows-per-year 5000 --runs 200
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_partitions_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import archive, balance, crud, listing, rollup, search  # noqa: E402
+from src.database import DatabaseManager, get_shard  # noqa: E402
+
+USER = "bench"
+new_reference_nos = (f"new-{i}" for i in itertools.count())
+
+
+def timed_us(fn, runs: int):
+    latencies = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def seed(years: int, rows_per_year: int):
+    db = get_shard(USER).SessionLocal()
+    this_year = datetime.date.today().year
+    words = ["rent", "groceries", "salary", "coffee", "fuel", "insurance"]
+    rows = []
+    for year in range(this_year - years + 1, this_year + 1):
+        for _ in range(rows_per_year):
+            rows.append({
+                "reference_no": f"{year}-{len(rows)}", "date": datetime.date(year, random.randint(1, 12), random.randint(1, 28)),
+                "details": random.choice(words), "debit": random.randint(0, 100), "credit": random.randint(0, 100),
+            })
+    try:
+        crud.insert_transactions(db, USER, rows)
+    finally:
+        db.close()
+
+
+def measure(runs: int):
+    user_table = DatabaseManager.get_table(USER)
+    checkpoint_table = balance.get_checkpoint_table(USER)
+    search_table = search.get_search_table(USER)
+    db = user_table.shard.SessionLocal()
+    this_year = datetime.date.today().year
+    recent_from = datetime.date(this_year, 1, 1)
+    recent = listing.build_listing_query(user_table, recent_from)
+    everything = listing.build_listing_query(user_table)
+
+    def insert(i):
+        crud.insert_transactions(db, USER, [{
+            "reference_no": next(new_reference_nos), "date": datetime.date(this_year, 1, 1 + i % 28),
+            "details": "rent", "debit": 1.0, "credit": 0.0,
+        }])
+
+    try:
+        return {
+            "list this year": timed_us(lambda i: listing.fetch_page(db, user_table, recent, None, 100, recent_from), runs),
+            "list all, 1st page": timed_us(lambda i: listing.fetch_page(db, user_table, everything, None, 100), runs),
+            "balance today": timed_us(
+                lambda i: balance.balance_as_of(db, user_table, checkpoint_table, datetime.date.today()), runs
+            ),
+            "search": timed_us(lambda i: search.search(db, user_table, search_table, "coffee", None, 20), runs),
+            "insert": timed_us(insert, runs),
+        }
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--rows-per-year", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(1)
+    seed(args.years, args.rows_per_year)
+    rollup.get_rollup_table(USER)
+    hot = measure(args.runs)
+    start = time.perf_counter()
+    moved = archive.compact([USER])[USER]
+    print(f"compact: {sum(moved.values())} rows in {len(moved)} years, {time.perf_counter() - start:.1f} s")
+    archived = measure(args.runs)
+
+    print(f"\n{'':>20} {'all hot p50/p99 us':>20} {'archived p50/p99 us':>20}  "
+          f"({args.years} years x {args.rows_per_year} rows)")
+    for label in hot:
+        print(f"{label:>20} {hot[label][0]:>10.0f}/{hot[label][1]:<9.0f} {archived[label][0]:>10.0f}/{archived[label][1]:<9.0f}")
+
+
+if __name__ == "__main__":
+    main()
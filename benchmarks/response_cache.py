@@ -0,0 +1,74 @@
+"""Latency of ``GET /transactions/{reference_no}`` through the app: with the response
+cache off, served from the cache, and answered 304 for a matching ``If-None-Match``:
+
+    python benchmarks/response_cache.py --rows 200 --reads 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_response_cache_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{tmp_dir}/auth.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from fast_api import app  # noqa: E402
+from src.response_cache import response_cache  # noqa: E402
+
+
+def timed_us(fn, count: int):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200, help="rows read round-robin")
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    with TestClient(app) as client:
+        client.post("/signup/", json={"username": "bench", "password": "bench"})
+        token = client.post("/login/", json={"username": "bench", "password": "bench"}).json()["access_token"]
+        params = {"token": token}
+        rows = [{"date": f"2024-01-{i % 28 + 1:02d}", "details": f"row {i}", "debit": i} for i in range(args.rows)]
+        reference_nos = client.post("/transactions/bulk", params=params, json=rows).json()["reference_nos"]
+        etags = {}
+
+        def read(i):
+            reference_no = reference_nos[i % len(reference_nos)]
+            response = client.get(f"/transactions/{reference_no}", params=params)
+            etags[reference_no] = response.headers["etag"]
+
+        def conditional(i):
+            reference_no = reference_nos[i % len(reference_nos)]
+            response = client.get(f"/transactions/{reference_no}", params=params,
+                                  headers={"If-None-Match": etags[reference_no]})
+            assert response.status_code == 304
+
+        maxsize = response_cache.maxsize
+        response_cache.maxsize = 0
+        uncached = timed_us(read, args.reads)
+        response_cache.maxsize = maxsize
+        for i in range(len(reference_nos)):
+            read(i)
+        cached = timed_us(read, args.reads)
+        not_modified = timed_us(conditional, args.reads)
+
+    print(f"{'':>14} {'p50 us':>8} {'p99 us':>8}  ({args.reads} reads over {args.rows} rows)")
+    for label, (p50, p99) in (("cache off", uncached), ("cache hit", cached), ("304", not_modified)):
+        print(f"{label:>14} {p50:>8.0f} {p99:>8.0f}")
+    print(response_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Search latency as history grows: FTS5 index versus a LIKE '%term%' scan.
+
+History grows in steps; at each size the same rare term (a fixed number of
+matching rows) is searched for, through the index (first page) and by scanning
+for every match:
+
+    python benchmarks/search.py --steps 4 --rows-per-step 100000
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_search_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import DatabaseManager, SessionLocal  # noqa: E402
+from src import crud, listing, search  # noqa: E402
+
+WORDS = ["salary", "rent", "groceries", "fuel", "transfer", "insurance", "coffee", "books", "pharmacy", "taxi"]
+RARE_MATCHES = 50
+
+
+def timed_us(fn, repeat=30):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--rows-per-step", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    db = SessionLocal()
+    for step in range(args.steps):
+        base = step * args.rows_per_step
+        rows = [
+            {"reference_no": f"ref-{i:09d}", "date": datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+             "details": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i % 997}", "debit": 1.0, "credit": 0.0}
+            for i in range(base, base + args.rows_per_step)
+        ]
+        if step == 0:
+            for row in rows[:RARE_MATCHES]:
+                row["details"] = "zanzibar holiday"
+        crud.insert_transactions(db, "bench", rows)
+
+        user_table = DatabaseManager.get_table("bench")
+        search_table = search.get_search_table("bench")
+        fts = timed_us(lambda: search.search(db, user_table, search_table, "zanzibar", None, 20))
+        like = timed_us(
+            lambda: db.execute(listing.build_listing_query(user_table).where(
+                user_table.c.details.like("%zanzibar%"))).fetchall(),
+            repeat=5,
+        )
+        print(f"{base + args.rows_per_step:>9} rows: fts5 {fts:8.0f} us p50   LIKE scan {like:10.0f} us p50")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
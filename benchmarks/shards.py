@@ -0,0 +1,94 @@
+"""Write throughput with tenants spread over one or several shard files.
+
+Every client writes for its own tenant, from asyncio clients in process (on DB_MODE=async
+sessions), so writers of different shards take different SQLite write locks:
+
+    python benchmarks/shards.py --shards 1,4 --concurrency 16,64 --requests 4000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from load_test import summarize  # noqa: E402
+
+
+async def run_db_workload(concurrency: int, total_requests: int):
+    """Inserts from ``concurrency`` clients, one tenant each."""
+    from src import crud, group_commit
+    from src.database import get_shard
+
+    latencies = {"create": []}
+    issued = 0
+
+    async def client(index: int):
+        nonlocal issued
+        user_name = f"bench_{index}"
+        db = get_shard(user_name).AsyncSessionLocal()
+        try:
+            while issued < total_requests:
+                issued += 1
+                start = time.perf_counter()
+                await group_commit.write(db, crud.insert_transactions, user_name, [{
+                    "reference_no": str(issued), "date": datetime.date(2024, 1, 1 + issued % 28),
+                    "details": "bench", "debit": 1.0, "credit": 0.0,
+                }])
+                latencies["create"].append(time.perf_counter() - start)
+        finally:
+            await db.close()
+
+    for index in range(concurrency):
+        crud.insert_transactions.prepare(f"bench_{index}")
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, {}, elapsed)["total"]
+
+
+def run_in_subprocess(shard_count: int, concurrency: int, args):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_shards_")
+    env = dict(os.environ, DB_SHARDS=str(shard_count), DB_MODE="async",
+               DATABASE_URL=f"sqlite:///{tmp_dir}/transactions.db")
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", "--concurrency", str(concurrency), "--requests", str(args.requests)],
+        env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", default="1,4")
+    parser.add_argument("--concurrency", default="16,64")
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(run_db_workload(int(args.concurrency), args.requests))))
+        return
+
+    print(f"synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}, "
+          f"WRITE_COALESCING={os.environ.get('WRITE_COALESCING', '0')}, one tenant per client")
+    print(f"{'clients':>7} {'shards':>6} {'writes/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        for shard_count in (int(count) for count in args.shards.split(",")):
+            total = run_in_subprocess(shard_count, concurrency, args)
+            print(
+                f"{concurrency:>7} {shard_count:>6} {total['throughput_rps']:>9.0f} {total['p50_ms']:>8.2f} "
+                f"{total['p95_ms']:>8.2f} {total['p99_ms']:>8.2f} {total['errors']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
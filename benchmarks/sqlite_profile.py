@@ -0,0 +1,104 @@
+"""Mixed read/write concurrency benchmark for the stock and tuned SQLite profiles.
+
+Writer threads insert-and-commit single rows while reader threads run date-range
+queries, each against a fresh throwaway database per profile:
+
+    python benchmarks/sqlite_profile.py --writers 4 --readers 8 --seconds 5
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from src.database import DatabaseManager, create_sqlite_engine  # noqa: E402
+
+
+def run_profile(profile: str, writers: int, readers: int, seconds: float, seed_rows: int):
+    tmp_dir = tempfile.mkdtemp(prefix=f"bench_sqlite_{profile}_")
+    bench_engine = create_sqlite_engine(f"sqlite:///{tmp_dir}/transactions.db", profile=profile)
+    table = DatabaseManager.get_user_transactions_table(f"bench_{profile}")
+    table.create(bench_engine)
+
+    def row(i):
+        return {
+            "reference_no": str(uuid.uuid4()),
+            "date": datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+            "details": f"item-{i % 20}",
+            "debit": float(i % 100),
+            "credit": 0.0,
+        }
+
+    with bench_engine.begin() as conn:
+        conn.execute(table.insert(), [row(i) for i in range(seed_rows)])
+
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def writer(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            try:
+                with bench_engine.begin() as conn:
+                    conn.execute(table.insert().values(**row(i)))
+                key = "writes"
+            except OperationalError:
+                key = "errors"
+            with lock:
+                counts[key] += 1
+            i += writers
+
+    def reader(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1400)
+            query = select(func.sum(table.c.debit)).where(
+                table.c.date >= start, table.c.date < start + datetime.timedelta(days=30)
+            )
+            try:
+                with bench_engine.connect() as conn:
+                    conn.execute(query).scalar()
+                key = "reads"
+            except OperationalError:
+                key = "errors"
+            with lock:
+                counts[key] += 1
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n * 97,)) for n in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    bench_engine.dispose()
+
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--seed-rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    for profile in ("default", "tuned"):
+        result = run_profile(profile, args.writers, args.readers, args.seconds, args.seed_rows)
+        print(
+            f"{profile:>8}: {result['writes']:8.0f} writes/s {result['reads']:8.0f} reads/s "
+            f"{result['errors']:6.1f} lock errors/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
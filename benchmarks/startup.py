@@ -0,0 +1,117 @@
+"""Cold start and worker scaling of the API server.
+
+* import: time to ``import fast_api`` in a fresh interpreter;
+* first request: a server is started on a pre-seeded database, once with the startup
+  work disabled (DB_POOL_PREWARM=0, TABLE_PRELOAD_LIMIT=0) and once with it; reported
+  are the time until it answers, a user's first request and a repeated one;
+* scaling: ``load_test.py --target live`` throughput for each ``--workers`` count.
+
+    python benchmarks/startup.py --workers 1,2,4 --requests 3000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+from load_test import free_port, start_server, throwaway_env  # noqa: E402
+
+SEED_SCRIPT = """
+import sys
+from fastapi.testclient import TestClient
+from fast_api import app
+with TestClient(app) as client:
+    for index in range(int(sys.argv[1])):
+        user = f"user_{index}"
+        client.post("/signup/", json={"username": user, "password": "pw"})
+        token = client.post("/login/", json={"username": user, "password": "pw"}).json()["access_token"]
+        rows = [{"date": f"2024-01-{day % 28 + 1:02d}", "details": "seed", "debit": day} for day in range(int(sys.argv[2]))]
+        client.post("/transactions/bulk", params={"token": token}, json=rows)
+"""
+
+
+def measure_import(env: dict, runs: int):
+    script = "import time; start = time.perf_counter(); import fast_api; print(time.perf_counter() - start)"
+    samples = [
+        float(subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True,
+                             check=True).stdout)
+        for _ in range(runs)
+    ]
+    return statistics.median(samples) * 1000
+
+
+def measure_first_requests(env: dict, users: int):
+    """Starts a server; returns ms until it answers, then a user's first and repeated request."""
+    import httpx
+    from src.auth import create_access_token
+
+    port = free_port()
+    start = time.perf_counter()
+    server = start_server(port, env)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            client.get("/metrics")
+            ready = time.perf_counter() - start
+            token = create_access_token({"sub": f"user_{users - 1}"})
+
+            def timed():
+                request_start = time.perf_counter()
+                client.get("/transactions/", params={"token": token, "limit": 50}).raise_for_status()
+                return (time.perf_counter() - request_start) * 1000
+
+            first, repeated = timed(), timed()
+    finally:
+        server.terminate()
+        server.wait()
+    return ready * 1000, first, repeated
+
+
+def measure_scaling(workers: int, args):
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, "load_test.py"), "--target", "live", "--workers", str(workers),
+             "--concurrency", str(args.concurrency), "--requests", str(args.requests), "--output", output.name],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        return json.load(open(output.name))["total"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200, help="users seeded before the first-request runs")
+    parser.add_argument("--transactions", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+
+    env = dict(os.environ, **throwaway_env())
+    os.environ.update(env)
+    print(f"import fast_api: {measure_import(env, args.runs):.0f} ms (median of {args.runs})")
+
+    subprocess.run([sys.executable, "-c", SEED_SCRIPT, str(args.users), str(args.transactions)],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    print(f"\n{'startup work':>12} {'ready ms':>9} {'first ms':>9} {'repeat ms':>9}  ({args.users} users)")
+    for label, settings in (("off", {"DB_POOL_PREWARM": "0", "TABLE_PRELOAD_LIMIT": "0"}), ("on", {})):
+        samples = [measure_first_requests(dict(env, **settings), args.users) for _ in range(args.runs)]
+        ready, first, repeated = (statistics.median(column) for column in zip(*samples))
+        print(f"{label:>12} {ready:>9.0f} {first:>9.2f} {repeated:>9.2f}")
+
+    print(f"\n{'workers':>7} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}  (os.cpu_count()={os.cpu_count()})")
+    for workers in (int(count) for count in args.workers.split(",")):
+        total = measure_scaling(workers, args)
+        print(f"{workers:>7} {total['throughput_rps']:>7.0f} {total['p50_ms']:>8.2f} {total['p99_ms']:>8.2f} "
+              f"{total['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Per-operation latency of update/delete: check-then-write versus a single statement.
+
+"before" replays the old handlers' SELECT followed by UPDATE/DELETE, "after" runs
+the single-statement ``crud`` functions, both on throwaway SQLite files:
+
+    python benchmarks/update_delete.py --ops 2000
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+tmp_dir = tempfile.mkdtemp(prefix="bench_update_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import DatabaseManager, SessionLocal  # noqa: E402
+from src import crud  # noqa: E402
+
+
+def legacy_update(db, user_name, reference_no, values):
+    user_table = DatabaseManager.get_table(user_name)
+    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
+    if db.execute(select_stmt).fetchone() is None:
+        raise LookupError(reference_no)
+    db.execute(user_table.update().where(user_table.c.reference_no == reference_no).values(**values))
+    db.commit()
+
+
+def legacy_delete(db, user_name, reference_no):
+    user_table = DatabaseManager.get_table(user_name)
+    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
+    if db.execute(select_stmt).fetchone() is None:
+        raise LookupError(reference_no)
+    db.execute(user_table.delete().where(user_table.c.reference_no == reference_no))
+    db.commit()
+
+
+def seed(db, user_name, n):
+    rows = [
+        {"reference_no": f"{user_name}-{i}", "date": datetime.date(2024, 1 + i % 12, 1), "details": "seed",
+         "debit": float(i), "credit": 0.0}
+        for i in range(n)
+    ]
+    crud.insert_transactions(db, user_name, rows)
+    return [row["reference_no"] for row in rows]
+
+
+def timed(fn, references, *args):
+    latencies = []
+    for i, reference_no in enumerate(references):
+        start = time.perf_counter()
+        fn(reference_no, i, *args)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(latencies), statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    results = {}
+    for label, update, delete in [
+        ("before", legacy_update, legacy_delete),
+        ("after", crud.update_transaction, crud.delete_transaction),
+    ]:
+        user_name = f"bench_{label}"
+        references = seed(db, user_name, args.ops)
+        results[(label, "update")] = timed(
+            lambda ref, i: update(db, user_name, ref, {"debit": float(i), "details": "updated"}), references
+        )
+        results[(label, "delete")] = timed(lambda ref, i: delete(db, user_name, ref), references)
+    db.close()
+
+    for operation in ("update", "delete"):
+        for label in ("before", "after"):
+            p50, mean = results[(label, operation)]
+            print(f"{operation:>6} {label:>6}: p50 {p50:7.1f} us  mean {mean:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 import dash
-import sqlite3
 import pandas as pd
+import pyarrow as pa
 import requests
 import calendar
+import threading
+from collections import OrderedDict
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 
-# Database Path
-db_path = r'C:\Users\A200204476\sqlite3\fastApiProject\pythonProject\databases\transactions_info.db'
-LOGIN_URL = "http://127.0.0.1:8001/login/"
+API_URL = "http://127.0.0.1:8001"
+LOGIN_URL = f"{API_URL}/login/"
 
 # Authenticate User
 def authenticate_user(username, password):
@@ -18,22 +19,59 @@ def authenticate_user(username, password):
         return response.json().get("access_token")
     return None
 
-# Fetch User-Specific Tables
-def get_user_tables(db_path, username):
-    conn = sqlite3.connect(db_path)
-    tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)['name'].tolist()
-    conn.close()
-    return [table for table in tables if username in table]
-
-# Fetch Data from Table
-def fetch_data(db_path, table_name):
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-    conn.close()
-    df.columns = [col.lower() for col in df.columns]
-    if 'date' in df.columns:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-    return df
+# Fetch User-Specific Tables from the API, whatever shard or storage mode holds them
+def get_user_tables(token, username):
+    response = requests.get(f"{API_URL}/transactions/summary/years", params={"token": token})
+    if response.status_code != 200 or not response.json():
+        return []
+    return [f"{username}_transactions"]
+
+# Fetch Pre-Aggregated Summary from the API
+def fetch_summary(kind, token, **params):
+    response = requests.get(f"{API_URL}/transactions/summary/{kind}", params={"token": token, **params})
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return pd.DataFrame(response.json())
+
+# Fetch Month-End Running Balances from the API
+def fetch_monthly_balances(token, year=None):
+    params = {"date_from": f"{year}-01-01", "date_to": f"{year}-12-31"} if year else {}
+    response = requests.get(f"{API_URL}/transactions/balance/monthly", params={"token": token, **params})
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return pd.DataFrame(response.json())
+
+# Fetch Raw Transactions from the API's Arrow IPC export (columnar, no per-row parsing)
+def fetch_data(token, **params):
+    response = requests.get(f"{API_URL}/transactions/export", params={"token": token, "format": "arrow", **params})
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return pa.ipc.open_stream(response.content).read_all().to_pandas()
+
+# Figure Cache keyed by (table, year, column), valid while the user's data version is unchanged
+FIGURE_CACHE_SIZE = 128
+figure_cache = OrderedDict()
+figure_cache_lock = threading.Lock()
+
+def fetch_data_version(token):
+    response = requests.get(f"{API_URL}/transactions/version", params={"token": token})
+    return response.json()["version"] if response.status_code == 200 else None
+
+def cached_figures(key, version, build):
+    with figure_cache_lock:
+        entry = figure_cache.get(key)
+        if version is not None and entry is not None and entry[0] == version:
+            figure_cache.move_to_end(key)
+            return entry[1]
+
+    figures = build()
+    if version is not None:
+        with figure_cache_lock:
+            figure_cache[key] = (version, figures)
+            figure_cache.move_to_end(key)
+            while len(figure_cache) > FIGURE_CACHE_SIZE:
+                figure_cache.popitem(last=False)
+    return figures
 
 # Initialize Dash App
 app = dash.Dash(__name__)
@@ -54,7 +92,8 @@ app.layout = html.Div([
 
     html.Div(id="dashboard-content", style={"display": "none"}, children=[
         html.Button('Refresh Data', id='refresh-button', n_clicks=0),
-        dcc.Interval(id='interval-component', interval=5000, n_intervals=0),
+        dcc.Store(id='change-feed'),  # Latest change event pushed by the API
+        dcc.Store(id='change-feed-connection'),
 
         html.Label("Select Table:"),
         dcc.Dropdown(id='table-selector', options=[], value=None, clearable=False),
@@ -83,6 +122,30 @@ app.layout = html.Div([
     ])
 ])
 
+# Change Feed: the browser subscribes to the API's Server-Sent Events and each event
+# lands in the change-feed store, which re-renders the charts
+app.clientside_callback(
+    """
+    function(token) {
+        if (window.changeFeedSource) {
+            window.changeFeedSource.close();
+            window.changeFeedSource = null;
+        }
+        if (!token) {
+            return null;
+        }
+        const source = new EventSource("API_URL/transactions/events?token=" + encodeURIComponent(token));
+        source.onmessage = function(event) {
+            dash_clientside.set_props("change-feed", {data: {id: event.lastEventId, change: JSON.parse(event.data)}});
+        };
+        window.changeFeedSource = source;
+        return null;
+    }
+    """.replace("API_URL", API_URL),
+    Output("change-feed-connection", "data"),
+    Input("auth-token", "data")
+)
+
 # Login Callback
 @app.callback(
     [Output("logged-in-user", "data"), Output("auth-token", "data"), Output("login-status", "children"), Output("dashboard-content", "style")],
@@ -96,33 +159,64 @@ def login(n_clicks, username, password):
             return username, token, "Login Successful", {"display": "block"}
     return None, None, "Invalid Credentials", {"display": "none"}
 
+# Update Table Dropdown
+@app.callback(Output('table-selector', 'options'), Input('auth-token', 'data'), State('logged-in-user', 'data'))
+def update_table_selector(token, username):
+    if not username or not token:
+        return []
+    return [{'label': table, 'value': table} for table in get_user_tables(token, username)]
+
+# Update Year Filter
+@app.callback(
+    [Output('year-filter', 'options'), Output('year-filter', 'value')],
+    [Input('table-selector', 'value')],
+    [State("auth-token", "data")]
+)
+def update_year_filter(selected_table, token):
+    if not selected_table or not token:
+        return [], None
+    response = requests.get(f"{API_URL}/transactions/summary/years", params={"token": token})
+    years = response.json() if response.status_code == 200 else []
+    return [{'label': str(year), 'value': year} for year in years], years[-1] if years else None
+
 # Update Charts
 @app.callback(
     [Output('bar-chart', 'figure'), Output('pie-chart', 'figure'), Output('income-expense-chart', 'figure'), Output('box-plot', 'figure')],
     [Input('table-selector', 'value'), Input('dropdown-column', 'value'), Input('year-filter', 'value'),
-     Input('refresh-button', 'n_clicks'), Input('interval-component', 'n_intervals')],
+     Input('refresh-button', 'n_clicks'), Input('change-feed', 'data')],
     [State("logged-in-user", "data"), State("auth-token", "data")]
 )
-def update_charts(selected_table, selected_column, selected_year, n_clicks, n_intervals, username, token):
+def update_charts(selected_table, selected_column, selected_year, n_clicks, change, username, token):
     if not username or not token or not selected_table:
         return px.bar(title="Please Log In"), px.pie(title="Please Log In"), px.bar(title="Please Log In"), px.box(title="Please Log In")
 
-    data = fetch_data(db_path, selected_table)
-    if data.empty or 'date' not in data.columns:
-        return px.bar(title="No Data Available"), px.pie(title="No Data Available"), px.bar(title="No Data Available"), px.box(title="No Data Available")
-
-    data['year'] = data['date'].dt.year
-    data['month'] = data['date'].dt.month
-    data['month_name'] = data['month'].apply(lambda x: calendar.month_abbr[x])
+    return cached_figures(
+        (selected_table, selected_year, selected_column),
+        fetch_data_version(token),
+        lambda: build_charts(selected_column, selected_year, token),
+    )
 
-    filtered_data = data[data['year'] == selected_year] if selected_year else data
+def build_charts(selected_column, selected_year, token):
+    filtered_data = fetch_summary("monthly", token, **({"year": selected_year} if selected_year else {}))
     if filtered_data.empty:
         return px.bar(title="No Data Available"), px.pie(title="No Data Available"), px.bar(title="No Data Available"), px.box(title="No Data Available")
 
-    bar_fig = px.bar(filtered_data, x='month_name', y=selected_column, color='details', text_auto=True)
+    filtered_data['month_name'] = filtered_data['month'].apply(lambda x: calendar.month_abbr[x])
+
+    if selected_column == 'balance':
+        balances = fetch_monthly_balances(token, selected_year)
+        balances['month_name'] = balances['month'].apply(lambda x: calendar.month_abbr[x])
+        bar_fig = px.line(balances, x='month_name', y='balance', markers=True)
+        selected_column = 'debit'
+    else:
+        bar_fig = px.bar(filtered_data, x='month_name', y=selected_column, color='details', text_auto=True)
     pie_fig = px.pie(filtered_data, values=selected_column, names='details', hole=0.3)
-    income_expense_fig = px.bar(filtered_data, x='year', y=selected_column, color='details', barmode='group', text_auto=True)
-    box_fig = px.box(filtered_data, y=selected_column)
+    yearly_data = filtered_data.groupby(['year', 'details'])[selected_column].sum().reset_index()
+    income_expense_fig = px.bar(yearly_data, x='year', y=selected_column, color='details', barmode='group', text_auto=True)
+
+    year_bounds = {"date_from": f"{selected_year}-01-01", "date_to": f"{selected_year}-12-31"} if selected_year else {}
+    transactions = fetch_data(token, **year_bounds)
+    box_fig = px.box(transactions, y=selected_column) if not transactions.empty else px.box(title="No Data Available")
 
     return bar_fig, pie_fig, income_expense_fig, box_fig
 
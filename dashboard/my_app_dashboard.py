@@ -1,27 +1,23 @@
 import dash
-import sqlite3
 import pandas as pd
 import requests
 import calendar
+import threading
+from collections import OrderedDict
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 
-# db_path = r'sqlite:///databases/transactions_info.db'
-db_path = r'C:\Users\A200204476\sqlite3\fastApiProject\pythonProject\databases\transactions_info.db'
+API_URL = "http://127.0.0.1:8001"
+LOGIN_URL = f"{API_URL}/login/"
 
-LOGIN_URL = "http://127.0.0.1:8001/login/"
-
-# Function to get user-specific table names
-def get_user_tables(db_path, username):
-    conn = sqlite3.connect(db_path)
-    query = "SELECT name FROM sqlite_master WHERE type='table';"
-    tables = pd.read_sql_query(query, conn)['name'].tolist()
-    conn.close()
-
-    # Assuming tables are named like "username_transactions", filter by user
-    user_tables = [table for table in tables if username in table]
-    return user_tables
+# Function to get user-specific table names from the API, which finds the user's data
+# whatever shard or storage mode holds it
+def get_user_tables(token, username):
+    response = requests.get(f"{API_URL}/transactions/summary/years", params={"token": token})
+    if response.status_code != 200 or not response.json():
+        return []
+    return [f"{username}_transactions"]
 
 # Function to authenticate user and retrieve token
 def authenticate_user(username, password):
@@ -30,19 +26,47 @@ def authenticate_user(username, password):
         return response.json().get("access_token")  # Extract token
     return None
 
-# Function to fetch data for a specific table (no user column filter)
-def fetch_data(db_path, table_name):
-    conn = sqlite3.connect(db_path)
-    query = f"SELECT * FROM {table_name}"  # Get all data from table (no user filtering)
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    df.columns = [col.lower() for col in df.columns]  # Normalize column names
-
-    if 'date' in df.columns:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-
-    return df
+# Function to fetch a pre-aggregated summary for the logged-in user from the API
+def fetch_summary(kind, token, **params):
+    response = requests.get(f"{API_URL}/transactions/summary/{kind}", params={"token": token, **params})
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return pd.DataFrame(response.json())
+
+# Function to fetch month-end running balances for the logged-in user from the API
+def fetch_monthly_balances(token, year=None):
+    params = {"date_from": f"{year}-01-01", "date_to": f"{year}-12-31"} if year else {}
+    response = requests.get(f"{API_URL}/transactions/balance/monthly", params={"token": token, **params})
+    if response.status_code != 200:
+        return pd.DataFrame()
+    return pd.DataFrame(response.json())
+
+# Finished figures per (table, year, column), reused while the user's data version is unchanged
+FIGURE_CACHE_SIZE = 128
+figure_cache = OrderedDict()
+figure_cache_lock = threading.Lock()
+
+# Function to fetch the user's data version, bumped by the API on every write
+def fetch_data_version(token):
+    response = requests.get(f"{API_URL}/transactions/version", params={"token": token})
+    return response.json()["version"] if response.status_code == 200 else None
+
+# Function to return cached figures for key, rebuilding them when the data version moved
+def cached_figures(key, version, build):
+    with figure_cache_lock:
+        entry = figure_cache.get(key)
+        if version is not None and entry is not None and entry[0] == version:
+            figure_cache.move_to_end(key)
+            return entry[1]
+
+    figures = build()
+    if version is not None:
+        with figure_cache_lock:
+            figure_cache[key] = (version, figures)
+            figure_cache.move_to_end(key)
+            while len(figure_cache) > FIGURE_CACHE_SIZE:
+                figure_cache.popitem(last=False)
+    return figures
 
 # Initialize Dash app
 app = dash.Dash(__name__)
@@ -66,7 +90,8 @@ app.layout = html.Div([
     # Dashboard (Initially hidden)
     html.Div(id="dashboard-content", style={"display": "none"}, children=[
         html.Button('Refresh Data', id='refresh-button', n_clicks=0),
-        dcc.Interval(id='interval-component', interval=5000, n_intervals=0),  # Auto-refresh every 5 sec
+        dcc.Store(id='change-feed'),  # Latest change event pushed by the API
+        dcc.Store(id='change-feed-connection'),
 
         html.Label("Select Table:"),
         dcc.Dropdown(
@@ -98,6 +123,30 @@ app.layout = html.Div([
     ])
 ])
 
+# Change Feed: the browser subscribes to the API's Server-Sent Events and each event
+# lands in the change-feed store, which re-renders the charts
+app.clientside_callback(
+    """
+    function(token) {
+        if (window.changeFeedSource) {
+            window.changeFeedSource.close();
+            window.changeFeedSource = null;
+        }
+        if (!token) {
+            return null;
+        }
+        const source = new EventSource("API_URL/transactions/events?token=" + encodeURIComponent(token));
+        source.onmessage = function(event) {
+            dash_clientside.set_props("change-feed", {data: {id: event.lastEventId, change: JSON.parse(event.data)}});
+        };
+        window.changeFeedSource = source;
+        return null;
+    }
+    """.replace("API_URL", API_URL),
+    Output("change-feed-connection", "data"),
+    Input("auth-token", "data")
+)
+
 # Login Callback
 @app.callback(
     [Output("logged-in-user", "data"), Output("auth-token", "data"),
@@ -117,31 +166,29 @@ def login(n_clicks, username, password):
 # Update Table Dropdown
 @app.callback(
     Output('table-selector', 'options'),
-    Input('logged-in-user', 'data')
+    Input('auth-token', 'data'),
+    State('logged-in-user', 'data')
 )
-def update_table_selector(username):
-    if not username:
+def update_table_selector(token, username):
+    if not username or not token:
         return []
 
-    user_tables = get_user_tables(db_path, username)  # Get user-specific tables
+    user_tables = get_user_tables(token, username)  # Get user-specific tables
     return [{'label': table, 'value': table} for table in user_tables]  # Populate dropdown with user-specific tables
 
 # Update Year Filter
 @app.callback(
     Output('year-filter', 'options'),
     Output('year-filter', 'value'),
-    Input('table-selector', 'value')
+    Input('table-selector', 'value'),
+    State("auth-token", "data")
 )
-def update_year_filter(selected_table):
-    if not selected_table:
+def update_year_filter(selected_table, token):
+    if not selected_table or not token:
         return [], None
 
-    data = fetch_data(db_path, selected_table)
-    if data.empty or 'date' not in data.columns:
-        return [], None
-
-    data['year'] = data['date'].dt.year.dropna().astype(int)
-    years = sorted(data['year'].unique())
+    response = requests.get(f"{API_URL}/transactions/summary/years", params={"token": token})
+    years = response.json() if response.status_code == 200 else []
     options = [{'label': str(year), 'value': year} for year in years]
 
     return options, years[-1] if years else None
@@ -150,53 +197,57 @@ def update_year_filter(selected_table):
 @app.callback(
     [Output('bar-chart', 'figure'), Output('pie-chart', 'figure'), Output('income-expense-chart', 'figure')],
     [Input('table-selector', 'value'), Input('dropdown-column', 'value'), Input('year-filter', 'value'),
-     Input('refresh-button', 'n_clicks'), Input('interval-component', 'n_intervals')],
+     Input('refresh-button', 'n_clicks'), Input('change-feed', 'data')],
     [State("logged-in-user", "data"), State("auth-token", "data")]
 )
-def update_charts(selected_table, selected_column, selected_year, n_clicks, n_intervals, username, token):
+def update_charts(selected_table, selected_column, selected_year, n_clicks, change, username, token):
     if not username or not token or not selected_table:
         return px.bar(title="Please Log In"), px.pie(title="Please Log In"), px.bar(title="Please Log In")
 
-    data = fetch_data(db_path, selected_table)  # Fetch all data (no user filtering)
-    if data.empty or 'date' not in data.columns:
-        return px.bar(title="No Data Available"), px.pie(title="No Data Available"), px.bar(title="No Data Available")
-
-    # Process data for visualization
-    data = data.copy()
-    data['year'] = data['date'].dt.year
-    data['month'] = data['date'].dt.month
-    data['month_name'] = data['month'].apply(lambda x: calendar.month_abbr[x])
+    return cached_figures(
+        (selected_table, selected_year, selected_column),
+        fetch_data_version(token),
+        lambda: build_charts(selected_column, selected_year, token),
+    )
 
-    filtered_data = data[data['year'] == selected_year].copy() if selected_year else data.copy()
-    if filtered_data.empty:
+def build_charts(selected_column, selected_year, token):
+    # Monthly totals per details, already grouped by the API
+    monthly = fetch_summary("monthly", token, **({"year": selected_year} if selected_year else {}))
+    if monthly.empty:
         return px.bar(title="No Data Available"), px.pie(title="No Data Available"), px.bar(title="No Data Available")
 
-    filtered_data['month_name'] = pd.Categorical(filtered_data['month_name'], categories=calendar.month_abbr[1:], ordered=True)
-
-    # Ensure selected column exists
-    if selected_column not in filtered_data.columns:
-        selected_column = 'debit' if 'debit' in filtered_data.columns else 'credit'
-
-    agg_data = filtered_data.groupby(['month_name', 'details'], observed=False)[selected_column].sum().reset_index()
-
-    # Bar chart
-    bar_fig = px.bar(
-        agg_data, x='month_name', y=selected_column, color='details',
-        title=f"Monthly {selected_column.capitalize()} Transactions for {selected_year}",
-        text_auto=True
+    monthly['month_name'] = pd.Categorical(
+        monthly['month'].apply(lambda x: calendar.month_abbr[x]), categories=calendar.month_abbr[1:], ordered=True
     )
+
+    if selected_column == 'balance':
+        # Month-end running balance; the breakdowns below fall back to debit
+        balances = fetch_monthly_balances(token, selected_year)
+        balances['month_name'] = balances['month'].apply(lambda x: calendar.month_abbr[x])
+        bar_fig = px.line(balances, x='month_name', y='balance', markers=True,
+                          title=f"Month-End Balance for {selected_year}")
+        selected_column = 'debit'
+    else:
+        agg_data = monthly.groupby(['month_name', 'details'], observed=False)[selected_column].sum().reset_index()
+
+        # Bar chart
+        bar_fig = px.bar(
+            agg_data, x='month_name', y=selected_column, color='details',
+            title=f"Monthly {selected_column.capitalize()} Transactions for {selected_year}",
+            text_auto=True
+        )
     bar_fig.update_layout(xaxis_tickangle=-45)
 
     # Pie chart
     pie_fig = px.pie(
-        filtered_data.groupby('details')[selected_column].sum().reset_index(),
+        monthly.groupby('details')[selected_column].sum().reset_index(),
         values=selected_column, names='details',
         title=f"{selected_column.capitalize()} Distribution by Transaction Type",
         hole=0.3
     )
 
     # Yearly comparison
-    yearly_summary = data.groupby('year')[['debit', 'credit']].sum().reset_index().melt(
+    yearly_summary = fetch_summary("yearly", token).melt(
         id_vars=['year'], value_vars=['debit', 'credit'],
         var_name='Transaction Type', value_name='Amount'
     )
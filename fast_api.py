@@ -1,13 +1,61 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ValidationError, field_validator
+import asyncio
+import json
+import os
+import threading
 import uuid
 import datetime
-from src.auth import router as auth_router, get_current_user
-from src.database import DatabaseManager, get_db, engine, metadata, Table
-
-app = FastAPI()
-app.include_router(auth_router)
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from src.auth import router as auth_router, get_current_user, get_user_db, init_db as init_auth_db
+from src.database import DatabaseManager, run_db, warm_pools
+from src import (
+    aggregates, archive, balance, crud, export, group_commit, idempotency, listing, metrics, rollup, search, versions,
+)
+from src.response_cache import load_response, response_cache
+from src.events import change_feed
+
+# Browser origins allowed to call the API directly (the dashboards' change-feed subscription)
+CORS_ALLOW_ORIGINS = os.getenv("CORS_ALLOW_ORIGINS", "http://127.0.0.1:8050,http://localhost:8050")
+
+router = APIRouter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Does the work that would otherwise land on the first requests: creates the auth
+    schema, opens pooled connections and, once the app is serving, loads existing users'
+    tables into the registry. With ARCHIVE_COMPACT_INTERVAL_SECONDS set, it also runs
+    the archive compaction."""
+    await run_in_threadpool(init_auth_db)
+    await warm_pools()
+    stop_preload = threading.Event()
+    preload = asyncio.create_task(run_in_threadpool(crud.preload_tables, crud.TABLE_PRELOAD_LIMIT, stop_preload))
+    compaction = None
+    if archive.ARCHIVE_COMPACT_INTERVAL_SECONDS > 0:
+        compaction = asyncio.create_task(archive.compact_periodically())
+    yield
+    stop_preload.set()
+    preload.cancel()
+    if compaction is not None:
+        compaction.cancel()
+
+
+def create_app() -> FastAPI:
+    """Builds the application; each worker process runs its ``lifespan`` on startup."""
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(auth_router)
+    app.include_router(router)
+    if CORS_ALLOW_ORIGINS:
+        app.add_middleware(CORSMiddleware, allow_origins=CORS_ALLOW_ORIGINS.split(","), allow_methods=["GET"])
+    if metrics.METRICS_ENABLED:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
 
 
 class BankTransactionCreate(BaseModel):
@@ -25,125 +73,425 @@ class BankTransactionCreate(BaseModel):
             raise ValueError("Date format must be YYYY-MM-DD")
 
 
+class BankTransactionUpdate(BaseModel):
+    date: Optional[str] = None
+    details: Optional[str] = None
+    debit: Optional[float] = None
+    credit: Optional[float] = None
+
+    @field_validator("date")
+    @classmethod
+    def validate_date(cls, v):
+        return v if v is None else BankTransactionCreate.validate_date(v)
+
+
 
 ## 🟢 Create Transaction
-@app.post("/transactions/", status_code=status.HTTP_201_CREATED)
+# A retried POST carrying the same Idempotency-Key gets the original response back
+# (marked with Idempotent-Replayed) instead of inserting again
+IdempotencyKey = Header(None, alias="Idempotency-Key", min_length=1, max_length=idempotency.IDEMPOTENCY_KEY_MAX_LENGTH)
+
+
+@router.post("/transactions/", status_code=status.HTTP_201_CREATED)
 async def create_transaction(
     transaction: BankTransactionCreate,
-    db: Session = Depends(get_db),
+    response: Response,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    db: Session = Depends(get_user_db),
     current_user=Depends(get_current_user)
 ):
-    user_table = DatabaseManager.get_user_transactions_table(current_user.username)
-    DatabaseManager.ensure_table_exists(user_table)
-
     reference_no = str(uuid.uuid4())  # Generate unique reference number
+    result = {"reference_no" : f"{reference_no}"}
+    values = {
+        "date": transaction.date,
+        "details": transaction.details,
+        "debit": transaction.debit,
+        "credit": transaction.credit,
+    }
+
+    replayed = await group_commit.write(
+        db, crud.insert_transactions, current_user.username, [{"reference_no": reference_no, **values}],
+        idempotency_key, idempotency_key and idempotency.fingerprint("/transactions/", values), result,
+    )
+    if replayed is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return replayed
+    response_cache.record_write(current_user.username)
+    await publish_change(db, current_user.username, "created", [reference_no])
+
+    return result
+
+
+## 🟢 Bulk Create Transactions
+async def _read_bulk_items(request: Request):
+    """Yields raw items from a JSON array body or an NDJSON stream."""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        if buffer.strip():
+            yield json.loads(buffer)
+        return
+
+    items = json.loads(await request.body())
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array of transactions")
+    for item in items:
+        yield item
+
+
+@router.post("/transactions/bulk", status_code=status.HTTP_201_CREATED)
+async def create_transactions_bulk(
+    request: Request,
+    response: Response,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    reference_nos = []
+    errors = []
+    rows = []
+    body_fingerprint = idempotency.Fingerprint("/transactions/bulk")
 
-    insert_stmt = user_table.insert().values(
-        reference_no=reference_no,
-        date=transaction.date,
-        details=transaction.details,
-        debit=transaction.debit,
-        credit=transaction.credit,
+    try:
+        index = 0
+        async for item in _read_bulk_items(request):
+            if idempotency_key is not None:
+                body_fingerprint.update(item)
+            try:
+                transaction = BankTransactionCreate.model_validate(item)
+            except ValidationError as e:
+                reference_nos.append(None)
+                errors.append({"index": index, "errors": e.errors(include_url=False, include_context=False)})
+            else:
+                reference_no = str(uuid.uuid4())
+                reference_nos.append(reference_no)
+                rows.append({
+                    "reference_no": reference_no,
+                    "date": transaction.date,
+                    "details": transaction.details,
+                    "debit": transaction.debit,
+                    "credit": transaction.credit,
+                })
+            index += 1
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        # json.loads decodes bytes itself: a body that isn't UTF-8 fails before parsing
+        raise HTTPException(status_code=400, detail=f"Malformed JSON: {e}")
+
+    result = {"inserted": len(rows), "reference_nos": reference_nos, "errors": errors}
+    if rows:
+        replayed = await group_commit.write(
+            db, crud.insert_transactions, current_user.username, rows,
+            idempotency_key, body_fingerprint.hexdigest(), result, rows=len(rows),
+        )
+        if replayed is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return replayed
+        response_cache.record_write(current_user.username)
+        await publish_change(db, current_user.username, "created", reference_nos)
+
+    return result
+
+
+## 🔵 List Transactions
+@router.get("/transactions/")
+async def list_transactions(
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    details: Optional[str] = None,
+    min_debit: Optional[float] = None,
+    max_debit: Optional[float] = None,
+    min_credit: Optional[float] = None,
+    max_credit: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(listing.LIST_DEFAULT_LIMIT, ge=1, le=listing.LIST_MAX_LIMIT),
+    format: Literal["json", "ndjson"] = "json",
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    try:
+        after = listing.decode_cursor(cursor) if cursor else None
+    except listing.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        if format == "ndjson":
+            return StreamingResponse(iter(()), media_type="application/x-ndjson")
+        return {"items": [], "next_cursor": None}
+
+    query = listing.build_listing_query(
+        user_table, date_from, date_to, details, min_debit, max_debit, min_credit, max_credit
     )
-    db.execute(insert_stmt)
-    db.commit()
 
-    return {"reference_no" : f"{reference_no}"}
+    if format == "ndjson":
+        # Stream the whole result set from the cursor onwards, ``limit`` rows per batch
+        rows = listing.iter_rows(user_table.shard.SessionLocal, user_table, query, after, limit, date_from, date_to)
+        lines = (json.dumps(listing.row_to_dict(row), default=str) + "\n" for row in rows)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
 
+    rows = await run_db(db, listing.fetch_page, user_table, query, after, limit, date_from, date_to)
+    next_cursor = listing.encode_cursor(rows[-1]) if len(rows) == limit else None
+    return {"items": [listing.row_to_dict(row) for row in rows], "next_cursor": next_cursor}
 
-## 🔵 Fetch Transaction by Reference No
-@app.get("/transactions/{reference_no}")
-async def read_transaction(
-    reference_no: str,
-    db: Session = Depends(get_db),
+
+## 📦 Export Transactions (CSV / Arrow IPC / Parquet)
+@router.get("/transactions/export")
+async def export_transactions(
+    format: Literal["csv", "arrow", "parquet"] = "csv",
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    details: Optional[str] = None,
     current_user=Depends(get_current_user)
 ):
-    table_name = f"{current_user.username}_transactions"
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        chunks = export.stream_empty_export(format)
+    else:
+        query = listing.build_listing_query(user_table, date_from, date_to, details)
+        chunks = export.stream_export(user_table, query, format, export.EXPORT_BATCH_SIZE, date_from, date_to)
+    media_type, extension = export.EXPORT_FORMATS[format]
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{current_user.username}_transactions.{extension}"'},
+    )
 
-    try:
-        user_table = Table(table_name, metadata, autoload_with=engine)
-    except Exception:
-        raise HTTPException(status_code=404, detail=f"User table '{table_name}' does not exist")
 
-    session = db
-    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
-    transaction = session.execute(select_stmt).fetchone()
+## 📊 Transaction Summaries
+@router.get("/transactions/summary/monthly")
+async def monthly_summary(
+    year: Optional[int] = None,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return []
+    return await run_db(db, aggregates.monthly_totals, rollup.get_rollup_table(current_user.username), year)
 
-    if not transaction:
-        raise HTTPException(status_code=404, detail=f"Transaction with reference {reference_no} not found")
 
-    return dict(zip(transaction._fields, transaction))
+@router.get("/transactions/summary/yearly")
+async def yearly_summary(
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return []
+    return await run_db(db, aggregates.yearly_totals, rollup.get_rollup_table(current_user.username))
 
 
-## 🟡 Update Transaction (PUT)
-@app.put("/transactions/{reference_no}")
-async def update_transaction(
-    reference_no: str,
-    transaction: BankTransactionCreate,
-    db: Session = Depends(get_db),
+@router.get("/transactions/summary/years")
+async def summary_years(
+    db: Session = Depends(get_user_db),
     current_user=Depends(get_current_user)
 ):
-    table_name = f"{current_user.username}_transactions"
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return []
+    return await run_db(db, aggregates.distinct_years, rollup.get_rollup_table(current_user.username))
+
+
+## 🔍 Search Transaction Details (full text)
+@router.get("/transactions/search")
+async def search_transactions(
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(search.SEARCH_DEFAULT_LIMIT, ge=1, le=search.SEARCH_MAX_LIMIT),
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    try:
+        after = search.decode_cursor(cursor) if cursor else None
+        search.build_match(q)
+    except search.InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return {"items": [], "next_cursor": None}
+    search_table = search.get_search_table(current_user.username)
+
+    items, next_cursor = await run_db(db, search.search, user_table, search_table, q, after, limit)
+    return {"items": items, "next_cursor": next_cursor}
 
+
+## 💰 Running Balance
+@router.get("/transactions/balance")
+async def get_balance(
+    as_of: Optional[datetime.date] = None,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    as_of = as_of or datetime.date.today()
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return {"as_of": as_of, "balance": 0.0}
+    checkpoint_table = balance.get_checkpoint_table(current_user.username)
+    return {"as_of": as_of, "balance": await run_db(db, balance.balance_as_of, user_table, checkpoint_table, as_of)}
+
+
+@router.get("/transactions/balance/monthly")
+async def get_monthly_balances(
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return []
+    checkpoint_table = balance.get_checkpoint_table(current_user.username)
+    return await run_db(db, balance.monthly_balances, checkpoint_table, date_from, date_to)
+
+
+@router.get("/transactions/balance/running")
+async def get_running_balance(
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(listing.LIST_DEFAULT_LIMIT, ge=1, le=listing.LIST_MAX_LIMIT),
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
     try:
-        user_table = Table(table_name, metadata, autoload_with=engine)
-    except Exception:
-        raise HTTPException(status_code=404, detail=f"User table '{table_name}' does not exist")
+        after = listing.decode_cursor(cursor) if cursor else None
+    except listing.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_table = DatabaseManager.get_table(current_user.username)
+    if user_table is None:
+        return {"items": [], "next_cursor": None}
+    checkpoint_table = balance.get_checkpoint_table(current_user.username)
+
+    query = listing.build_listing_query(user_table, date_from, date_to)
+    rows, balances = await run_db(
+        db, balance.running_balance, user_table, checkpoint_table, query, after, limit, date_from, date_to
+    )
+    next_cursor = listing.encode_cursor(rows[-1]) if len(rows) == limit else None
+    return {
+        "items": [{**listing.row_to_dict(row), "balance": row_balance} for row, row_balance in zip(rows, balances)],
+        "next_cursor": next_cursor,
+    }
+
+
+## 🔵 Data Version (bumped by every write, for client-side caches)
+@router.get("/transactions/version")
+async def data_version(
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    return {"version": await run_db(db, versions.current, current_user.username)}
 
-    session = db
 
-    # Check if the transaction exists
-    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
-    existing_transaction = session.execute(select_stmt).fetchone()
+## 🔔 Change Feed (Server-Sent Events)
+async def publish_change(db, user_name: str, event_type: str, reference_nos):
+    """Sends a committed write, with the data version it brought the user to, to the
+    user's change-feed streams open in this process."""
+    if change_feed.has_subscribers(user_name):
+        change_feed.publish(user_name, event_type, reference_nos, await run_db(db, versions.current, user_name))
 
-    if not existing_transaction:
-        raise HTTPException(status_code=404, detail=f"Transaction with reference {reference_no} not found")
 
-    # Update the transaction
-    update_stmt = user_table.update().where(user_table.c.reference_no == reference_no).values(
-        date=transaction.date,
-        details=transaction.details,
-        debit=transaction.debit,
-        credit=transaction.credit
+@router.get("/transactions/events")
+async def transaction_events(current_user=Depends(get_current_user)):
+    return StreamingResponse(
+        change_feed.stream(current_user.username),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    session.execute(update_stmt)
-    session.commit()
 
-    return {"message": f"Transaction {reference_no} updated successfully"}
+## 🔵 Fetch Transaction by Reference No
+@router.get("/transactions/{reference_no}")
+async def read_transaction(
+    reference_no: str,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    user_name = current_user.username
+    cached = response_cache.get(user_name, reference_no)
+    if cached is None:
+        generation = response_cache.generation(user_name)
+        version, cached = await run_db(db, load_response, user_name, reference_no)
+        response_cache.put(user_name, reference_no, generation, version, cached)
 
+    headers = {"ETag": cached.etag, "Cache-Control": "private, no-cache"}
+    if if_none_match is not None and cached.matches(if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
 
-## 🔴 Delete Transaction (DELETE)
-@app.delete("/transactions/{reference_no}")
-async def delete_transaction(
+
+## 🟡 Update Transaction (PUT)
+@router.put("/transactions/{reference_no}")
+async def update_transaction(
     reference_no: str,
-    db: Session = Depends(get_db),
+    transaction: BankTransactionCreate,
+    db: Session = Depends(get_user_db),
     current_user=Depends(get_current_user)
 ):
-    table_name = f"{current_user.username}_transactions"
+    updated = await group_commit.write(db, crud.update_transaction, current_user.username, reference_no, {
+        "date": transaction.date,
+        "details": transaction.details,
+        "debit": transaction.debit,
+        "credit": transaction.credit,
+    })
+    response_cache.invalidate(current_user.username, reference_no)
+    await publish_change(db, current_user.username, "updated", [reference_no])
 
-    try:
-        user_table = Table(table_name, metadata, autoload_with=engine)
-    except Exception:
-        raise HTTPException(status_code=404, detail=f"User table '{table_name}' does not exist")
+    return {"message": f"Transaction {reference_no} updated successfully", "transaction": updated}
+
+
+## 🟡 Partially Update Transaction (PATCH)
+@router.patch("/transactions/{reference_no}")
+async def patch_transaction(
+    reference_no: str,
+    transaction: BankTransactionUpdate,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    values = {
+        field: getattr(transaction, field)
+        for field in transaction.model_fields_set
+        if getattr(transaction, field) is not None
+    }
+    if not values:
+        raise HTTPException(status_code=400, detail="No fields to update")
 
-    session = db
+    updated = await group_commit.write(db, crud.update_transaction, current_user.username, reference_no, values)
+    response_cache.invalidate(current_user.username, reference_no)
+    await publish_change(db, current_user.username, "updated", [reference_no])
 
-    # Check if the transaction exists
-    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
-    existing_transaction = session.execute(select_stmt).fetchone()
+    return {"message": f"Transaction {reference_no} updated successfully", "transaction": updated}
 
-    if not existing_transaction:
-        raise HTTPException(status_code=404, detail=f"Transaction with reference {reference_no} not found")
 
-    # Delete the transaction
-    delete_stmt = user_table.delete().where(user_table.c.reference_no == reference_no)
-    session.execute(delete_stmt)
-    session.commit()
+## 🔴 Delete Transaction (DELETE)
+@router.delete("/transactions/{reference_no}")
+async def delete_transaction(
+    reference_no: str,
+    db: Session = Depends(get_user_db),
+    current_user=Depends(get_current_user)
+):
+    await group_commit.write(db, crud.delete_transaction, current_user.username, reference_no)
+    response_cache.invalidate(current_user.username, reference_no)
+    await publish_change(db, current_user.username, "deleted", [reference_no])
 
     return {"message": f"Transaction {reference_no} deleted successfully"}
 
+## 📈 Metrics (Prometheus text format)
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+app = create_app()
+
 if __name__ == "__main__":
-    import uvicorn
+    from src import serve
 
-    uvicorn.run(app, host="127.0.0.1", port=8001)
+    serve.main(app)
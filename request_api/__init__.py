@@ -0,0 +1,3 @@
+from request_api.client import ApiError, AsyncTransactionsClient, TransactionsClient
+
+__all__ = ["ApiError", "AsyncTransactionsClient", "TransactionsClient"]
@@ -0,0 +1,371 @@
+"""Python clients for the transactions API.
+
+``TransactionsClient`` (blocking) and ``AsyncTransactionsClient`` (asyncio) keep one
+keep-alive connection pool per client, log in on demand and again shortly before
+the token expires (or after a 401), retry idempotent calls on connection errors and
+503s, and upload large batches through ``/transactions/bulk`` in chunks. Creates
+carry an ``Idempotency-Key``, so they are retried too without inserting twice:
+
+    with TransactionsClient("http://127.0.0.1:8001", "alice", "secret") as client:
+        reference_nos = client.bulk_create(rows)["reference_nos"]
+        for transaction in client.iter_transactions(date_from="2024-01-01"):
+            ...
+
+    async with AsyncTransactionsClient("http://127.0.0.1:8001", "alice", "secret") as client:
+        transactions = await asyncio.gather(*(client.get_transaction(ref) for ref in reference_nos))
+        async for transaction in client.iter_transactions():
+            ...
+"""
+import asyncio
+import base64
+import datetime
+import json
+import threading
+import time
+import uuid
+
+import httpx
+
+DEFAULT_BASE_URL = "http://127.0.0.1:8001"
+BULK_CHUNK_SIZE = 500
+# Log in again this many seconds before the token's ``exp``
+TOKEN_REFRESH_MARGIN = 30
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE", "PATCH")
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def token_expiry(token: str):
+    """Reads ``exp`` from a JWT without verifying it (the server does that)."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+    except (IndexError, ValueError):
+        return None
+
+
+def _serialize(row: dict):
+    return {key: value.isoformat() if isinstance(value, datetime.date) else value for key, value in row.items()}
+
+
+def _transaction_body(date, details, debit, credit):
+    # A field left out takes the server's default; it rejects an explicit null
+    fields = {"date": date, "details": details, "debit": debit, "credit": credit}
+    return _serialize({key: value for key, value in fields.items() if value is not None})
+
+
+def _raise_for_status(response: httpx.Response):
+    if response.status_code < 400:
+        return
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        detail = response.text
+    raise ApiError(response.status_code, detail)
+
+
+def _idempotency_headers():
+    # One key per logical create, reused by its retries
+    return {"Idempotency-Key": str(uuid.uuid4())}
+
+
+def _retry_delay(response, attempt: int):
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return float(response.headers["Retry-After"])
+    return min(0.1 * 2 ** attempt, 2.0)
+
+
+def _list_params(filters: dict):
+    return {key: value.isoformat() if isinstance(value, datetime.date) else value
+            for key, value in filters.items() if value is not None}
+
+
+class _ClientBase:
+    def __init__(self, base_url, username, password, token, retries, bulk_chunk_size):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.retries = retries
+        self.bulk_chunk_size = bulk_chunk_size
+        self._set_token(token)
+
+    def _set_token(self, token):
+        self.token = token
+        self.token_expires_at = token_expiry(token) if token else None
+
+    def _token_is_fresh(self):
+        if self.token is None:
+            return False
+        return self.token_expires_at is None or time.time() < self.token_expires_at - TOKEN_REFRESH_MARGIN
+
+    def _can_login(self):
+        return self.username is not None and self.password is not None
+
+    def _chunks(self, rows):
+        rows = [_serialize(row) for row in rows]
+        return [rows[start:start + self.bulk_chunk_size] for start in range(0, len(rows), self.bulk_chunk_size)]
+
+    @staticmethod
+    def _merge_bulk(responses):
+        result = {"inserted": 0, "reference_nos": [], "errors": []}
+        for body in responses:
+            offset = len(result["reference_nos"])
+            result["inserted"] += body["inserted"]
+            result["reference_nos"].extend(body["reference_nos"])
+            result["errors"].extend({**error, "index": error["index"] + offset} for error in body["errors"])
+        return result
+
+
+class TransactionsClient(_ClientBase):
+    """Blocking client; safe to share between threads."""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, username: str = None, password: str = None,
+                 token: str = None, max_connections: int = 10, timeout: float = 30.0, retries: int = 3,
+                 bulk_chunk_size: int = BULK_CHUNK_SIZE):
+        super().__init__(base_url, username, password, token, retries, bulk_chunk_size)
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._login_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._http.close()
+
+    def signup(self):
+        response = self._http.post("/signup/", json={"username": self.username, "password": self.password})
+        _raise_for_status(response)
+        return response.json()
+
+    def login(self, stale_token: str = None):
+        with self._login_lock:
+            # Concurrent callers that saw the same stale token share one login
+            if self.token != stale_token and self._token_is_fresh():
+                return self.token
+            response = self._send("POST", "/login/", json={"username": self.username, "password": self.password})
+            _raise_for_status(response)
+            self._set_token(response.json()["access_token"])
+        return self.token
+
+    def _ensure_token(self):
+        if not self._token_is_fresh() and self._can_login():
+            return self.login(self.token)
+        return self.token
+
+    def _send(self, method, url, retry=None, **kwargs):
+        retry = method in IDEMPOTENT_METHODS if retry is None else retry
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._http.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if not retry or attempt == self.retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                # 503 from the password-hash pool means nothing was done, so retrying is safe
+                if not retry and response.status_code != 503:
+                    return response
+            time.sleep(_retry_delay(response, attempt))
+
+    def _request(self, method, url, params=None, retry=None, **kwargs):
+        token = self._ensure_token()
+        params = dict(params or {}, token=token)
+        response = self._send(method, url, retry=retry, params=params, **kwargs)
+        if response.status_code == 401 and self._can_login():
+            params["token"] = self.login(token)
+            response = self._send(method, url, retry=retry, params=params, **kwargs)
+        _raise_for_status(response)
+        return response.json()
+
+    def create_transaction(self, date, details: str = None, debit: float = 0.0, credit: float = 0.0):
+        row = _transaction_body(date, details, debit, credit)
+        response = self._request("POST", "/transactions/", retry=True, json=row, headers=_idempotency_headers())
+        return response["reference_no"]
+
+    def bulk_create(self, rows):
+        """Inserts ``rows`` in ``bulk_chunk_size`` chunks; returns the merged bulk response."""
+        return self._merge_bulk(
+            self._request("POST", "/transactions/bulk", retry=True, json=chunk, headers=_idempotency_headers())
+            for chunk in self._chunks(rows)
+        )
+
+    def get_transaction(self, reference_no: str):
+        return self._request("GET", f"/transactions/{reference_no}")
+
+    def update_transaction(self, reference_no: str, date, details: str = None, debit: float = 0.0,
+                           credit: float = 0.0):
+        row = _transaction_body(date, details, debit, credit)
+        return self._request("PUT", f"/transactions/{reference_no}", json=row)["transaction"]
+
+    def patch_transaction(self, reference_no: str, **fields):
+        return self._request("PATCH", f"/transactions/{reference_no}", json=_serialize(fields))["transaction"]
+
+    def delete_transaction(self, reference_no: str):
+        return self._request("DELETE", f"/transactions/{reference_no}")
+
+    def list_transactions(self, cursor: str = None, limit: int = None, **filters):
+        """One page of ``GET /transactions/``: ``{"items": [...], "next_cursor": ...}``."""
+        return self._request("GET", "/transactions/", params=_list_params(dict(filters, cursor=cursor, limit=limit)))
+
+    def iter_transactions(self, batch_size: int = 1000, **filters):
+        """Yields every matching transaction from a single NDJSON stream."""
+        params = _list_params(dict(filters, limit=batch_size, format="ndjson", token=self._ensure_token()))
+        with self._http.stream("GET", "/transactions/", params=params) as response:
+            if response.status_code >= 400:
+                response.read()
+                _raise_for_status(response)
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def monthly_summary(self, year: int = None):
+        return self._request("GET", "/transactions/summary/monthly", params=_list_params({"year": year}))
+
+    def yearly_summary(self):
+        return self._request("GET", "/transactions/summary/yearly")
+
+    def years(self):
+        return self._request("GET", "/transactions/summary/years")
+
+
+class AsyncTransactionsClient(_ClientBase):
+    """asyncio client; at most ``max_concurrency`` requests are in flight at once, so
+    callers can ``gather`` thousands of calls without opening thousands of sockets."""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, username: str = None, password: str = None,
+                 token: str = None, max_concurrency: int = 16, timeout: float = 30.0, retries: int = 3,
+                 bulk_chunk_size: int = BULK_CHUNK_SIZE, transport: httpx.AsyncBaseTransport = None):
+        super().__init__(base_url, username, password, token, retries, bulk_chunk_size)
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport,
+        )
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._login_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def signup(self):
+        response = await self._http.post("/signup/", json={"username": self.username, "password": self.password})
+        _raise_for_status(response)
+        return response.json()
+
+    async def login(self, stale_token: str = None):
+        async with self._login_lock:
+            # Concurrent callers that saw the same stale token share one login
+            if self.token != stale_token and self._token_is_fresh():
+                return self.token
+            response = await self._send("POST", "/login/", json={"username": self.username, "password": self.password})
+            _raise_for_status(response)
+            self._set_token(response.json()["access_token"])
+        return self.token
+
+    async def _ensure_token(self):
+        if not self._token_is_fresh() and self._can_login():
+            return await self.login(self.token)
+        return self.token
+
+    async def _send(self, method, url, retry=None, **kwargs):
+        retry = method in IDEMPOTENT_METHODS if retry is None else retry
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._slots:
+                    response = await self._http.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if not retry or attempt == self.retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                if not retry and response.status_code != 503:
+                    return response
+            await asyncio.sleep(_retry_delay(response, attempt))
+
+    async def _request(self, method, url, params=None, retry=None, **kwargs):
+        token = await self._ensure_token()
+        params = dict(params or {}, token=token)
+        response = await self._send(method, url, retry=retry, params=params, **kwargs)
+        if response.status_code == 401 and self._can_login():
+            params["token"] = await self.login(token)
+            response = await self._send(method, url, retry=retry, params=params, **kwargs)
+        _raise_for_status(response)
+        return response.json()
+
+    async def create_transaction(self, date, details: str = None, debit: float = 0.0, credit: float = 0.0):
+        row = _transaction_body(date, details, debit, credit)
+        response = await self._request("POST", "/transactions/", retry=True, json=row, headers=_idempotency_headers())
+        return response["reference_no"]
+
+    async def bulk_create(self, rows):
+        """Uploads ``rows`` in ``bulk_chunk_size`` chunks, concurrently; returns the merged
+        bulk response with ``reference_nos`` and error indexes in input order."""
+        responses = await asyncio.gather(
+            *(self._request("POST", "/transactions/bulk", retry=True, json=chunk, headers=_idempotency_headers())
+              for chunk in self._chunks(rows))
+        )
+        return self._merge_bulk(responses)
+
+    async def get_transaction(self, reference_no: str):
+        return await self._request("GET", f"/transactions/{reference_no}")
+
+    async def update_transaction(self, reference_no: str, date, details: str = None, debit: float = 0.0,
+                                 credit: float = 0.0):
+        row = _transaction_body(date, details, debit, credit)
+        return (await self._request("PUT", f"/transactions/{reference_no}", json=row))["transaction"]
+
+    async def patch_transaction(self, reference_no: str, **fields):
+        return (await self._request("PATCH", f"/transactions/{reference_no}", json=_serialize(fields)))["transaction"]
+
+    async def delete_transaction(self, reference_no: str):
+        return await self._request("DELETE", f"/transactions/{reference_no}")
+
+    async def list_transactions(self, cursor: str = None, limit: int = None, **filters):
+        return await self._request(
+            "GET", "/transactions/", params=_list_params(dict(filters, cursor=cursor, limit=limit))
+        )
+
+    async def iter_transactions(self, batch_size: int = 1000, **filters):
+        """Async iterator over every matching transaction from a single NDJSON stream."""
+        params = _list_params(dict(filters, limit=batch_size, format="ndjson", token=await self._ensure_token()))
+        async with self._http.stream("GET", "/transactions/", params=params) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _raise_for_status(response)
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def monthly_summary(self, year: int = None):
+        return await self._request("GET", "/transactions/summary/monthly", params=_list_params({"year": year}))
+
+    async def yearly_summary(self):
+        return await self._request("GET", "/transactions/summary/yearly")
+
+    async def years(self):
+        return await self._request("GET", "/transactions/summary/years")
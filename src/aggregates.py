@@ -0,0 +1,48 @@
+from typing import Optional
+from sqlalchemy import Integer, cast, func, select
+
+
+def monthly_totals_query(user_table):
+    """Debit/credit sums and row counts per (year, month, details), computed from the base table."""
+    year_col = cast(func.strftime("%Y", user_table.c.date), Integer).label("year")
+    month_col = cast(func.strftime("%m", user_table.c.date), Integer).label("month")
+    return user_table.scope(
+        select(
+            year_col,
+            month_col,
+            user_table.c.details,
+            func.sum(user_table.c.debit).label("debit"),
+            func.sum(user_table.c.credit).label("credit"),
+            func.count().label("count"),
+        )
+        .where(user_table.c.date.is_not(None))
+        .group_by(year_col, month_col, user_table.c.details)
+    )
+
+
+def monthly_totals(db, rollup_table, year: Optional[int] = None):
+    """Debit/credit totals per (year, month, details), read from the monthly rollup."""
+    c = rollup_table.c
+    query = rollup_table.scope(
+        select(c.year, c.month, c.details, c.debit, c.credit).order_by(c.year, c.month, c.details)
+    )
+    if year is not None:
+        query = query.where(c.year == year)
+    return [row._asdict() for row in db.execute(query)]
+
+
+def yearly_totals(db, rollup_table):
+    """Debit/credit totals per year."""
+    c = rollup_table.c
+    query = rollup_table.scope(
+        select(c.year, func.sum(c.debit).label("debit"), func.sum(c.credit).label("credit"))
+        .group_by(c.year)
+        .order_by(c.year)
+    )
+    return [row._asdict() for row in db.execute(query)]
+
+
+def distinct_years(db, rollup_table):
+    c = rollup_table.c
+    query = rollup_table.scope(select(c.year).distinct().order_by(c.year))
+    return list(db.execute(query).scalars())
@@ -0,0 +1,295 @@
+"""Moves closed years of transactions out of the hot tables into per-year archives.
+
+Every year older than the ARCHIVE_HOT_YEARS most recent ones is moved, tenant by
+tenant, into the shard's archive file for that year (see ``src.partitions``), which
+is then VACUUMed and has its search indexes rebuilt. Rows written into an archived
+year later, and rows taken back for an update or delete, wait in the hot table for
+the next compaction.
+
+    python -m src.archive compact [--user NAME] [--hot-years 2] [--dry-run]
+    python -m src.archive restore --user NAME [--year 2019]
+
+``restore`` moves archived years back into the hot table, e.g. before
+``src.rebalance_shards`` or ``src.migrate_storage``, which refuse tenants that have
+archives. With ARCHIVE_COMPACT_INTERVAL_SECONDS set, every API worker also runs
+``compact`` in the background at that interval, one process at a time.
+
+A year is copied into the archive and committed there before it is deleted from the
+hot table and listed in the catalogue, so an interrupted move leaves the rows in the
+hot table and the next run copies them again. Writes that span the hot table and an
+archive commit the hot table first, so a crash between the two files leaves a row in
+both rather than in neither, until the next compaction of that year.
+"""
+import argparse
+import asyncio
+import datetime
+import fcntl
+import os
+import traceback
+from contextlib import contextmanager
+from sqlalchemy import Integer, cast, create_engine, func, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from src.database import SQLITE_PRAGMAS, DatabaseManager, create_missing_indexes, shards
+from src import balance, partitions, rollup, search
+
+
+ARCHIVE_HOT_YEARS = int(os.getenv("ARCHIVE_HOT_YEARS", "2"))
+# 0 leaves compaction to the command line
+ARCHIVE_COMPACT_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_COMPACT_INTERVAL_SECONDS", "0"))
+
+
+def _resolve_tables(user_name: str):
+    """Resolves the user's tables, and the triggers and catalogue a move touches, ahead of
+    the move's transaction."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is not None:
+        rollup.get_rollup_table(user_name)
+        balance.get_checkpoint_table(user_name)
+        search.get_search_table(user_name)
+        partitions.get_catalogue_table()
+    return user_table
+
+
+def _in_year(user_table, year: int):
+    return user_table.c.date >= datetime.date(year, 1, 1), user_table.c.date < datetime.date(year + 1, 1, 1)
+
+
+def cold_years(user_table, hot_years: int = ARCHIVE_HOT_YEARS):
+    """Years before the ``hot_years`` most recent that still have rows in the hot table."""
+    first_hot = datetime.date(datetime.date.today().year - max(hot_years, 1) + 1, 1, 1)
+    year = cast(func.strftime("%Y", user_table.c.date), Integer)
+    query = user_table.scope(select(year).distinct()).where(user_table.c.date < first_hot).order_by(year)
+    with user_table.shard.engine.connect() as conn:
+        return list(conn.execute(query).scalars())
+
+
+@contextmanager
+def _aggregates_paused(conn, user_name: str, user_table):
+    """Drops the rollup and balance triggers for the block, for rows that move between
+    the hot table and an archive: they stay counted wherever they are. Other writers
+    don't see the gap, the caller's transaction holds the write lock throughout."""
+    rollup_table = rollup.get_rollup_table(user_name)
+    checkpoint_table = balance.get_checkpoint_table(user_name)
+    rollup.drop_triggers(conn, rollup_table)
+    balance.drop_triggers(conn, checkpoint_table)
+    yield
+    rollup.install_triggers(conn, user_table, rollup_table)
+    balance.install_triggers(conn, user_table, checkpoint_table)
+
+
+def _copy_year(user_name: str, user_table, year: int):
+    """Copies the user's hot rows of ``year`` into its archive, created if need be, and
+    commits there; returns the number of rows copied."""
+    shard = user_table.shard
+    search_table = search.get_search_table(user_name)
+    archive = partitions.archive_table(user_table, year)
+    in_year = _in_year(user_table, year)
+    with shard.engine.connect() as conn:
+        schema = partitions.attach(conn, shard, year)
+        # Only outside a transaction; a no-op for an archive that exists
+        conn.exec_driver_sql(f"PRAGMA {schema}.journal_mode={SQLITE_PRAGMAS['journal_mode']}")
+        try:
+            archive.table.create(conn, checkfirst=True)
+            create_missing_indexes(conn, archive.table)
+            conn.exec_driver_sql(search.create_sql(search_table, schema))
+            search.install_triggers(conn, user_table, search_table, schema)
+            # Rows left by a move that was interrupted before the hot table committed:
+            # all of the user's rows, if the year was never listed, or else those of
+            # the rows about to be copied again
+            leftovers = archive.delete()
+            if year in partitions.archived_years(conn, user_table):
+                hot_rows = user_table.scope(select(user_table.c.reference_no)).where(*in_year)
+                leftovers = leftovers.where(archive.c.reference_no.in_(hot_rows))
+            conn.execute(leftovers)
+            copied = conn.execute(
+                archive.table.insert().from_select(
+                    [column.name for column in user_table.table.c],
+                    user_table.scope(select(*user_table.table.c)).where(*in_year),
+                )
+            ).rowcount
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        # It changed the archive's schema, which the checks in ``create_sqlite_engine``
+        # don't see: don't hand it back to the pool
+        conn.invalidate()
+    return copied
+
+
+def move_year(user_name: str, user_table, year: int):
+    """Moves the user's hot rows of ``year`` into its archive; returns how many moved.
+
+    The hot table is write-locked from before the copy until its rows are gone, so no
+    write to them can fall in between.
+    """
+    catalogue = partitions.get_catalogue_table()
+    table_name, username = partitions.catalogue_key(user_table)
+    with user_table.shard.engine.begin() as conn:
+        # BEGIN IMMEDIATE write-locks every database attached to the connection, and the
+        # copy writes the archive from a connection of its own
+        partitions.detach(conn, year)
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        moved = _copy_year(user_name, user_table, year)
+        with _aggregates_paused(conn, user_name, user_table):
+            conn.execute(user_table.delete().where(*_in_year(user_table, year)))
+        conn.execute(
+            insert(catalogue).on_conflict_do_nothing(), {"table_name": table_name, "username": username, "year": year}
+        )
+    return moved
+
+
+def vacuum_archive(shard, year: int):
+    """VACUUMs the shard's ``year`` archive, then rebuilds the search indexes in it,
+    since VACUUM may renumber the rowids they refer to."""
+    archive_engine = create_engine(
+        f"sqlite:///{partitions.archive_path(shard, year)}", poolclass=NullPool,
+        connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000},
+    )
+    try:
+        with archive_engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.exec_driver_sql("VACUUM")
+            indexes = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"
+            )).scalars().all()
+            for name in indexes:
+                search._rebuild(conn, name)
+    finally:
+        archive_engine.dispose()
+
+
+def compact(user_names=None, hot_years: int = ARCHIVE_HOT_YEARS, dry_run: bool = False):
+    """Moves every cold year of ``user_names`` (default: every user) into the archives
+    and VACUUMs the archives that changed; returns ``{user: {year: rows}}``."""
+    moved = {}
+    touched = set()
+    for user_name in user_names or DatabaseManager.user_names():
+        user_table = _resolve_tables(user_name)
+        if user_table is None:
+            continue
+        years = cold_years(user_table, hot_years)
+        if dry_run:
+            moved[user_name] = {year: None for year in years}
+            continue
+        moved[user_name] = {year: move_year(user_name, user_table, year) for year in years}
+        touched.update((user_table.shard.index, year) for year in years)
+    for shard_index, year in sorted(touched):
+        vacuum_archive(shards[shard_index], year)
+    return moved
+
+
+def restore(user_name: str, years=None):
+    """Moves archived years (default: all of them) of the user back into the hot table;
+    returns ``{year: rows}``."""
+    user_table = _resolve_tables(user_name)
+    if user_table is None:
+        return {}
+    catalogue = partitions.get_catalogue_table()
+    table_name, username = partitions.catalogue_key(user_table)
+    with user_table.shard.engine.connect() as conn:
+        archived = partitions.archived_years(conn, user_table)
+    restored = {}
+    for year in archived:
+        if years and year not in years:
+            continue
+        archive = partitions.archive_table(user_table, year)
+        with user_table.shard.engine.begin() as conn:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            partitions.attach(conn, user_table.shard, year)
+            with _aggregates_paused(conn, user_name, user_table):
+                restored[year] = conn.execute(
+                    user_table.table.insert().from_select(
+                        [column.name for column in archive.table.c], archive.scope(select(*archive.table.c))
+                    )
+                ).rowcount
+            conn.execute(catalogue.delete().where(
+                catalogue.c.table_name == table_name, catalogue.c.username == username, catalogue.c.year == year
+            ))
+            conn.execute(archive.delete())
+    return restored
+
+
+def _archived_year_of(user_table, reference_no: str):
+    """The archived year holding ``reference_no``. Looked up on a connection of its own, so
+    the caller's transaction attaches (and keeps locked) only that one archive."""
+    query = user_table.scope(select(user_table.c.reference_no)).where(user_table.c.reference_no == reference_no)
+    with user_table.shard.engine.connect() as conn:
+        for year in reversed(partitions.archived_years(conn, user_table)):
+            if partitions.execute(conn, user_table, query, year).first() is not None:
+                return year
+    return None
+
+
+def restore_row(db, user_name: str, user_table, reference_no: str):
+    """Moves the row ``reference_no`` back from its archive into the hot table, inside the
+    caller's write transaction, so it can be updated or deleted there; returns whether
+    there was one.
+
+    The aggregate triggers are dropped and recreated for it, a schema change; this is
+    for the rare write to a closed year.
+    """
+    year = _archived_year_of(user_table, reference_no)
+    if year is None:
+        return False
+    conn = db.connection()
+    partitions.attach(conn, user_table.shard, year)
+    archive = partitions.archive_table(user_table, year)
+    row = archive.scope(select(*archive.table.c)).where(archive.c.reference_no == reference_no)
+    with _aggregates_paused(conn, user_name, user_table):
+        restored = conn.execute(
+            user_table.table.insert().from_select([column.name for column in archive.table.c], row)
+        ).rowcount
+    conn.execute(archive.delete().where(archive.c.reference_no == reference_no))
+    return restored > 0
+
+
+def _compact_lock_path():
+    return f"{os.path.splitext(make_url(shards[0].url).database)[0]}.compact.lock"
+
+
+def compact_exclusively():
+    """``compact``, unless another process is already running it (then ``None``)."""
+    with open(_compact_lock_path(), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        return compact()
+
+
+async def compact_periodically(interval: float = ARCHIVE_COMPACT_INTERVAL_SECONDS):
+    """Runs ``compact`` every ``interval`` seconds on a worker thread, until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(compact_exclusively)
+        except Exception:
+            traceback.print_exc()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed years of transactions into per-year archives")
+    parser.add_argument("command", choices=["compact", "restore"])
+    parser.add_argument("--user", help="Only process this user (default: every user; required for restore)")
+    parser.add_argument("--hot-years", type=int, default=ARCHIVE_HOT_YEARS,
+                        help="Most recent years kept in the hot table (default: ARCHIVE_HOT_YEARS)")
+    parser.add_argument("--year", type=int, action="append", help="Only restore this year (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the years that would move")
+    args = parser.parse_args()
+
+    if args.command == "restore":
+        if not args.user:
+            parser.error("restore needs --user")
+        for year, rows in restore(args.user, args.year).items():
+            print(f"{args.user}: {year} restored, {rows} rows")
+        return
+    for user_name, years in compact([args.user] if args.user else None, args.hot_years, args.dry_run).items():
+        for year, rows in years.items():
+            print(f"{user_name}: {year} {'to archive' if args.dry_run else f'archived, {rows} rows'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,61 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import event, inspect, Column, Integer, String
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
-from typing import Optional
+from typing import NamedTuple, Optional
+from src import metrics
+from src.database import DB_MODE, create_sqlite_engine, get_db, run_db
 
 # JWT Config
 SECRET_KEY = "your_secret_key"  # Change this!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Authenticated-user cache (AUTH_CACHE_SIZE=0 disables it). Deleting a user or changing
+# their password through this process's ORM drops their entries at once; other worker
+# processes, admin scripts and bulk UPDATE/DELETE on another connection are only seen
+# once an entry expires, so a revoked token can keep working for up to the TTL.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "5"))
+
+# Password hashing pool: bcrypt runs on PASSWORD_HASH_WORKERS threads with at most
+# PASSWORD_HASH_QUEUE_LIMIT calls waiting; 0 workers hashes inline on the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
 # Database Setup for Auth
-AUTH_DATABASE_URL = "sqlite:///databases/auth.db"
-auth_engine = create_engine(AUTH_DATABASE_URL, connect_args={"check_same_thread": False})
-AuthSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=auth_engine)
+AUTH_DATABASE_URL = os.getenv("AUTH_DATABASE_URL", "sqlite:///databases/auth.db")
+auth_engine = create_sqlite_engine(AUTH_DATABASE_URL)
+metrics.instrument_engine(auth_engine, "auth")
+
+
+class AuthSession(Session):
+    """Session on the auth database, for the user cache's invalidation hooks."""
+
+
+AuthSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=auth_engine, class_=AuthSession)
 AuthBase = declarative_base()
 
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    auth_async_engine = create_sqlite_engine(AUTH_DATABASE_URL, use_async=True)
+    metrics.instrument_engine(auth_async_engine, "auth_async")
+    AuthAsyncSessionLocal = async_sessionmaker(
+        auth_async_engine, autoflush=False, expire_on_commit=False, sync_session_class=AuthSession
+    )
+else:
+    auth_async_engine = AuthAsyncSessionLocal = None
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -30,10 +68,138 @@ class User(AuthBase):
     hashed_password = Column(String)
 
 
-AuthBase.metadata.create_all(bind=auth_engine)
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def init_db():
+    """Creates the auth tables. The app runs it at startup rather than at import, so
+    importing this module (e.g. in a prefork parent) opens no database connection;
+    ``get_auth_db`` runs it on first use for anything started without the app's lifespan."""
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                with auth_engine.begin() as conn:
+                    # Workers starting together would otherwise race between check and CREATE
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    AuthBase.metadata.create_all(bind=conn)
+                _schema_ready = True
+
+
+class AuthenticatedUser(NamedTuple):
+    id: int
+    username: str
+
 
+class AuthUserCache:
+    """Bounded LRU of token -> resolved user, with entries expiring after ``ttl`` seconds
+    or at the token's own expiry, whichever comes first.
+
+    A hit skips both the JWT signature check and the auth DB lookup.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._discard(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return user
+
+    def put(self, token: str, user: AuthenticatedUser, token_expiry: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expiry is not None:
+            expires_at = min(expires_at, token_expiry)
+        with self._lock:
+            self._discard(token)
+            self._entries[token] = (user, expires_at)
+            self._tokens_by_user.setdefault(user.username, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_user(self, username: str):
+        """Drops every cached token of ``username``."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(username, ())):
+                self._discard(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _discard(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0].username)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0].username]
+
+
+user_cache = AuthUserCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    user_cache.invalidate_user(target.username)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.hashed_password.history.has_changes() or state.attrs.username.history.has_changes():
+        for username in {target.username, *state.attrs.username.history.deleted}:
+            user_cache.invalidate_user(username)
+
+
+@event.listens_for(AuthSession, "do_orm_execute")
+def _invalidate_bulk_changed_users(orm_execute_state):
+    # ``query(User).update()/delete()`` bypasses the mapper events above and doesn't
+    # say which users it hit
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is inspect(User):
+        user_cache.clear()
+
+
+async def get_auth_db():
+    if not _schema_ready:
+        init_db()
+    if AuthAsyncSessionLocal is not None:
+        async with AuthAsyncSessionLocal() as db:
+            yield db
+        return
 
-def get_auth_db():
     db = AuthSessionLocal()
     try:
         yield db
@@ -66,6 +232,68 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+class PasswordHashPool:
+    """Runs bcrypt calls off the event loop on a bounded thread pool.
+
+    bcrypt releases the GIL, so the loop keeps serving other requests while a hash
+    is computed. When every worker is busy and the queue is full the call is
+    rejected with 503 instead of piling up.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers > 0 else None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        fn = metrics.timed("bcrypt", fn)
+        if self._slots is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password hashing is saturated, retry later",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        # Created lazily so the threads are started in the serving process
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hash_pool = PasswordHashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
+
+
+def _auth_metrics():
+    stats = user_cache.stats()
+    return [
+        ("auth_cache_hits_total", "counter", "Token lookups served from the user cache", stats["hits"]),
+        ("auth_cache_misses_total", "counter", "Token lookups that decoded the JWT", stats["misses"]),
+        ("auth_cache_size", "gauge", "Tokens held in the user cache", stats["size"]),
+        ("password_hash_rejected_total", "counter", "bcrypt calls rejected with 503", password_hash_pool.rejected),
+    ]
+
+
+metrics.register_collector(_auth_metrics)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
@@ -77,41 +305,60 @@ def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
 
-def get_current_user(token: str, db: Session = Depends(get_auth_db)):
+def create_user(db: Session, username: str, hashed_password: str):
+    new_user = User(username=username, hashed_password=hashed_password)
+    db.add(new_user)
+    db.commit()
+    return new_user
+
+
+async def get_current_user(token: str, db: Session = Depends(get_auth_db)):
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.stage("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        user = get_user_by_username(db, username)
+        with metrics.stage("auth_db_lookup"):
+            user = await run_db(db, get_user_by_username, username)
         if user is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-        return user
+        authenticated_user = AuthenticatedUser(id=user.id, username=user.username)
+        user_cache.put(token, authenticated_user, payload.get("exp"))
+        return authenticated_user
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
+async def get_user_db(current_user=Depends(get_current_user)):
+    """A transactions session on the shard that holds the current user's data."""
+    async for db in get_db(current_user.username):
+        yield db
+
+
 # FastAPI Router
 router = APIRouter()
 
 
 @router.post("/signup/")
 async def signup(user: UserSignup, db: Session = Depends(get_auth_db)):
-    existing_user = get_user_by_username(db, user.username)
+    existing_user = await run_db(db, get_user_by_username, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already taken")
 
-    hashed_password = get_password_hash(user.password)
-    new_user = User(username=user.username, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
+    hashed_password = await password_hash_pool.run(get_password_hash, user.password)
+    await run_db(db, create_user, user.username, hashed_password)
     return {"message": "User registered successfully"}
 
 
 @router.post("/login/", response_model=Token)
 async def login(user: UserLogin, db: Session = Depends(get_auth_db)):
-    db_user = get_user_by_username(db, user.username)
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+    db_user = await run_db(db, get_user_by_username, user.username)
+    if not db_user or not await password_hash_pool.run(verify_password, user.password, db_user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     access_token = create_access_token(data={"sub": db_user.username},
@@ -0,0 +1,293 @@
+"""Per-user running balance (credit - debit, ordered by ``(date, reference_no)``).
+
+Month-end balances are stored as checkpoints, one per month that has transactions,
+and kept current by SQLite triggers on the transaction table: a write dated in
+month M adds its net amount to the checkpoints of M and every later month, so a
+backdated change only touches the checkpoints after it. A balance as of any
+position then costs one checkpoint lookup plus a scan of the rows since it.
+
+Rows of archived years (``src.partitions``) count towards the checkpoints like rows
+of the hot table, so moving rows between partitions leaves the checkpoints as they are.
+
+    python -m src.balance rebuild [--user NAME]
+    python -m src.balance check [--user NAME]
+"""
+import argparse
+import datetime
+import math
+from collections import defaultdict
+from typing import Optional
+from sqlalchemy import Column, Float, Integer, String, Table, cast, func, literal, select, text, tuple_
+from src.database import DatabaseManager, engine, metadata
+from src import listing, partitions
+
+
+CHECK_TOLERANCE = 1e-6
+TRIGGER_SUFFIXES = ("insert", "delete", "update_old", "update_new")
+
+
+def get_user_checkpoint_table(user_name: str):
+    """The user's own checkpoint table, or with ``user_name=None`` the shared one."""
+    tenant_columns = [] if user_name else [Column("username", String, primary_key=True)]
+    return Table(
+        f"{user_name}_balance_checkpoints" if user_name else "balance_checkpoints",
+        metadata,
+        *tenant_columns,
+        Column("year", Integer, primary_key=True),
+        Column("month", Integer, primary_key=True),
+        Column("balance", Float, default=0.0, nullable=False),
+        extend_existing=True,
+    )
+
+
+def get_checkpoint_table(user_name: str):
+    """Returns the user's checkpoint table, making sure its maintenance triggers exist.
+
+    Like the rollup, call it only once the user's transaction table exists; a newly
+    created table is filled from it in the same transaction that installs the triggers.
+    """
+    def prepare(checkpoint_table, created):
+        user_table = DatabaseManager.get_table(user_name)
+        # ``_fill`` reads the archive catalogue while this transaction holds the write lock
+        partitions.get_catalogue_table()
+        with user_table.shard.engine.begin() as conn:
+            install_triggers(conn, user_table, checkpoint_table)
+            if created:
+                _fill(conn, user_table, checkpoint_table)
+
+    return DatabaseManager.resolve_table(
+        user_name, "balance", get_user_checkpoint_table, create=True, on_resolve=prepare
+    )
+
+
+def _net(user_table):
+    return func.coalesce(user_table.c.credit, 0) - func.coalesce(user_table.c.debit, 0)
+
+
+def monthly_nets_query(user_table):
+    """Net amount of every month that has transactions, from one partition of the base table."""
+    year_col = cast(func.strftime("%Y", user_table.c.date), Integer).label("year")
+    month_col = cast(func.strftime("%m", user_table.c.date), Integer).label("month")
+    return user_table.scope(
+        select(year_col, month_col, func.sum(_net(user_table)).label("net"))
+        .where(user_table.c.date.is_not(None))
+        .group_by(year_col, month_col)
+    )
+
+
+def month_end_balances(conn, user_table):
+    """Cumulative balance at the end of every month that has transactions, from the
+    base table and its archived years, as ``{(year, month): balance}``."""
+    query = monthly_nets_query(user_table)
+    nets = defaultdict(float)
+    for row in [*conn.execute(query), *partitions.archived_rows(user_table, query)]:
+        nets[row.year, row.month] += row.net
+    balances = {}
+    balance = 0.0
+    for key in sorted(nets):
+        balance += nets[key]
+        balances[key] = balance
+    return balances
+
+
+def _fill(conn, user_table, checkpoint_table):
+    tenant_values = checkpoint_table.tenant_values
+    checkpoints = [
+        {"year": year, "month": month, "balance": balance, **tenant_values}
+        for (year, month), balance in month_end_balances(conn, user_table).items()
+    ]
+    conn.execute(checkpoint_table.delete())
+    if checkpoints:
+        conn.execute(checkpoint_table.table.insert(), checkpoints)
+
+
+def _trigger_statements(user_table, checkpoint_table):
+    quote = engine.dialect.identifier_preparer.quote
+    base, checkpoints = quote(user_table.table.name), quote(checkpoint_table.table.name)
+    shared = "username" in checkpoint_table.c
+
+    def apply(row, sign):
+        year = f"CAST(strftime('%Y', {row}.date) AS INTEGER)"
+        month = f"CAST(strftime('%m', {row}.date) AS INTEGER)"
+        tenant = f"username = {row}.username AND " if shared else ""
+        # A month without a checkpoint has no other rows, so it opens at the balance
+        # of the closest earlier checkpoint
+        opening = (
+            f"COALESCE((SELECT balance FROM {checkpoints} WHERE {tenant}year * 12 + month < {year} * 12 + {month} "
+            f"ORDER BY year DESC, month DESC LIMIT 1), 0)"
+        )
+        tenant_column, tenant_value = ("username, ", f"{row}.username, ") if shared else ("", "")
+        return (
+            f"INSERT OR IGNORE INTO {checkpoints} ({tenant_column}year, month, balance) "
+            f"VALUES ({tenant_value}{year}, {month}, {opening}); "
+            f"UPDATE {checkpoints} SET balance = balance {sign} (COALESCE({row}.credit, 0) - COALESCE({row}.debit, 0)) "
+            f"WHERE {tenant}year * 12 + month >= {year} * 12 + {month};"
+        )
+
+    def trigger(suffix, event, row, sign):
+        name = quote(f"{checkpoint_table.table.name}_{suffix}")
+        return (
+            f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {base} "
+            f"WHEN {row}.date IS NOT NULL BEGIN {apply(row, sign)} END"
+        )
+
+    columns = "date, debit, credit"
+    return [
+        trigger("insert", "INSERT", "NEW", "+"),
+        trigger("delete", "DELETE", "OLD", "-"),
+        trigger("update_old", f"UPDATE OF {columns}", "OLD", "-"),
+        trigger("update_new", f"UPDATE OF {columns}", "NEW", "+"),
+    ]
+
+
+def install_triggers(conn, user_table, checkpoint_table):
+    """Creates the insert/update/delete triggers that carry row changes into later checkpoints."""
+    for statement in _trigger_statements(user_table, checkpoint_table):
+        conn.execute(text(statement))
+
+
+def drop_triggers(conn, checkpoint_table):
+    """Drops the triggers again, for rows that move between partitions without changing the balance."""
+    quote = engine.dialect.identifier_preparer.quote
+    for suffix in TRIGGER_SUFFIXES:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {quote(f'{checkpoint_table.table.name}_{suffix}')}"))
+
+
+def _next_month(year: int, month: int):
+    return datetime.date(year + month // 12, month % 12 + 1, 1)
+
+
+def balance_before(db, user_table, checkpoint_table, date: datetime.date, reference_no: str = ""):
+    """Balance over every row strictly before the ``(date, reference_no)`` position.
+
+    Starts from the last checkpoint of an earlier month and adds the rows after it.
+    """
+    c = checkpoint_table.c
+    checkpoint = db.execute(
+        checkpoint_table.scope(select(c.year, c.month, c.balance))
+        .where(c.year * 12 + c.month < date.year * 12 + date.month)
+        .order_by(c.year.desc(), c.month.desc())
+        .limit(1)
+    ).first()
+
+    query = user_table.scope(select(func.coalesce(func.sum(_net(user_table)), 0.0))).where(
+        tuple_(user_table.c.date, user_table.c.reference_no) < tuple_(literal(date), literal(reference_no))
+    )
+    opening, since = 0.0, None
+    if checkpoint is not None:
+        opening, since = checkpoint.balance, _next_month(checkpoint.year, checkpoint.month)
+        query = query.where(user_table.c.date >= since)
+    return opening + sum(result.scalar() for result in partitions.execute_all(db, user_table, query, since, date))
+
+
+def balance_as_of(db, user_table, checkpoint_table, as_of: datetime.date):
+    """Balance at the end of ``as_of``."""
+    return balance_before(db, user_table, checkpoint_table, as_of + datetime.timedelta(days=1))
+
+
+def monthly_balances(db, checkpoint_table, date_from: Optional[datetime.date] = None,
+                     date_to: Optional[datetime.date] = None):
+    """Month-end balances for every month in range, read from the checkpoints only.
+
+    Months without transactions carry the previous balance forward; the series is
+    clipped to the months between the first and the last checkpoint.
+    """
+    c = checkpoint_table.c
+    key = c.year * 12 + c.month
+    first_key = date_from.year * 12 + date_from.month if date_from else None
+    last_key = date_to.year * 12 + date_to.month if date_to else None
+
+    query = checkpoint_table.scope(select(c.year, c.month, c.balance)).order_by(c.year, c.month)
+    if last_key is not None:
+        query = query.where(key <= last_key)
+    checkpoints = db.execute(query).all()
+    if not checkpoints:
+        return []
+
+    series = []
+    balance = None
+    start_key = checkpoints[0].year * 12 + checkpoints[0].month
+    end_key = checkpoints[-1].year * 12 + checkpoints[-1].month
+    by_key = {row.year * 12 + row.month: row.balance for row in checkpoints}
+    for month_key in range(start_key, end_key + 1):
+        balance = by_key.get(month_key, balance)
+        if first_key is None or month_key >= first_key:
+            year, month = divmod(month_key - 1, 12)
+            series.append({"year": year, "month": month + 1, "balance": balance})
+    return series
+
+
+def running_balance(db, user_table, checkpoint_table, query, after, limit: int,
+                    date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """One page of ``query`` (a ``(date, reference_no)``-ordered listing, built with the
+    ``date_from`` / ``date_to`` bounds) with each row's balance after it; the page opens
+    from the balance before its first row."""
+    rows = listing.fetch_page(db, user_table, query, after, limit, date_from, date_to)
+    if not rows:
+        return rows, []
+    balance = balance_before(db, user_table, checkpoint_table, rows[0].date, rows[0].reference_no)
+    balances = []
+    for row in rows:
+        balance += (row.credit or 0.0) - (row.debit or 0.0)
+        balances.append(balance)
+    return rows, balances
+
+
+def rebuild(user_name: str):
+    """Regenerates the user's checkpoints from the base transaction table."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        return
+    checkpoint_table = get_checkpoint_table(user_name)
+    with user_table.shard.engine.begin() as conn:
+        _fill(conn, user_table, checkpoint_table)
+
+
+def check(user_name: str):
+    """Compares the stored checkpoints with freshly computed month-end balances."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        return []
+    checkpoint_table = get_checkpoint_table(user_name)
+
+    db = user_table.shard.SessionLocal()
+    try:
+        expected = month_end_balances(db, user_table)
+        stored = {(r.year, r.month): r.balance for r in db.execute(checkpoint_table.select())}
+    finally:
+        db.close()
+
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        # A checkpoint left on a month whose rows were all deleted still holds the
+        # balance carried from the months before it
+        earlier = [month for month in expected if month <= key]
+        want = expected[max(earlier)] if earlier else 0.0
+        got = stored.get(key)
+        if got is None or not math.isclose(want, got, abs_tol=CHECK_TOLERANCE):
+            mismatches.append({"key": key, "expected": want, "stored": got})
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-user balance checkpoints")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user", help="Only process this user (default: every user)")
+    args = parser.parse_args()
+
+    failed = False
+    for user_name in [args.user] if args.user else DatabaseManager.user_names():
+        if args.command == "rebuild":
+            rebuild(user_name)
+            print(f"{user_name}: rebuilt")
+        else:
+            mismatches = check(user_name)
+            failed |= bool(mismatches)
+            print(f"{user_name}: {'ok' if not mismatches else f'{len(mismatches)} mismatched months'}")
+            for mismatch in mismatches:
+                print(f"  {mismatch}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Transaction CRUD operations on a synchronous ``Session``.
+
+The handlers run these through ``run_db`` so the same code serves both the sync
+session and, in async mode, ``AsyncSession.run_sync``. Writes go through
+``group_commit.write``, which can also batch them into a shared transaction.
+"""
+import functools
+import os
+import threading
+from fastapi import HTTPException
+from sqlalchemy import Float, cast
+from src.database import DatabaseManager
+from src import archive, balance, idempotency, partitions, rollup, search, versions
+
+
+BULK_INSERT_CHUNK_SIZE = 500
+# Users whose tables the app resolves in the background once it is serving (0 leaves
+# every user to their first request). Each costs ~10 ms of DDL and checks, taken one
+# user at a time under the table registry lock.
+TABLE_PRELOAD_LIMIT = int(os.getenv("TABLE_PRELOAD_LIMIT", "100"))
+
+
+def _get_user_table(user_name: str, create: bool = False):
+    """Resolves the user's table and, for writes, the triggers that maintain their rollup,
+    balance checkpoints and search index, and the data version, idempotency key and
+    archive catalogue tables the write touches."""
+    user_table = DatabaseManager.get_table(user_name, create)
+    if user_table is None:
+        raise HTTPException(status_code=404, detail=f"User table '{user_name}_transactions' does not exist")
+    rollup.get_rollup_table(user_name)
+    balance.get_checkpoint_table(user_name)
+    search.get_search_table(user_name)
+    versions.get_versions_table()
+    idempotency.get_keys_table()
+    partitions.get_catalogue_table()
+    return user_table
+
+
+def preload_tables(limit: int = TABLE_PRELOAD_LIMIT, stop: threading.Event = None):
+    """Resolves the tables of up to ``limit`` existing users into the registry, with
+    the triggers a write needs, until ``stop`` is set; returns how many users were loaded."""
+    user_names = DatabaseManager.user_names()[:limit] if limit > 0 else []
+    for loaded, user_name in enumerate(user_names):
+        if stop is not None and stop.is_set():
+            return loaded
+        _get_user_table(user_name)
+    return len(user_names)
+
+
+def _returning_columns(user_table):
+    # SQLite can hand back integral REAL values as integers from RETURNING; cast them
+    # so the response matches a plain SELECT
+    return [
+        cast(column, Float).label(column.name) if isinstance(column.type, Float) else column
+        for column in user_table.columns
+    ]
+
+
+def _not_found(reference_no: str):
+    return HTTPException(status_code=404, detail=f"Transaction with reference {reference_no} not found")
+
+
+def _write(create: bool = False):
+    """Turns ``apply(db, user_name, ...)``, which leaves its changes uncommitted, into a
+    write that resolves the user's tables and then commits, or rolls back on error.
+
+    The group-commit writer runs ``.prepare`` and ``.apply`` itself, so many writes
+    can share one transaction.
+    """
+    def decorate(apply):
+        @functools.wraps(apply)
+        def write(db, user_name: str, *args):
+            write.prepare(user_name)
+            try:
+                result = apply(db, user_name, *args)
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            return result
+
+        write.prepare = functools.partial(_get_user_table, create=create)
+        write.apply = apply
+        return write
+    return decorate
+
+
+@_write(create=True)
+def insert_transactions(db, user_name: str, rows, idempotency_key: str = None, fingerprint: str = None,
+                        response: dict = None):
+    """Inserts ``rows`` (dicts with every column) in chunked executemany batches and one commit.
+
+    With an ``idempotency_key``, ``response`` is stored under the key in the same
+    transaction. A key that was already used skips the insert; its stored response
+    is returned then, ``None`` otherwise.
+    """
+    user_table = _get_user_table(user_name, create=True)
+    if idempotency_key is not None:
+        stored = idempotency.claim(db, user_name, idempotency_key, fingerprint, response)
+        if stored is not None:
+            stored_fingerprint, stored_response = stored
+            if stored_fingerprint != fingerprint:
+                raise HTTPException(
+                    status_code=422, detail="Idempotency-Key was already used with a different request body"
+                )
+            return stored_response
+
+    insert_stmt = user_table.insert()
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        db.execute(insert_stmt, rows[start:start + BULK_INSERT_CHUNK_SIZE])
+    versions.bump(db, user_name)
+    return None
+
+
+def get_transaction(db, user_name: str, reference_no: str):
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        raise HTTPException(status_code=404, detail=f"User table '{user_name}_transactions' does not exist")
+
+    select_stmt = user_table.select().where(user_table.c.reference_no == reference_no)
+    transaction = partitions.first(db, user_table, select_stmt)
+
+    if not transaction:
+        raise _not_found(reference_no)
+
+    return dict(zip(transaction._fields, transaction))
+
+
+@_write()
+def update_transaction(db, user_name: str, reference_no: str, values: dict):
+    """Updates the given columns in one ``UPDATE ... RETURNING`` and returns the new row.
+
+    A row of an archived year is moved back into the hot table first.
+    """
+    user_table = _get_user_table(user_name)
+
+    update_stmt = (
+        user_table.update()
+        .where(user_table.c.reference_no == reference_no)
+        .values(**values)
+        .returning(*_returning_columns(user_table))
+    )
+    transaction = db.execute(update_stmt).fetchone()
+    if not transaction and archive.restore_row(db, user_name, user_table, reference_no):
+        transaction = db.execute(update_stmt).fetchone()
+
+    if not transaction:
+        raise _not_found(reference_no)
+
+    versions.bump(db, user_name)
+    return dict(zip(transaction._fields, transaction))
+
+
+@_write()
+def delete_transaction(db, user_name: str, reference_no: str):
+    user_table = _get_user_table(user_name)
+
+    delete_stmt = user_table.delete().where(user_table.c.reference_no == reference_no)
+    result = db.execute(delete_stmt)
+    if result.rowcount == 0 and archive.restore_row(db, user_name, user_table, reference_no):
+        result = db.execute(delete_stmt)
+
+    if result.rowcount == 0:
+        raise _not_found(reference_no)
+
+    versions.bump(db, user_name)
@@ -1,26 +1,322 @@
+import os
+import asyncio
+import bisect
+import hashlib
 import uuid
 import datetime
-from sqlalchemy import create_engine, Column, String, Float, Date, Table, MetaData
+import threading
+from sqlalchemy import create_engine, event, exc, inspect, select, Column, String, Float, Date, Index, Table, MetaData
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from sqlalchemy.schema import CreateIndex
 
+from src import metrics
 
-DATABASE_URL = "sqlite:///databases/transactions_info.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///databases/transactions_info.db")
+
+# "sync" runs queries on a blocking Session, "async" on an aiosqlite-backed AsyncSession
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+# "per_user" keeps one {username}_transactions table per user, "shared" keeps every
+# user's rows in one transactions table keyed by (username, reference_no)
+STORAGE_MODE = os.getenv("STORAGE_MODE", "per_user")
+
+# SQLite tuning applied to every new connection. SQLITE_PROFILE=default leaves
+# SQLite and the pool at their stock settings.
+#
+# cache_size is private to each connection, so its worst case is cache_size x
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW) x DB_SHARDS x workers: 2 MiB x 30 x 1 x 1 = 60 MiB
+# by default. Hot pages are shared through the OS page cache instead, which mmap_size
+# lets connections read without copying; raise cache_size only with few connections.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned")
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-2048")),  # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+# Tenants are spread over DB_SHARDS SQLite files by consistent hashing of the username.
+# Shard 0 is DATABASE_URL and shard i its sibling "<name>.shard<i>.db", unless
+# DATABASE_SHARD_URL_TEMPLATE (e.g. "sqlite:////mnt/disk{shard}/transactions.db") says otherwise.
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+DATABASE_SHARD_URL_TEMPLATE = os.getenv("DATABASE_SHARD_URL_TEMPLATE")
+SHARD_VIRTUAL_NODES = 160
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Connections each engine opens at app startup, so the first requests don't pay for them
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", "2"))
+
+
+def to_async_url(url: str) -> str:
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def create_sqlite_engine(url: str, use_async: bool = False, profile: str = None):
+    """Creates a (sync or aiosqlite) engine for ``url`` with the configured SQLite profile.
+
+    The ``tuned`` profile switches to WAL with ``synchronous=NORMAL`` so readers no
+    longer block behind writers, waits on locks instead of failing with "database is
+    locked", and sizes the connection pool for concurrent requests.
+    """
+    profile = profile or SQLITE_PROFILE
+    tuned = profile == "tuned"
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if tuned and ":memory:" not in url:
+        kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+
+    if use_async:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        new_engine = create_async_engine(to_async_url(url), **kwargs)
+        sync_engine = new_engine.sync_engine
+    else:
+        new_engine = sync_engine = create_engine(url, **kwargs)
+
+    if tuned:
+        @event.listens_for(sync_engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            apply_sqlite_pragmas(dbapi_connection, SQLITE_PRAGMAS)
+
+    # A connection that changed the schema can fail its next write to a table with
+    # trigger-maintained FTS5 and rollup tables ("no such table", SQLite 3.40) once
+    # another connection has changed the schema too, so it is replaced rather than
+    # reused. DDL that changed nothing (``IF NOT EXISTS`` on resolve) keeps it.
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if _is_ddl(statement):
+            conn.info["schema_version"] = _schema_version(conn.connection.dbapi_connection)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        if _is_ddl(statement):
+            if conn.info.pop("schema_version", None) != _schema_version(conn.connection.dbapi_connection):
+                conn.info["schema_changed"] = True
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.pop("schema_changed", False):
+            raise exc.DisconnectionError("connection changed the schema")
+
+    _engines.append(new_engine)
+    return new_engine
+
+
+def _is_ddl(statement: str):
+    return statement.lstrip()[:6].upper().startswith(("CREATE", "DROP ", "ALTER "))
+
+
+def _schema_version(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+# Every engine created above, for warm-up at startup and clean-up after a fork
+_engines = []
+
+
+def _dispose_inherited_pools():
+    """Runs in a forked child: drops the pools inherited from the parent without
+    closing their connections, which still belong to the parent."""
+    for created in _engines:
+        getattr(created, "sync_engine", created).dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_inherited_pools)
+
+
+def _warm_pool(sync_engine, connections: int):
+    opened = [sync_engine.connect() for _ in range(connections)]
+    for connection in opened:
+        connection.close()
+
+
+async def warm_pools(connections: int = DB_POOL_PREWARM):
+    """Opens ``connections`` connections on every engine (and their PRAGMAs) and
+    returns them to the pools, so the first requests find them ready."""
+    for created in _engines:
+        if ":memory:" in str(created.url):
+            continue
+        if hasattr(created, "sync_engine"):
+            opened = [await created.connect() for _ in range(connections)]
+            for connection in opened:
+                await connection.close()
+        else:
+            await asyncio.to_thread(_warm_pool, created, connections)
+
+
+def shard_url(index: int) -> str:
+    if DATABASE_SHARD_URL_TEMPLATE:
+        return DATABASE_SHARD_URL_TEMPLATE.format(shard=index)
+    if index == 0:
+        return DATABASE_URL
+    base, extension = os.path.splitext(DATABASE_URL)
+    return f"{base}.shard{index}{extension}"
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring over shard indexes.
+
+    Every shard owns ``virtual_nodes`` points on the ring and a key belongs to the
+    shard of the first point at or after its hash. Going from N to N+1 shards only
+    moves the keys that land on the new shard's points, about 1/(N+1) of them.
+    """
+
+    def __init__(self, shard_count: int, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted(
+            (_ring_hash(f"shard-{shard}#{node}"), shard) for shard in range(shard_count) for node in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def lookup(self, key: str) -> int:
+        if len(self._shards) <= 1:
+            return 0
+        return self._shards[bisect.bisect(self._hashes, _ring_hash(key)) % len(self._shards)]
+
+
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+else:
+    AsyncSession = None
+
+
+class Shard:
+    """One SQLite file holding a subset of the tenants, with its own engine and pool."""
+
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.url = url
+        suffix = f"_shard{index}" if index else ""
+        self.engine = create_sqlite_engine(url)
+        metrics.instrument_engine(self.engine, f"transactions{suffix}")
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        if DB_MODE == "async":
+            self.async_engine = create_sqlite_engine(url, use_async=True)
+            metrics.instrument_engine(self.async_engine, f"transactions_async{suffix}")
+            self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        else:
+            self.async_engine = self.AsyncSessionLocal = None
+
+
+metrics.instrument_sessions(Session)
+shards = [Shard(index, shard_url(index)) for index in range(DB_SHARDS)]
+shard_ring = HashRing(DB_SHARDS)
+
+
+def get_shard(user_name: str) -> Shard:
+    """The shard holding ``user_name``'s tables (and, in shared storage, their rows)."""
+    return shards[shard_ring.lookup(user_name)]
+
+
+# Shard 0, which is the only one unless DB_SHARDS is set
+engine = shards[0].engine
+SessionLocal = shards[0].SessionLocal
+async_engine = shards[0].async_engine
+AsyncSessionLocal = shards[0].AsyncSessionLocal
 Base = declarative_base()
 metadata = MetaData()
 
-def get_db():
-    db = SessionLocal()
+
+async def get_db(user_name: str = None):
+    """Yields a session on ``user_name``'s shard (shard 0 without a user)."""
+    shard = get_shard(user_name) if user_name is not None else shards[0]
+    if shard.AsyncSessionLocal is not None:
+        async with shard.AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = shard.SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
+async def run_db(db, fn, *args):
+    """Calls ``fn(session, *args)`` on a worker thread for a sync ``Session`` or, for an
+    ``AsyncSession``, through ``run_sync``, so its I/O does not block the event loop."""
+    if AsyncSession is not None and isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await asyncio.to_thread(fn, db, *args)
+
+
+def create_missing_indexes(conn, table):
+    """CREATE INDEX IF NOT EXISTS for every index of ``table``; a no-op for those it has."""
+    for index in table.indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+class UserTable:
+    """One user's view of a table: their own table in per-user storage, or their
+    rows of a shared table (tagged with ``username``) in shared storage.
+
+    Statements built through it are scoped to the user, and ``select()`` leaves out
+    the ``username`` column so results look the same in both storage modes. ``shard``
+    is where the table lives; run statements on its engine or sessions.
+    """
+
+    def __init__(self, table, user_name: str = None, shard: Shard = None):
+        self.table = table
+        self.user_name = user_name
+        self.shard = shard
+        self.name = table.name
+        self.c = table.c
+        self.columns = [column for column in table.c if column.name != "username"]
+
+    @property
+    def tenant_values(self):
+        return {} if self.user_name is None else {"username": self.user_name}
+
+    def scope(self, query):
+        if self.user_name is None:
+            return query
+        return query.where(self.table.c.username == self.user_name)
+
+    def select(self):
+        return self.scope(select(*self.columns))
+
+    def insert(self):
+        return self.table.insert().values(**self.tenant_values)
+
+    def update(self):
+        return self.scope(self.table.update())
+
+    def delete(self):
+        return self.scope(self.table.delete())
+
 
 class DatabaseManager:
+    # Process-wide registry of user tables that are known to exist in the database,
+    # so schema reflection / creation runs once per table instead of once per request.
+    _tables = {}
+    _shared_tables = {}
+    _tables_lock = threading.RLock()
+    # Hits are counted on the lock-free fast path, under a lock of their own that is
+    # never held for longer than the increment
+    _hits_lock = threading.Lock()
+    table_cache_hits = 0
+    table_cache_misses = 0
+
     @staticmethod
     def get_user_transactions_table(user_name: str):
         table_name = f"{user_name}_transactions"
@@ -30,13 +326,197 @@ class DatabaseManager:
             metadata,
             Column("reference_no", String, primary_key=True, index=True, default=lambda: str(uuid.uuid4())),
             Column("date", Date, index=True),
-            Column("details", String, index=True, default="REF418873"),
+            Column("details", String, default="REF418873"),
             Column("debit", Float, default=0.0),
             Column("credit", Float, default=0.0),
+            # Serves a details filter in listing order, without sorting every match
+            Index(f"ix_{table_name}_details_date", "details", "date", "reference_no"),
             extend_existing=True,
         )
 
     @staticmethod
-    def ensure_table_exists(user_table):
-        """Ensures the user's transaction table exists."""
-        metadata.create_all(engine)
+    def get_shared_transactions_table():
+        return Table(
+            "transactions",
+            metadata,
+            Column("username", String, primary_key=True),
+            Column("reference_no", String, primary_key=True, default=lambda: str(uuid.uuid4())),
+            Column("date", Date),
+            Column("details", String, default="REF418873"),
+            Column("debit", Float, default=0.0),
+            Column("credit", Float, default=0.0),
+            Index("ix_transactions_username_date", "username", "date"),
+            Index("ix_transactions_username_details_date", "username", "details", "date", "reference_no"),
+            extend_existing=True,
+        )
+
+    @staticmethod
+    def get_tenants_table():
+        """Users registered in shared storage, the counterpart of a per-user table existing."""
+        return Table("tenants", metadata, Column("username", String, primary_key=True), extend_existing=True)
+
+    @staticmethod
+    def ensure_table_exists(user_table, shard: Shard = None):
+        """Ensures the table exists on ``shard``, or on every shard for tables shared by
+        all tenants.
+
+        Tables SQLAlchemy cannot create, such as FTS5 virtual tables, carry their own
+        ``CREATE ... IF NOT EXISTS`` statement in ``info["create_sql"]``.
+        """
+        create_sql = user_table.info.get("create_sql")
+        for target in [shard] if shard is not None else shards:
+            if create_sql is not None:
+                with target.engine.begin() as conn:
+                    conn.exec_driver_sql(create_sql)
+            else:
+                # Under the write lock, so another worker process can't create it between
+                # the existence check and the CREATE
+                with target.engine.begin() as conn:
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    user_table.create(conn, checkfirst=True)
+                    create_missing_indexes(conn, user_table)
+
+    @staticmethod
+    def ensure_indexes(table, shard: Shard):
+        """Adds the indexes ``table`` defines to an existing table created without them."""
+        if table.indexes:
+            with shard.engine.begin() as conn:
+                create_missing_indexes(conn, table)
+
+    @classmethod
+    def resolve_table(cls, user_name: str, kind: str, build, create: bool = False, on_resolve=None):
+        """Returns one of the user's tables, as a ``UserTable``, from the registry.
+
+        ``build(user_name)`` defines the per-user table and ``build(None)`` the shared
+        one. On a miss the table (or, in shared storage, the user's registration) is
+        created when ``create=True`` or looked up in the database, and ``None`` is
+        returned when it does not exist. ``on_resolve(user_table, created)`` then runs
+        once per process, under the registry lock, before the table is handed out.
+        """
+        key = (user_name, kind)
+        user_table = cls._tables.get(key)
+        if user_table is not None:
+            with cls._hits_lock:
+                cls.table_cache_hits += 1
+            return user_table
+
+        with cls._tables_lock:
+            # Another request may have resolved the table while we waited for the lock
+            user_table = cls._tables.get(key)
+            if user_table is not None:
+                with cls._hits_lock:
+                    cls.table_cache_hits += 1
+                return user_table
+
+            cls.table_cache_misses += 1
+            with metrics.stage("table_resolve"):
+                created = False
+                shard = get_shard(user_name)
+                if STORAGE_MODE == "shared":
+                    user_table = UserTable(cls._get_shared_table(kind, build), user_name, shard)
+                    if not cls._is_tenant(user_name, shard):
+                        if not create:
+                            return None
+                        cls._register_tenant(user_name, shard)
+                else:
+                    table = build(user_name)
+                    if not inspect(shard.engine).has_table(table.name):
+                        if not create:
+                            metadata.remove(table)
+                            return None
+                        cls.ensure_table_exists(table, shard)
+                        created = True
+                    else:
+                        cls.ensure_indexes(table, shard)
+                    user_table = UserTable(table, shard=shard)
+
+                if on_resolve is not None:
+                    on_resolve(user_table, created)
+            cls._tables[key] = user_table
+            return user_table
+
+    @classmethod
+    def _get_shared_table(cls, kind: str, build):
+        table = cls._shared_tables.get(kind)
+        if table is None:
+            table = build(None)
+            cls.ensure_table_exists(table)
+            cls.ensure_table_exists(cls.get_tenants_table())
+            cls._shared_tables[kind] = table
+        return table
+
+    @classmethod
+    def _is_tenant(cls, user_name: str, shard: Shard):
+        tenants = cls.get_tenants_table()
+        with shard.engine.connect() as conn:
+            return conn.execute(select(tenants.c.username).where(tenants.c.username == user_name)).first() is not None
+
+    @classmethod
+    def _register_tenant(cls, user_name: str, shard: Shard):
+        with shard.engine.begin() as conn:
+            conn.execute(sqlite_insert(cls.get_tenants_table()).on_conflict_do_nothing(), {"username": user_name})
+
+    @classmethod
+    def get_table(cls, user_name: str, create: bool = False):
+        """Returns the user's transaction table, see ``resolve_table``."""
+        return cls.resolve_table(
+            user_name,
+            "transactions",
+            lambda name: cls.get_user_transactions_table(name) if name else cls.get_shared_transactions_table(),
+            create,
+        )
+
+    @classmethod
+    def user_names(cls, shard: Shard = None):
+        """Usernames that have transaction storage in the current storage mode, on
+        ``shard`` or on any shard."""
+        if shard is None:
+            return sorted({name for target in shards for name in cls.user_names(target)})
+        if STORAGE_MODE == "shared":
+            if not inspect(shard.engine).has_table("tenants"):
+                return []
+            tenants = cls.get_tenants_table()
+            with shard.engine.connect() as conn:
+                return sorted(conn.execute(select(tenants.c.username)).scalars())
+        return per_user_table_names(shard)
+
+    @classmethod
+    def invalidate_table(cls, user_name: str = None):
+        """Drops one user's tables (or every table when no user is given) from the registry."""
+        with cls._tables_lock:
+            keys = [key for key in cls._tables if user_name is None or key[0] == user_name]
+            for key in keys:
+                user_table = cls._tables.pop(key)
+                if user_table.user_name is None:
+                    metadata.remove(user_table.table)
+
+    @classmethod
+    def table_cache_stats(cls):
+        return {
+            "hits": cls.table_cache_hits,
+            "misses": cls.table_cache_misses,
+            "size": len(cls._tables),
+        }
+
+
+def _table_cache_metrics():
+    stats = DatabaseManager.table_cache_stats()
+    return [
+        ("table_registry_hits_total", "counter", "Table registry lookups served from memory", stats["hits"]),
+        ("table_registry_misses_total", "counter", "Table registry lookups that went to the database", stats["misses"]),
+        ("table_registry_size", "gauge", "Tables held in the registry", stats["size"]),
+    ]
+
+
+metrics.register_collector(_table_cache_metrics)
+
+
+def per_user_table_names(shard: Shard = None):
+    """Usernames that have a ``{username}_transactions`` table on ``shard`` or on any shard."""
+    suffix = "_transactions"
+    return sorted(
+        name[:-len(suffix)]
+        for target in ([shard] if shard is not None else shards)
+        for name in inspect(target.engine).get_table_names()
+        if name.endswith(suffix)
+    )
@@ -0,0 +1,120 @@
+"""Per-user change feed served to clients as Server-Sent Events.
+
+Write handlers ``publish`` once their transaction has committed, with the data
+version it brought the user to, and every open ``GET /transactions/events`` stream
+of that user in this process receives the event at once. Writes served by another
+worker process are found by a single poller per process, which reads the data
+versions of every subscribed user each CHANGE_FEED_POLL_SECONDS and reports a
+version that moved past the last one delivered as a ``changed`` event. An idle
+stream is otherwise a parked coroutine plus a keepalive comment every
+CHANGE_FEED_KEEPALIVE_SECONDS.
+"""
+import asyncio
+import json
+import os
+import traceback
+from src import metrics, versions
+
+
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "100"))
+CHANGE_FEED_KEEPALIVE_SECONDS = float(os.getenv("CHANGE_FEED_KEEPALIVE_SECONDS", "15"))
+# 0 only delivers the writes served by this process
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "0.5"))
+
+
+class ChangeFeed:
+    def __init__(self, queue_size: int, keepalive_seconds: float, poll_seconds: float, read_versions):
+        self.queue_size = queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self.poll_seconds = poll_seconds
+        # ``read_versions(user_names) -> {user_name: version}``, blocking
+        self.read_versions = read_versions
+        self._subscribers = {}
+        # Data version each subscribed user's streams have last been told about
+        self._versions = {}
+        self._poller = None
+
+    def subscribe(self, username: str, version: int):
+        """Opens a stream's queue for ``username``, whose data is at ``version``."""
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(username, set()).add(queue)
+        self._versions.setdefault(username, version)
+        if self.poll_seconds > 0 and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, username: str, queue):
+        queues = self._subscribers.get(username)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[username]
+                self._versions.pop(username, None)
+
+    def has_subscribers(self, username: str):
+        return username in self._subscribers
+
+    def publish(self, username: str, event_type: str, reference_nos, version: int = None):
+        """Queues ``{"type", "reference_nos", "version"}`` for every open stream of
+        ``username``, unless the poller has already reported ``version``."""
+        if username not in self._subscribers:
+            return
+        if version is not None:
+            if version <= self._versions.get(username, 0):
+                return
+            self._versions[username] = version
+        event = {"type": event_type, "reference_nos": [ref for ref in reference_nos if ref is not None], "version": version}
+        for queue in self._subscribers.get(username, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stream that fell this far behind only needs to know it must reload
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "reference_nos": [], "version": version})
+
+    async def _poll(self):
+        """Reports the versions of subscribed users that moved without a local event,
+        until no stream is left."""
+        while self._subscribers:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                latest = await asyncio.to_thread(self.read_versions, list(self._subscribers))
+            except Exception:
+                traceback.print_exc()
+                continue
+            for username, version in latest.items():
+                self.publish(username, "changed", [], version)
+
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def stream(self, username: str):
+        """Yields SSE frames for ``username`` until the client disconnects."""
+        version = (await asyncio.to_thread(self.read_versions, [username]))[username]
+        queue = self.subscribe(username, version)
+        try:
+            event_id = 0
+            yield "retry: 1000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                event_id += 1
+                yield f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(username, queue)
+
+
+change_feed = ChangeFeed(
+    CHANGE_FEED_QUEUE_SIZE, CHANGE_FEED_KEEPALIVE_SECONDS, CHANGE_FEED_POLL_SECONDS, versions.current_by_user
+)
+
+
+def _change_feed_metrics():
+    return [("change_feed_subscribers", "gauge", "Open change-feed streams", change_feed.subscriber_count())]
+
+
+metrics.register_collector(_change_feed_metrics)
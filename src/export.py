@@ -0,0 +1,184 @@
+"""Streaming export of a user's transactions as CSV, Arrow IPC or Parquet.
+
+Rows come off a single server-side cursor ``EXPORT_BATCH_SIZE`` at a time, so the
+export is one consistent snapshot and memory stays flat however many rows there
+are. Each batch is encoded and handed on before the next one is read. Archived years
+(``src.partitions``) in the export's date range are streamed one after the other on a
+second connection and merged in; they are read as of when their turn comes.
+
+    python -m src.export --user NAME --format parquet --output alice.parquet
+"""
+import argparse
+import csv
+import datetime
+import heapq
+import io
+import itertools
+import os
+import sys
+from typing import Optional
+from src.database import DatabaseManager
+from src import listing, partitions
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COLUMNS = ["reference_no", "date", "details", "debit", "credit"]
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("reference_no", pa.string()),
+        ("date", pa.date32()),
+        ("details", pa.string()),
+        ("debit", pa.float64()),
+        ("credit", pa.float64()),
+    ])
+
+
+def iter_batches(user_table, query, batch_size: int = EXPORT_BATCH_SIZE,
+                 date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """Yields lists of up to ``batch_size`` rows of ``query`` (a ``(date, reference_no)``-ordered
+    listing over ``user_table``, built with the ``date_from`` / ``date_to`` bounds) from
+    streaming cursors."""
+    with user_table.shard.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        years = partitions.archived_years(conn, user_table, date_from, date_to)
+        result = conn.execute(query)
+        if not years:
+            yield from result.partitions()
+            return
+        # The archives go through a second connection, where each can be detached again
+        # once read; the first one's open cursor would keep them all attached
+        with user_table.shard.engine.connect() as archive_conn:
+            archive_conn = archive_conn.execution_options(stream_results=True, yield_per=batch_size)
+            archived = itertools.chain.from_iterable(
+                partitions.execute(archive_conn, user_table, query, year) for year in years
+            )
+            rows = heapq.merge(result, archived, key=listing.sort_key)
+            while batch := list(itertools.islice(rows, batch_size)):
+                yield batch
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back what was written since the last ``drain``."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _record_batch(rows, schema):
+    import pyarrow as pa
+
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_arrow(batches):
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(_record_batch(rows, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def encode_parquet(batches):
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in batches:
+            # One row group per batch
+            writer.write_batch(_record_batch(rows, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": encode_csv, "arrow": encode_arrow, "parquet": encode_parquet}
+
+
+def _encode(format: str, batches):
+    for chunk in ENCODERS[format](batches):
+        if chunk:
+            yield chunk
+
+
+def stream_export(user_table, query, format: str, batch_size: int = EXPORT_BATCH_SIZE,
+                  date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """Yields the encoded export of ``query`` (over ``user_table``) chunk by chunk."""
+    return _encode(format, iter_batches(user_table, query, batch_size, date_from, date_to))
+
+
+def stream_empty_export(format: str):
+    """Yields an export without rows: the CSV header, or an Arrow / Parquet file with the
+    schema and no batches. For users who have no transactions table yet."""
+    return _encode(format, iter(()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a user's transactions")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    user_table = DatabaseManager.get_table(args.user)
+    if user_table is None:
+        raise SystemExit(f"{args.user}: no transactions table")
+    query = user_table.select().order_by(user_table.c.date, user_table.c.reference_no)
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in stream_export(user_table, query, args.format, args.batch_size):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Group commit: concurrent writes share one transaction, and so one WAL sync.
+
+With WRITE_COALESCING=1 the write handlers hand their ``crud`` write to an
+in-process queue instead of running it on their own session. A single writer
+drains the queue into batches that close at WRITE_BATCH_MAX_ROWS rows or
+WRITE_BATCH_MAX_MS after the first write arrived, and runs each batch in one
+transaction on a dedicated thread. If a write fails (a missing reference, a reused
+idempotency key), the batch is run again with every write in its own SAVEPOINT, so
+only the failed one is rolled back and its caller gets its error. No caller hears
+back before the batch's COMMIT has returned. Each shard has its own writer, so
+tenants on different shards never share a batch or wait on each other's lock.
+
+Without it every request commits on its own, as before.
+"""
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from src import metrics
+from src.database import get_shard, run_db, shards
+
+
+WRITE_COALESCING = os.getenv("WRITE_COALESCING", "0") == "1"
+WRITE_BATCH_MAX_ROWS = int(os.getenv("WRITE_BATCH_MAX_ROWS", "256"))
+WRITE_BATCH_MAX_MS = float(os.getenv("WRITE_BATCH_MAX_MS", "2"))
+
+
+class GroupCommitWriter:
+    def __init__(self, shard, max_rows: int, max_wait_seconds: float):
+        self.shard = shard
+        self.max_rows = max_rows
+        self.max_wait_seconds = max_wait_seconds
+        self.batches = 0
+        self.writes = 0
+        # One queue and drain task per event loop (a server has one; test clients may not)
+        self._queues = weakref.WeakKeyDictionary()
+        # One thread, so one writer connection: batches never contend with each other
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"group-commit-{shard.index}")
+
+    def _queue(self, loop):
+        queue, task = self._queues.get(loop, (None, None))
+        if task is None or task.done():
+            queue = asyncio.Queue()
+            task = loop.create_task(self._run(loop, queue))
+            self._queues[loop] = (queue, task)
+        return queue
+
+    async def submit(self, write, user_name: str, *args, rows: int = 1):
+        """Queues ``write(db, user_name, *args)`` (a ``crud`` write) and returns its result
+        once the batch it joined has committed; ``rows`` counts towards the batch size."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue(loop).put_nowait((write, user_name, args, rows, future))
+        return await future
+
+    def queue_depth(self):
+        return sum(queue.qsize() for queue, _ in list(self._queues.values()))
+
+    async def _run(self, loop, queue):
+        while True:
+            batch = [await queue.get()]
+            rows = batch[0][3]
+            # A write that arrives alone is flushed at once; the wait only pays off when
+            # others queued up behind the previous batch
+            deadline = loop.time() + (self.max_wait_seconds if not queue.empty() else 0)
+            while rows < self.max_rows:
+                if not queue.empty():
+                    item = queue.get_nowait()
+                    batch.append(item)
+                    rows += item[3]
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                rows += item[3]
+
+            try:
+                outcomes = await loop.run_in_executor(self._executor, self._flush, batch)
+            except Exception as exc:
+                outcomes = [(False, exc)] * len(batch)
+            for (*_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _flush(self, batch):
+        """Runs ``batch`` in one transaction; returns ``(ok, result or exception)`` per write."""
+        outcomes = []
+        # Table creation happens on other connections, so it must be done before this
+        # transaction takes the write lock
+        pending = []
+        for write, user_name, args, rows, future in batch:
+            try:
+                write.prepare(user_name)
+            except Exception as exc:
+                outcomes.append((False, exc))
+            else:
+                outcomes.append(None)
+                pending.append((len(outcomes) - 1, write, user_name, args))
+
+        with metrics.stage("group_commit_flush"):
+            try:
+                self._apply(pending, outcomes, isolate=False)
+            except Exception:
+                # Rare: some write failed, so run the batch again with each write in its
+                # own SAVEPOINT and roll back just the ones that fail
+                self._apply(pending, outcomes, isolate=True)
+
+        self.batches += 1
+        self.writes += len(batch)
+        return outcomes
+
+    def _apply(self, pending, outcomes, isolate: bool):
+        db = self.shard.SessionLocal()
+        try:
+            db.execute(text("BEGIN IMMEDIATE"))
+            for index, write, user_name, args in pending:
+                if not isolate:
+                    outcomes[index] = (True, write.apply(db, user_name, *args))
+                    continue
+                savepoint = db.begin_nested()
+                try:
+                    result = write.apply(db, user_name, *args)
+                except Exception as exc:
+                    savepoint.rollback()
+                    outcomes[index] = (False, exc)
+                else:
+                    savepoint.commit()
+                    outcomes[index] = (True, result)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+writers = [GroupCommitWriter(shard, WRITE_BATCH_MAX_ROWS, WRITE_BATCH_MAX_MS / 1000) for shard in shards]
+
+
+async def write(db, fn, user_name: str, *args, rows: int = 1):
+    """Runs the ``crud`` write ``fn``: through its shard's group-commit writer when
+    WRITE_COALESCING is on, otherwise in its own transaction on ``db``."""
+    if WRITE_COALESCING:
+        return await writers[get_shard(user_name).index].submit(fn, user_name, *args, rows=rows)
+    return await run_db(db, fn, user_name, *args)
+
+
+def _group_commit_metrics():
+    batches = sum(writer.batches for writer in writers)
+    writes = sum(writer.writes for writer in writers)
+    queue_depth = sum(writer.queue_depth() for writer in writers)
+    return [
+        ("group_commit_batches_total", "counter", "Transactions committed by the group-commit writers", batches),
+        ("group_commit_writes_total", "counter", "Writes committed by the group-commit writers", writes),
+        ("group_commit_queue_depth", "gauge", "Writes waiting for the group-commit writers", queue_depth),
+    ]
+
+
+metrics.register_collector(_group_commit_metrics)
@@ -0,0 +1,121 @@
+"""``Idempotency-Key`` support for the create endpoints.
+
+A client that retries a POST after a timeout sends the same key again. The key is
+stored in ``idempotency_keys`` with the response it produced, in the same
+transaction as the rows it inserted. A retry then finds the key and gets the
+original response back instead of inserting the rows a second time. The store is
+a ``WITHOUT ROWID`` table keyed by ``(username, key)``, so a claim is one primary
+key probe folded into the write the request makes anyway. Entries expire after
+``IDEMPOTENCY_KEY_TTL_SECONDS`` and are swept in small batches by later claims.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from sqlalchemy import Column, Index, Integer, String, Table, select, tuple_
+from src.database import DatabaseManager, metadata
+
+
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Expired keys are deleted at most this often per process, this many at a time
+IDEMPOTENCY_SWEEP_SECONDS = 60
+IDEMPOTENCY_SWEEP_BATCH = 1000
+
+
+_keys_table = None
+_keys_lock = threading.Lock()
+# Next sweep time per database (each shard has its own key store)
+_next_sweep = {}
+
+
+def get_keys_table():
+    """The ``idempotency_keys`` table, created on first use.
+
+    Writers resolve it before they start their transaction, so the CREATE never has
+    to wait on their own write lock.
+    """
+    global _keys_table
+    if _keys_table is None:
+        with _keys_lock:
+            if _keys_table is None:
+                table = Table(
+                    "idempotency_keys",
+                    metadata,
+                    Column("username", String, primary_key=True),
+                    Column("key", String, primary_key=True),
+                    Column("fingerprint", String, nullable=False),
+                    Column("response", String, nullable=False),
+                    Column("expires_at", Integer, nullable=False),
+                    Index("ix_idempotency_keys_expires_at", "expires_at"),
+                    sqlite_with_rowid=False,
+                    extend_existing=True,
+                )
+                DatabaseManager.ensure_table_exists(table)
+                _keys_table = table
+    return _keys_table
+
+
+class Fingerprint:
+    """Digest of an endpoint and its request body, to tell a retry from a different
+    request reusing its key. Items can be added one at a time as a body streams in."""
+
+    def __init__(self, endpoint: str):
+        self._digest = hashlib.sha256(endpoint.encode())
+
+    def update(self, payload):
+        self._digest.update(b"\n" + json.dumps(payload, sort_keys=True, default=str).encode())
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def fingerprint(endpoint: str, payload) -> str:
+    digest = Fingerprint(endpoint)
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+def claim(db, user_name: str, key: str, request_fingerprint: str, response: dict):
+    """Records ``key`` with ``response`` inside the caller's transaction.
+
+    Returns ``None`` when the key is new (or its previous use has expired) and the
+    caller should go ahead with the write, or the ``(fingerprint, response)`` stored
+    by the earlier request otherwise. SQLite lets one writer in at a time, so a
+    concurrent retry waits here until the first request commits and then sees its key.
+    """
+    keys = get_keys_table()
+    now = int(time.time())
+    _sweep(db, keys, now)
+
+    entry = {
+        "fingerprint": request_fingerprint,
+        "response": json.dumps(response),
+        "expires_at": now + IDEMPOTENCY_KEY_TTL_SECONDS,
+    }
+    # INSERT OR IGNORE rather than an upsert: SQLAlchemy caches its compiled form,
+    # which keeps the claim as cheap as the insert it guards
+    claimed = db.execute(keys.insert().prefix_with("OR IGNORE"), {"username": user_name, "key": key, **entry})
+    if claimed.rowcount:
+        return None
+
+    where = (keys.c.username == user_name) & (keys.c.key == key)
+    stored = db.execute(select(keys.c.fingerprint, keys.c.response, keys.c.expires_at).where(where)).one()
+    if stored.expires_at <= now:
+        db.execute(keys.update().where(where).values(**entry))
+        return None
+    return stored.fingerprint, json.loads(stored.response)
+
+
+def _sweep(db, keys, now: int):
+    bind = db.get_bind()
+    if now < _next_sweep.get(bind, 0):
+        return
+    _next_sweep[bind] = now + IDEMPOTENCY_SWEEP_SECONDS
+    expired = (
+        select(keys.c.username, keys.c.key)
+        .where(keys.c.expires_at <= now)
+        .limit(IDEMPOTENCY_SWEEP_BATCH)
+    )
+    db.execute(keys.delete().where(tuple_(keys.c.username, keys.c.key).in_(expired)))
@@ -0,0 +1,118 @@
+import base64
+import datetime
+import heapq
+import json
+from typing import Optional
+from sqlalchemy import tuple_
+from src import partitions
+
+
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row) -> str:
+    """Encodes the (date, reference_no) keyset position of ``row`` as an opaque token."""
+    raw = json.dumps([row.date.isoformat(), row.reference_no]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        date, reference_no = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.date.fromisoformat(date), reference_no
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def build_listing_query(
+    user_table,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    details: Optional[str] = None,
+    min_debit: Optional[float] = None,
+    max_debit: Optional[float] = None,
+    min_credit: Optional[float] = None,
+    max_credit: Optional[float] = None,
+):
+    """Builds the filtered, (date, reference_no)-ordered select for a user's transactions.
+
+    Date bounds and ``details`` are plain comparisons so SQLite can drive the scan
+    from the ``date`` / ``details`` indexes.
+    """
+    c = user_table.c
+    query = user_table.select()
+    if date_from is not None:
+        query = query.where(c.date >= date_from)
+    if date_to is not None:
+        query = query.where(c.date <= date_to)
+    if details is not None:
+        query = query.where(c.details == details)
+    if min_debit is not None:
+        query = query.where(c.debit >= min_debit)
+    if max_debit is not None:
+        query = query.where(c.debit <= max_debit)
+    if min_credit is not None:
+        query = query.where(c.credit >= min_credit)
+    if max_credit is not None:
+        query = query.where(c.credit <= max_credit)
+    return query.order_by(c.date, c.reference_no)
+
+
+def seek(user_table, query, after):
+    """Restricts ``query`` to rows strictly after the ``after`` keyset position."""
+    if after is None:
+        return query
+    return query.where(tuple_(user_table.c.date, user_table.c.reference_no) > tuple_(*after))
+
+
+def sort_key(row):
+    """The listing order, ``(date, reference_no)`` with SQLite's NULL dates first, for
+    merging rows from several partitions."""
+    return row.date is not None, row.date or datetime.date.min, row.reference_no
+
+
+def fetch_page(db, user_table, query, after, limit: int,
+               date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """Returns up to ``limit`` rows of ``query`` after the ``after`` keyset position.
+
+    ``date_from`` / ``date_to`` are the bounds ``query`` was built with, and select
+    the archived years it reads besides the hot table (see ``src.partitions``). They
+    are read oldest first, and only until the page is full of rows from before them.
+    """
+    query = seek(user_table, query, after).limit(limit)
+    if after is not None and (date_from is None or after[0] > date_from):
+        date_from = after[0]
+    rows = db.execute(query).fetchall()
+    for year in partitions.archived_years(db, user_table, date_from, date_to):
+        if len(rows) >= limit and (rows[limit - 1].date is None or rows[limit - 1].date.year < year):
+            break
+        rows = list(heapq.merge(rows, partitions.execute(db, user_table, query, year).fetchall(), key=sort_key))
+    return rows[:limit]
+
+
+def iter_rows(session_factory, user_table, query, after, batch_size: int,
+              date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None):
+    """Yields every row of ``query`` after ``after`` in keyset-paged batches.
+
+    Each batch runs as its own short query on a private session, so memory stays
+    bounded by ``batch_size`` and no read transaction is held open between batches.
+    """
+    while True:
+        db = session_factory()
+        try:
+            rows = fetch_page(db, user_table, query, after, batch_size, date_from, date_to)
+        finally:
+            db.close()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1].date, rows[-1].reference_no)
+
+
+def row_to_dict(row):
+    return dict(zip(row._fields, row))
@@ -0,0 +1,218 @@
+"""Prometheus-style metrics: per-route latency, per-stage timings and gauges.
+
+Everything is kept in process memory and rendered in the Prometheus text format by
+``GET /metrics``. Recording an observation is a bisect and two additions under a
+lock, cheap enough to leave on in production; METRICS_ENABLED=0 turns it all off.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.label_names + ("le",), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+STAGE_LATENCY = Histogram("app_stage_duration_seconds", "Time spent in internal request stages", ("stage",))
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection", ("pool",)
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+# Callables returning ``[(name, type, documentation, value)]``, sampled at scrape time
+_collectors = []
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the enclosed block as internal stage ``name``."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, name)
+
+
+def timed(name: str, fn):
+    """Wraps ``fn`` so each call is timed as stage ``name`` (used for pool/thread work)."""
+    def wrapper(*args):
+        with stage(name):
+            return fn(*args)
+    return wrapper
+
+
+# Engine -> pool label of the engines passed to ``instrument_engine``
+_pool_names = {}
+
+
+def instrument_engine(engine, pool_name: str):
+    """Records SQL execute time for ``engine`` (sync or async), and labels its pool
+    checkouts for ``instrument_sessions``."""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    _pool_names[sync_engine] = pool_name
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_execute_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("metrics_execute_start", None)
+        if start is not None:
+            STAGE_LATENCY.observe(time.perf_counter() - start, "sql_execute")
+
+
+def instrument_sessions(session_class):
+    """Records commit time and pool checkout wait for every ``session_class`` (the sync
+    side of an AsyncSession too).
+
+    A session checks its connection out between starting its transaction and the
+    ``after_begin`` event, so that span is the checkout wait, including opening a new
+    connection. Connections taken straight from an engine are not timed.
+    """
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(session_class, "after_transaction_create")
+    def _after_transaction_create(session, transaction):
+        if transaction.parent is None:
+            session.info["metrics_checkout_start"] = time.perf_counter()
+
+    @event.listens_for(session_class, "after_begin")
+    def _after_begin(session, transaction, connection):
+        start = session.info.pop("metrics_checkout_start", None)
+        pool_name = _pool_names.get(connection.engine)
+        if start is not None and pool_name is not None:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, pool_name)
+
+    @event.listens_for(session_class, "before_commit")
+    def _before_commit(session):
+        session.info["metrics_commit_start"] = time.perf_counter()
+
+    @event.listens_for(session_class, "after_commit")
+    def _after_commit(session):
+        start = session.info.pop("metrics_commit_start", None)
+        if start is not None:
+            STAGE_LATENCY.observe(time.perf_counter() - start, "commit")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and the in-flight request gauge."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                route.path if route is not None else "<unmatched>",
+                status_code[0],
+            )
+
+
+def render():
+    lines = []
+    for metric in (REQUEST_LATENCY, STAGE_LATENCY, POOL_CHECKOUT_WAIT, REQUESTS_IN_FLIGHT):
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, metric_type, documentation, value in collect():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
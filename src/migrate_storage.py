@@ -0,0 +1,98 @@
+"""Copies per-user ``{username}_transactions`` tables into the shared ``transactions`` table.
+
+The copy runs in small batches, each in its own short transaction, so the app can
+keep serving (and writing) while it runs. Every run brings the shared rows back in
+line with the per-user table: rows updated since the last run are overwritten and
+rows deleted since are removed. Run it as often as needed while the app still runs
+with ``STORAGE_MODE=per_user``, the last time once writes have stopped, then switch
+to ``STORAGE_MODE=shared``; the tool refuses to run in shared mode, where it would
+undo the writes made in shared storage since. Users with archived years are
+refused; move them back with ``python -m src.archive restore`` first.
+
+    python -m src.migrate_storage [--user NAME] [--batch-size 1000]
+"""
+import argparse
+from sqlalchemy import exists, or_, select, text
+from sqlalchemy.dialects.sqlite import insert
+from src.database import STORAGE_MODE, DatabaseManager, UserTable, get_shard, per_user_table_names
+from src import balance, partitions, rollup
+
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+def migrate_user(user_name: str, batch_size: int = MIGRATION_BATCH_SIZE):
+    """Copies one user's table into shared storage, over their rows copied by an earlier
+    run, and rebuilds their shared rollup and balance checkpoints.
+
+    Returns the number of rows read from the per-user table.
+    """
+    shard = get_shard(user_name)
+    source = DatabaseManager.get_user_transactions_table(user_name)
+    with shard.engine.connect() as conn:
+        if partitions.archived_years(conn, UserTable(source, shard=shard)):
+            raise SystemExit(f"{user_name}: has archived years, run python -m src.archive restore --user {user_name}")
+    shared = DatabaseManager.get_shared_transactions_table()
+    tenants = DatabaseManager.get_tenants_table()
+    shared_rollup = rollup.get_user_rollup_table(None)
+    shared_checkpoints = balance.get_user_checkpoint_table(None)
+    for table in (shared, tenants, shared_rollup, shared_checkpoints):
+        DatabaseManager.ensure_table_exists(table, shard)
+
+    with shard.engine.begin() as conn:
+        conn.execute(insert(tenants).on_conflict_do_nothing(), {"username": user_name})
+
+    columns = [column.name for column in source.c]
+    data_columns = [name for name in columns if name != "reference_no"]
+    copy_stmt = insert(shared)
+    copy_stmt = copy_stmt.on_conflict_do_update(
+        index_elements=[shared.c.username, shared.c.reference_no],
+        set_={name: copy_stmt.excluded[name] for name in data_columns},
+        # Rows that are already up to date are left alone, so a re-run only writes changes
+        where=or_(*(shared.c[name].is_not(copy_stmt.excluded[name]) for name in data_columns)),
+    )
+    last_rowid = 0
+    copied = 0
+    while True:
+        with shard.engine.begin() as conn:
+            batch = conn.execute(
+                select(text("rowid"), *source.c)
+                .where(text("rowid > :last_rowid").bindparams(last_rowid=last_rowid))
+                .order_by(text("rowid"))
+                .limit(batch_size)
+            ).fetchall()
+            if batch:
+                conn.execute(copy_stmt, [
+                    {"username": user_name, **{name: row._mapping[name] for name in columns}} for row in batch
+                ])
+        if not batch:
+            break
+        copied += len(batch)
+        last_rowid = batch[-1][0]
+
+    with shard.engine.begin() as conn:
+        # Rows deleted from the per-user table since an earlier run
+        conn.execute(
+            shared.delete()
+            .where(shared.c.username == user_name)
+            .where(~exists().where(source.c.reference_no == shared.c.reference_no))
+        )
+        rollup._fill(conn, UserTable(shared, user_name, shard), UserTable(shared_rollup, user_name, shard))
+        balance._fill(conn, UserTable(shared, user_name, shard), UserTable(shared_checkpoints, user_name, shard))
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-user transaction tables into shared storage")
+    parser.add_argument("--user", help="Only migrate this user (default: every per-user table)")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+    if STORAGE_MODE == "shared":
+        parser.error("run it with STORAGE_MODE=per_user, before switching to shared storage")
+
+    for user_name in [args.user] if args.user else per_user_table_names():
+        print(f"{user_name}: {migrate_user(user_name, args.batch_size)} rows copied")
+
+
+if __name__ == "__main__":
+    main()
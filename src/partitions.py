@@ -0,0 +1,172 @@
+"""Year partitions of a user's transactions: the hot table and per-year archives.
+
+The hot table (``DatabaseManager.get_table``) holds the recent years and every row
+whose year has not been archived. ``python -m src.archive compact`` moves closed
+years into archive files beside the shard, one per year (``transactions_info.y2019.db``),
+holding tables of the same names and shape. The shard's ``archived_partitions``
+catalogue lists which (table, tenant, year) have been moved.
+
+Readers ATTACH an archive to the connection they run on when they first need it, and
+run the very statement they built for the hot table against it through a
+``schema_translate_map``. ``archived_years`` is the planner: it lists only the
+archived years that overlap a date range, so a query over recent months reads the hot
+table alone however many years a tenant has. The hot table is read in every case, as
+a row written into an archived year stays there until the next compaction.
+
+A read is not one snapshot across the partitions: a read that races the compaction
+of the year it covers can miss or repeat that year's rows in its one response.
+"""
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy import Column, Integer, MetaData, String, Table, exc, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from src.database import DatabaseManager, UserTable, metadata
+
+
+# SQLite attaches at most 10 databases to a connection; beyond this many archives the
+# least recently used one is detached again
+ARCHIVE_MAX_ATTACHED = 8
+
+_catalogue_table = None
+_catalogue_lock = threading.Lock()
+# Copies of the hot tables bound to an archive's schema, for statements naming both
+_archive_metadata = MetaData()
+_archive_lock = threading.Lock()
+
+
+def get_catalogue_table():
+    """The ``archived_partitions`` table, created on first use.
+
+    ``username`` is empty for a per-user table. Writers resolve it before they start
+    their transaction, so the CREATE never has to wait on their own write lock.
+    """
+    global _catalogue_table
+    if _catalogue_table is None:
+        with _catalogue_lock:
+            if _catalogue_table is None:
+                table = Table(
+                    "archived_partitions",
+                    metadata,
+                    Column("table_name", String, primary_key=True),
+                    Column("username", String, primary_key=True),
+                    Column("year", Integer, primary_key=True),
+                    extend_existing=True,
+                )
+                DatabaseManager.ensure_table_exists(table)
+                _catalogue_table = table
+    return _catalogue_table
+
+
+def catalogue_key(user_table):
+    """The ``(table_name, username)`` the catalogue lists ``user_table``'s years under."""
+    return user_table.name, user_table.user_name or ""
+
+
+def archive_path(shard, year: int):
+    """File of the shard's ``year`` archive, beside the shard's own file."""
+    database = make_url(shard.url).database
+    if not database or database == ":memory:":
+        raise ValueError("In-memory databases cannot have archives")
+    base, extension = os.path.splitext(database)
+    return f"{base}.y{year}{extension}"
+
+
+def schema_name(year: int):
+    return f"archive_{year}"
+
+
+def _connection(db):
+    return db.connection() if isinstance(db, Session) else db
+
+
+def attach(db, shard, year: int):
+    """ATTACHes the shard's ``year`` archive to the connection ``db`` runs on, unless it
+    already is; returns its schema name."""
+    conn = _connection(db)
+    attached = conn.info.setdefault("archives", OrderedDict())
+    schema = schema_name(year)
+    if schema in attached:
+        attached.move_to_end(schema)
+        return schema
+    for candidate in list(attached):
+        if len(attached) < ARCHIVE_MAX_ATTACHED:
+            break
+        try:
+            conn.exec_driver_sql(f"DETACH DATABASE {candidate}")
+        except exc.OperationalError:
+            # Still read by an open cursor or the current transaction
+            continue
+        del attached[candidate]
+    conn.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (archive_path(shard, year),))
+    attached[schema] = True
+    return schema
+
+
+def detach(db, year: int):
+    """DETACHes the ``year`` archive from the connection ``db`` runs on, if it is attached."""
+    conn = _connection(db)
+    attached = conn.info.setdefault("archives", OrderedDict())
+    schema = schema_name(year)
+    if attached.pop(schema, None):
+        conn.exec_driver_sql(f"DETACH DATABASE {schema}")
+
+
+def archive_table(user_table, year: int):
+    """``user_table`` as it is in the ``year`` archive, for statements that name it next
+    to the hot table (``attach`` the archive first)."""
+    schema = schema_name(year)
+    with _archive_lock:
+        table = _archive_metadata.tables.get(f"{schema}.{user_table.name}")
+        if table is None:
+            table = user_table.table.to_metadata(_archive_metadata, schema=schema)
+    return UserTable(table, user_table.user_name, user_table.shard)
+
+
+def archived_years(db, user_table, date_from=None, date_to=None):
+    """The user's archived years that can hold rows between ``date_from`` and ``date_to``, oldest first."""
+    catalogue = get_catalogue_table()
+    table_name, username = catalogue_key(user_table)
+    query = select(catalogue.c.year).where(catalogue.c.table_name == table_name, catalogue.c.username == username)
+    if date_from is not None:
+        query = query.where(catalogue.c.year >= date_from.year)
+    if date_to is not None:
+        query = query.where(catalogue.c.year <= date_to.year)
+    return list(db.execute(query.order_by(catalogue.c.year)).scalars())
+
+
+def execute(db, user_table, query, year: int):
+    """Runs ``query``, built over the hot table, on the ``year`` archive instead."""
+    schema = attach(db, user_table.shard, year)
+    return db.execute(query, execution_options={"schema_translate_map": {None: schema}})
+
+
+def execute_all(db, user_table, query, date_from=None, date_to=None):
+    """Yields the result of ``query`` on the hot table, then on every archived year in range."""
+    years = archived_years(db, user_table, date_from, date_to)
+    yield db.execute(query)
+    for year in years:
+        yield execute(db, user_table, query, year)
+
+
+def archived_rows(user_table, query):
+    """Every row of ``query`` on the user's archived years, read on a connection of its own.
+
+    For callers inside a write transaction: it keeps each archive it has read attached
+    until it ends, and SQLite attaches no more than 10. Archives only change under the
+    hot table's write lock, so such a caller still reads them consistently.
+    """
+    with user_table.shard.engine.connect() as conn:
+        return [row for year in archived_years(conn, user_table) for row in execute(conn, user_table, query, year)]
+
+
+def first(db, user_table, query):
+    """The first row of ``query`` in the hot table, or else in the newest archive that has one."""
+    row = db.execute(query).first()
+    if row is None:
+        for year in reversed(archived_years(db, user_table)):
+            row = execute(db, user_table, query, year).first()
+            if row is not None:
+                break
+    return row
@@ -0,0 +1,159 @@
+"""Moves tenants to the shard the hash ring assigns them after DB_SHARDS changes.
+
+Run it with the API stopped and DB_SHARDS set to the new count, before the API is
+started again. ``--from-shards`` is the old count, so shards that are being removed
+are emptied too:
+
+    DB_SHARDS=4 python -m src.rebalance_shards --from-shards 2 [--dry-run]
+
+Each tenant is copied in one transaction on the destination, with the source file
+ATTACHed, and its rows are inserted through the destination's triggers so the rollup,
+balance checkpoints and search index are rebuilt as they go. The tenant's data
+version and idempotency keys travel with it. The source is cleaned up only after the
+copy has committed, and a leftover copy from an interrupted run is cleared before
+copying again, so the tool can simply be re-run. Tenants with archived years are
+skipped; move them back with ``python -m src.archive restore`` and run it again.
+"""
+import argparse
+from sqlalchemy import select, text
+from src.database import (
+    DB_SHARDS, STORAGE_MODE, DatabaseManager, Shard, engine, get_shard, shard_url, shards,
+)
+from src import balance, crud, idempotency, partitions, rollup, search, versions
+
+
+def _quote(name: str) -> str:
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def _columns(table):
+    return ", ".join(_quote(column.name) for column in table.c)
+
+
+def _tenant_tables(user_name: str):
+    """Names of the tables holding the tenant's data, in the order they can be emptied.
+
+    Only names: defining the transaction tables again here would add their indexes
+    to the metadata a second time.
+    """
+    if STORAGE_MODE == "shared":
+        # Rows go before the derived tables, so the delete triggers have nothing left to adjust
+        return ["transactions", rollup.get_user_rollup_table(None).name,
+                balance.get_user_checkpoint_table(None).name, DatabaseManager.get_tenants_table().name]
+    return [
+        search.get_user_search_table(user_name).name,
+        rollup.get_user_rollup_table(user_name).name,
+        balance.get_user_checkpoint_table(user_name).name,
+        f"{user_name}_transactions",
+    ]
+
+
+def _has_table(conn, schema: str, name: str) -> bool:
+    found = conn.execute(
+        text(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    )
+    return found.first() is not None
+
+
+def _has_archives(source: Shard, user_name: str) -> bool:
+    catalogue = partitions.get_catalogue_table()
+    table_name, username = ("transactions", user_name) if STORAGE_MODE == "shared" else (f"{user_name}_transactions", "")
+    with source.engine.connect() as conn:
+        if not _has_table(conn, "main", catalogue.name):
+            return False
+        return conn.execute(
+            select(catalogue.c.year).where(catalogue.c.table_name == table_name, catalogue.c.username == username)
+        ).first() is not None
+
+
+def _remove_tenant(conn, schema: str, user_name: str):
+    """Deletes everything ``user_name`` has in ``schema`` (``main`` or the attached source)."""
+    tables = [versions.get_versions_table().name, idempotency.get_keys_table().name]
+    if STORAGE_MODE == "shared":
+        tables = _tenant_tables(user_name) + tables
+    else:
+        for name in _tenant_tables(user_name):
+            conn.execute(text(f"DROP TABLE IF EXISTS {schema}.{_quote(name)}"))
+    for name in tables:
+        if _has_table(conn, schema, name):
+            conn.execute(
+                text(f"DELETE FROM {schema}.{_quote(name)} WHERE username = :username"),
+                {"username": user_name},
+            )
+
+
+def _copy_tenant(conn, user_table, user_name: str):
+    """Copies the tenant's rows from the attached source into ``main``; returns the row count."""
+    table = user_table.table
+    name, columns = _quote(table.name), _columns(table)
+    where = "WHERE username = :username" if user_table.user_name is not None else ""
+    copied = conn.execute(
+        text(f"INSERT INTO main.{name} ({columns}) SELECT {columns} FROM source.{name} {where} "
+             "ORDER BY date, reference_no"),
+        {"username": user_name},
+    ).rowcount
+
+    for table in (versions.get_versions_table(), idempotency.get_keys_table()):
+        if _has_table(conn, "source", table.name):
+            name, columns = _quote(table.name), _columns(table)
+            conn.execute(
+                text(f"INSERT OR REPLACE INTO main.{name} ({columns}) "
+                     f"SELECT {columns} FROM source.{name} WHERE username = :username"),
+                {"username": user_name},
+            )
+    return copied
+
+
+def move_tenant(user_name: str, source: Shard, destination: Shard):
+    """Moves one tenant's data from ``source`` to ``destination``; returns the rows moved."""
+    with destination.engine.begin() as conn:
+        _remove_tenant(conn, "main", user_name)
+    DatabaseManager.invalidate_table(user_name)
+    # Creates the destination tables and the triggers that maintain the derived data
+    user_table = crud._get_user_table(user_name, create=True)
+
+    with destination.engine.connect() as conn:
+        # ATTACH cannot run inside a transaction, so it comes before the first statement
+        conn.exec_driver_sql("ATTACH DATABASE ? AS source", (source.engine.url.database,))
+        try:
+            copied = _copy_tenant(conn, user_table, user_name)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE source")
+
+    with source.engine.begin() as conn:
+        _remove_tenant(conn, "main", user_name)
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move tenants to their shard after DB_SHARDS changes")
+    parser.add_argument("--from-shards", type=int, default=DB_SHARDS,
+                        help="Shard count the data was written with (default: DB_SHARDS)")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the tenants that would move")
+    args = parser.parse_args()
+
+    sources = shards + [Shard(index, shard_url(index)) for index in range(DB_SHARDS, args.from_shards)]
+    moved = 0
+    for source in sources:
+        for user_name in DatabaseManager.user_names(source):
+            destination = get_shard(user_name)
+            if destination.index == source.index:
+                continue
+            if _has_archives(source, user_name):
+                print(f"{user_name}: has archived years, skipped (python -m src.archive restore --user {user_name})")
+                continue
+            if args.dry_run:
+                print(f"{user_name}: shard {source.index} -> {destination.index}")
+            else:
+                rows = move_tenant(user_name, source, destination)
+                print(f"{user_name}: shard {source.index} -> {destination.index}, {rows} rows moved")
+            moved += 1
+    print(f"{moved} tenants {'to move' if args.dry_run else 'moved'}")
+
+
+if __name__ == "__main__":
+    main()
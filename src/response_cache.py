@@ -0,0 +1,164 @@
+"""Serialized ``GET /transactions/{reference_no}`` responses, cached per user.
+
+A cached row is served as stored bytes with its ETag, and a request whose
+``If-None-Match`` matches gets a 304, neither touching the database. Rows have no
+version column of their own, so the ETag is a hash of the serialized row: it
+changes exactly when the row does.
+
+This process's updates and deletes drop the entry of the row they changed as they
+commit; creates change no cached row and drop nothing. Writes from another worker
+process are noticed through the user's data version (``src.versions``), which every
+write moves on by one: entries were stored with the version they were read at, and
+once a user's entries are RESPONSE_CACHE_REVALIDATE_SECONDS old the next read goes to
+the database, and drops the rest of them if the version has moved further than this
+process's own writes since account for.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import orjson
+from src import crud, metrics, versions
+
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_REVALIDATE_SECONDS = float(os.getenv("RESPONSE_CACHE_REVALIDATE_SECONDS", "5"))
+
+
+class CachedResponse:
+    __slots__ = ("etag", "body")
+
+    def __init__(self, etag: str, body: bytes):
+        self.etag = etag
+        self.body = body
+
+    def matches(self, if_none_match: str):
+        """Whether an ``If-None-Match`` header names this response (weak comparison)."""
+        return any(
+            tag == "*" or tag.removeprefix("W/") == self.etag
+            for tag in (part.strip() for part in if_none_match.split(","))
+        )
+
+
+def serialize(row: dict):
+    # Column names come back as ``quoted_name``, a str subclass orjson only takes with this option
+    body = orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS)
+    return CachedResponse(f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', body)
+
+
+def load_response(db, user_name: str, reference_no: str):
+    """Reads the row and the user's data version in one transaction; returns both."""
+    row = crud.get_transaction(db, user_name, reference_no)
+    return versions.current(db, user_name), serialize(row)
+
+
+class ResponseCache:
+    """Bounded LRU of (user, reference_no) -> ``CachedResponse``."""
+
+    def __init__(self, maxsize: int, revalidate_seconds: float):
+        self.maxsize = maxsize
+        self.revalidate_seconds = revalidate_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # user -> [data version, time it was read, reference_nos cached, own writes since]
+        self._users = {}
+        # user -> count of invalidations, so a read that raced a write doesn't store a stale row
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_name: str, reference_no: str):
+        with self._lock:
+            user = self._users.get(user_name)
+            if user is None or time.monotonic() - user[1] >= self.revalidate_seconds:
+                self.misses += 1
+                return None
+            entry = self._entries.get((user_name, reference_no))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_name, reference_no))
+            self.hits += 1
+            return entry
+
+    def generation(self, user_name: str):
+        """Taken before a database read and handed to ``put`` with its result."""
+        return self._generations.get(user_name, 0)
+
+    def put(self, user_name: str, reference_no: str, generation: int, version: int, response: CachedResponse):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if self._generations.get(user_name, 0) != generation:
+                return
+            user = self._users.get(user_name)
+            if user is not None and user[0] + user[3] != version:
+                self._discard_user(user_name)
+                user = None
+            if user is None:
+                user = self._users[user_name] = [version, 0.0, set(), 0]
+            user[0], user[3] = version, 0
+            # A read at the version the entries were stored at confirms them all
+            user[1] = time.monotonic()
+            user[2].add(reference_no)
+            self._entries[(user_name, reference_no)] = response
+            self._entries.move_to_end((user_name, reference_no))
+            while len(self._entries) > self.maxsize:
+                self._discard(*next(iter(self._entries)))
+
+    def record_write(self, user_name: str):
+        """Accounts for a committed write of this process that changed no cached row (a
+        create), so the version it moved on doesn't discard the user's entries."""
+        with self._lock:
+            self._record_write(user_name)
+
+    def invalidate(self, user_name: str, reference_no: str):
+        """Drops the cached response of the row a committed update or delete changed."""
+        with self._lock:
+            self._record_write(user_name)
+            self._discard(user_name, reference_no)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._users.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+    def _record_write(self, user_name: str):
+        # A read that raced the write may have seen the version before it: don't store it
+        self._generations[user_name] = self._generations.get(user_name, 0) + 1
+        user = self._users.get(user_name)
+        if user is not None:
+            user[3] += 1
+
+    def _discard_user(self, user_name: str):
+        user = self._users.pop(user_name, None)
+        if user is not None:
+            for reference_no in user[2]:
+                self._entries.pop((user_name, reference_no), None)
+
+    def _discard(self, user_name: str, reference_no: str):
+        self._entries.pop((user_name, reference_no), None)
+        user = self._users.get(user_name)
+        if user is not None:
+            user[2].discard(reference_no)
+            if not user[2]:
+                del self._users[user_name]
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_REVALIDATE_SECONDS)
+
+
+def _response_cache_metrics():
+    stats = response_cache.stats()
+    return [
+        ("response_cache_hits_total", "counter", "Transaction reads served from the response cache", stats["hits"]),
+        ("response_cache_misses_total", "counter", "Transaction reads that went to the database", stats["misses"]),
+        ("response_cache_size", "gauge", "Responses held in the response cache", stats["size"]),
+    ]
+
+
+metrics.register_collector(_response_cache_metrics)
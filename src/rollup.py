@@ -0,0 +1,205 @@
+"""Per-user monthly rollup of debit/credit sums and counts keyed by (year, month, details).
+
+The rollup is kept up to date by SQLite triggers on the transaction table, so it
+changes in the same transaction as the row itself, every write stays a single
+statement, and dashboard summaries cost O(months) instead of O(rows). Rows of
+archived years (``src.partitions``) stay counted after they move.
+
+    python -m src.rollup rebuild [--user NAME]
+    python -m src.rollup check [--user NAME]
+"""
+import argparse
+import math
+from sqlalchemy import Column, Float, Integer, String, Table, literal, text
+from sqlalchemy.dialects.sqlite import insert
+from src.aggregates import monthly_totals_query
+from src.database import DatabaseManager, engine, metadata
+from src import partitions
+
+
+CHECK_TOLERANCE = 1e-6
+TRIGGER_SUFFIXES = ("insert", "delete", "update_old", "update_new")
+
+
+def get_user_rollup_table(user_name: str):
+    """The user's own rollup table, or with ``user_name=None`` the shared one."""
+    tenant_columns = [] if user_name else [Column("username", String, primary_key=True)]
+    return Table(
+        f"{user_name}_monthly_rollup" if user_name else "monthly_rollup",
+        metadata,
+        *tenant_columns,
+        Column("year", Integer, primary_key=True),
+        Column("month", Integer, primary_key=True),
+        Column("details", String, primary_key=True),
+        Column("debit", Float, default=0.0, nullable=False),
+        Column("credit", Float, default=0.0, nullable=False),
+        Column("count", Integer, default=0, nullable=False),
+        extend_existing=True,
+    )
+
+
+def get_rollup_table(user_name: str):
+    """Returns the user's rollup table, making sure its maintenance triggers exist.
+
+    Call it only once the user's transaction table exists; a newly created rollup is
+    back-filled from it in the same transaction that installs the triggers.
+    """
+    def prepare(rollup_table, created):
+        user_table = DatabaseManager.get_table(user_name)
+        # ``_fill`` reads the archive catalogue while this transaction holds the write lock
+        partitions.get_catalogue_table()
+        with user_table.shard.engine.begin() as conn:
+            install_triggers(conn, user_table, rollup_table)
+            if created:
+                _fill(conn, user_table, rollup_table)
+
+    return DatabaseManager.resolve_table(
+        user_name, "rollup", get_user_rollup_table, create=True, on_resolve=prepare
+    )
+
+
+def _fill(conn, user_table, rollup_table):
+    tenant_values = rollup_table.tenant_values
+    query = monthly_totals_query(user_table).add_columns(*(literal(value) for value in tenant_values.values()))
+    conn.execute(rollup_table.delete())
+    conn.execute(
+        rollup_table.table.insert().from_select(
+            ["year", "month", "details", "debit", "credit", "count", *tenant_values], query
+        )
+    )
+    # Archived years add to the keys that rows left in the hot table already opened
+    totals = partitions.archived_rows(user_table, monthly_totals_query(user_table))
+    if totals:
+        add = insert(rollup_table.table)
+        add = add.on_conflict_do_update(
+            index_elements=[column.name for column in rollup_table.table.primary_key],
+            set_={name: rollup_table.c[name] + add.excluded[name] for name in ("debit", "credit", "count")},
+        )
+        conn.execute(add, [{**row._mapping, **tenant_values} for row in totals])
+
+
+def monthly_totals(conn, user_table):
+    """``monthly_totals_query`` over the base table and its archived years, by (year, month, details)."""
+    query = monthly_totals_query(user_table)
+    totals = {}
+    for row in [*conn.execute(query), *partitions.archived_rows(user_table, query)]:
+        key = (row.year, row.month, row.details)
+        total = totals.setdefault(key, {"year": row.year, "month": row.month, "details": row.details,
+                                        "debit": 0.0, "credit": 0.0, "count": 0})
+        total["debit"] += row.debit or 0.0
+        total["credit"] += row.credit or 0.0
+        total["count"] += row.count
+    return totals
+
+
+def _trigger_statements(user_table, rollup_table):
+    quote = engine.dialect.identifier_preparer.quote
+    base, rollup = quote(user_table.table.name), quote(rollup_table.table.name)
+    shared = "username" in rollup_table.c
+    key_columns = (["username"] if shared else []) + ["year", "month", "details"]
+
+    def upsert(row, sign):
+        key_values = ([f"{row}.username"] if shared else []) + [
+            f"CAST(strftime('%Y', {row}.date) AS INTEGER)",
+            f"CAST(strftime('%m', {row}.date) AS INTEGER)",
+            f"{row}.details",
+        ]
+        upsert_sql = (
+            f"INSERT INTO {rollup} ({', '.join(key_columns)}, debit, credit, count) "
+            f"VALUES ({', '.join(key_values)}, {sign}COALESCE({row}.debit, 0), {sign}COALESCE({row}.credit, 0), {sign}1) "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET debit = debit + excluded.debit, "
+            f"credit = credit + excluded.credit, count = count + excluded.count;"
+        )
+        if sign == "":
+            return upsert_sql
+        match = " AND ".join(f"{column} IS {value}" for column, value in zip(key_columns, key_values))
+        return upsert_sql + f" DELETE FROM {rollup} WHERE {match} AND count <= 0;"
+
+    def trigger(suffix, event, row, sign):
+        name = quote(f"{rollup_table.table.name}_{suffix}")
+        return (
+            f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {base} "
+            f"WHEN {row}.date IS NOT NULL BEGIN {upsert(row, sign)} END"
+        )
+
+    columns = "date, details, debit, credit"
+    return [
+        trigger("insert", "INSERT", "NEW", ""),
+        trigger("delete", "DELETE", "OLD", "-"),
+        trigger("update_old", f"UPDATE OF {columns}", "OLD", "-"),
+        trigger("update_new", f"UPDATE OF {columns}", "NEW", ""),
+    ]
+
+
+def install_triggers(conn, user_table, rollup_table):
+    """Creates the insert/update/delete triggers that fold row changes into the rollup."""
+    for statement in _trigger_statements(user_table, rollup_table):
+        conn.execute(text(statement))
+
+
+def drop_triggers(conn, rollup_table):
+    """Drops the triggers again, for rows that move between partitions without changing the totals."""
+    quote = engine.dialect.identifier_preparer.quote
+    for suffix in TRIGGER_SUFFIXES:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {quote(f'{rollup_table.table.name}_{suffix}')}"))
+
+
+def rebuild(user_name: str):
+    """Regenerates the user's rollup from the base transaction table."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        return
+    rollup_table = get_rollup_table(user_name)
+    with user_table.shard.engine.begin() as conn:
+        _fill(conn, user_table, rollup_table)
+
+
+def check(user_name: str):
+    """Compares the stored rollup with a fresh GROUP BY and returns the mismatching keys."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        return []
+    rollup_table = get_rollup_table(user_name)
+
+    db = user_table.shard.SessionLocal()
+    try:
+        expected = monthly_totals(db, user_table)
+        stored = {(r.year, r.month, r.details): r._asdict() for r in db.execute(rollup_table.select())}
+    finally:
+        db.close()
+
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        want, got = expected.get(key), stored.get(key)
+        if (
+            want is None or got is None
+            or want["count"] != got["count"]
+            or not math.isclose(want["debit"], got["debit"], abs_tol=CHECK_TOLERANCE)
+            or not math.isclose(want["credit"], got["credit"], abs_tol=CHECK_TOLERANCE)
+        ):
+            mismatches.append({"key": key, "expected": want, "stored": got})
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-user monthly rollup tables")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user", help="Only process this user (default: every user)")
+    args = parser.parse_args()
+
+    failed = False
+    for user_name in [args.user] if args.user else DatabaseManager.user_names():
+        if args.command == "rebuild":
+            rebuild(user_name)
+            print(f"{user_name}: rebuilt")
+        else:
+            mismatches = check(user_name)
+            failed |= bool(mismatches)
+            print(f"{user_name}: {'ok' if not mismatches else f'{len(mismatches)} mismatched keys'}")
+            for mismatch in mismatches:
+                print(f"  {mismatch}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Full-text search over transaction ``details`` with an SQLite FTS5 index.
+
+Each transaction table gets an external-content FTS5 index (``{user}_transactions_search``,
+or ``transactions_search`` in shared storage) that stores only the inverted index and
+reads the text from the table itself. SQLite triggers keep it in step with every insert,
+update and delete, so a search costs a lookup of the matching terms rather than a scan
+of the user's history.
+
+Archived years (``src.partitions``) carry an index of their own in their archive
+file. A search runs on every partition and merges the results by rank; BM25 ranks
+are relative to the partition's own index.
+
+The index refers to rows by ``rowid``, which VACUUM may renumber for these tables;
+rebuild it after a VACUUM (compaction does so for the archives):
+
+    python -m src.search rebuild [--user NAME]
+"""
+import argparse
+import base64
+import heapq
+import json
+from sqlalchemy import Column, Integer, String, Table, literal_column, or_, select, text
+from src.database import STORAGE_MODE, DatabaseManager, engine, get_shard, metadata, shards
+from src import partitions
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+def get_user_search_table(user_name: str):
+    """The user's FTS5 index, or with ``user_name=None`` the shared one.
+
+    SQLAlchemy cannot emit ``CREATE VIRTUAL TABLE``, so the DDL travels in
+    ``info["create_sql"]`` for ``DatabaseManager.ensure_table_exists``.
+    """
+    name = f"{user_name}_transactions_search" if user_name else "transactions_search"
+    indexed = ["details"] if user_name else ["username", "details"]
+    table = Table(
+        name,
+        metadata,
+        Column("rowid", Integer, primary_key=True),
+        *(Column(column, String) for column in indexed),
+        extend_existing=True,
+    )
+    table.info["create_sql"] = create_sql(table)
+    return table
+
+
+def create_sql(search_table, schema: str = None):
+    """The ``CREATE VIRTUAL TABLE`` of the index, in ``schema`` (an attached archive) if given."""
+    quote = engine.dialect.identifier_preparer.quote
+    content = search_table.name.removesuffix("_search")
+    indexed = [column.name for column in search_table.c if column.name != "rowid"]
+    qualified = f"{schema}.{quote(search_table.name)}" if schema else quote(search_table.name)
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {qualified} USING fts5("
+        f"{', '.join(indexed)}, content={quote(content)}, content_rowid='rowid', "
+        f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def get_search_table(user_name: str):
+    """Returns the search index over the user's transactions, creating it on first use.
+
+    The index is (re)built from the table when it is empty but the table is not, which
+    covers a new index over existing rows in both storage modes.
+    """
+    def prepare(search_table, created):
+        user_table = DatabaseManager.get_table(user_name)
+        with user_table.shard.engine.begin() as conn:
+            install_triggers(conn, user_table, search_table)
+            if _needs_rebuild(conn, user_table, search_table):
+                _rebuild(conn, search_table.name)
+
+    return DatabaseManager.resolve_table(
+        user_name, "search", get_user_search_table, create=True, on_resolve=prepare
+    )
+
+
+def _needs_rebuild(conn, user_table, search_table):
+    quote = engine.dialect.identifier_preparer.quote
+    indexed = conn.execute(text(f"SELECT 1 FROM {quote(search_table.name + '_docsize')} LIMIT 1")).first()
+    return indexed is None and conn.execute(select(user_table.table.c.reference_no).limit(1)).first() is not None
+
+
+def _rebuild(conn, name: str):
+    quote = engine.dialect.identifier_preparer.quote(name)
+    conn.execute(text(f"INSERT INTO {quote}({quote}) VALUES('rebuild')"))
+
+
+def _trigger_statements(user_table, search_table, schema: str = None):
+    quote = engine.dialect.identifier_preparer.quote
+    base, index = quote(user_table.table.name), quote(search_table.name)
+    columns = [column.name for column in search_table.table.c if column.name != "rowid"]
+    names = ", ".join(columns)
+
+    def add(row):
+        values = ", ".join(f"{row}.{column}" for column in columns)
+        return f"INSERT INTO {index}(rowid, {names}) VALUES ({row}.rowid, {values});"
+
+    def remove(row):
+        values = ", ".join(f"{row}.{column}" for column in columns)
+        return f"INSERT INTO {index}({index}, rowid, {names}) VALUES ('delete', {row}.rowid, {values});"
+
+    def trigger(suffix, event, body):
+        name = quote(f"{search_table.name}_{suffix}")
+        if schema:
+            name = f"{schema}.{name}"
+        return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {base} BEGIN {body} END"
+
+    return [
+        trigger("insert", "INSERT", add("NEW")),
+        trigger("delete", "DELETE", remove("OLD")),
+        trigger("update", f"UPDATE OF {names}", remove("OLD") + " " + add("NEW")),
+    ]
+
+
+def install_triggers(conn, user_table, search_table, schema: str = None):
+    """Creates the insert/update/delete triggers that keep the index in step with the table
+    (the copies of both in ``schema``, an attached archive, if given)."""
+    for statement in _trigger_statements(user_table, search_table, schema):
+        conn.execute(text(statement))
+
+
+def _phrase(term: str):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match(q: str, user_name: str = None):
+    """Turns free text into an FTS5 query: every word must match, ``word*`` matches a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in ``q`` are searched for
+    literally instead of failing to parse.
+    """
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append(_phrase(word) + ("*" if prefix else ""))
+    if not terms:
+        raise InvalidSearch("Search query must contain at least one word")
+    match = f"details : ({' '.join(terms)})"
+    if user_name is not None:
+        match = f"username : {_phrase(user_name)} AND {match}"
+    return match
+
+
+def encode_cursor(rank: float, partition: int, rowid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, partition, rowid]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Returns the ``(rank, partition, rowid)`` position; cursors from before archiving,
+    ``(rank, rowid)``, are positions in the hot table (partition 0)."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(position) == 2:
+            position = [position[0], 0, position[1]]
+        rank, partition, rowid = position
+        return float(rank), int(partition), int(rowid)
+    except (ValueError, TypeError):
+        raise InvalidSearch("Invalid cursor")
+
+
+def _search_query(user_table, search_table, q: str, partition: int, after, limit: int):
+    """The page query on one partition, which continues after ``after`` in the merged
+    ``(rank, partition, rowid)`` order."""
+    quote = engine.dialect.identifier_preparer.quote
+    index = quote(search_table.name)
+    rank = literal_column(f"{index}.rank")
+    rowid = literal_column(f"{index}.rowid")
+    base_rowid = literal_column(f"{quote(user_table.table.name)}.rowid")
+
+    query = user_table.scope(
+        select(*user_table.columns, rank.label("rank"), rowid.label("search_rowid"))
+        .select_from(search_table.table.join(user_table.table, base_rowid == rowid))
+        .where(literal_column(index).op("MATCH")(build_match(q, user_table.user_name)))
+        .order_by(rank, rowid)
+        .limit(limit)
+    )
+    if after is not None:
+        after_rank, after_partition, after_rowid = after
+        if partition == after_partition:
+            query = query.where(or_(rank > after_rank, (rank == after_rank) & (rowid > after_rowid)))
+        elif partition > after_partition:
+            query = query.where(rank >= after_rank)
+        else:
+            query = query.where(rank > after_rank)
+    return query
+
+
+def search(db, user_table, search_table, q: str, after, limit: int):
+    """One page of the user's transactions matching ``q``, best match first.
+
+    Returns ``(items, next_cursor)``; each item carries its BM25 ``score`` (higher is
+    better) and pages continue after the ``(rank, partition, rowid)`` of the previous
+    page's last item. The hot table is partition 0, an archive its year.
+    """
+    def page(partition, result):
+        return [(row.rank, partition, row.search_rowid, row) for row in result]
+
+    rows = page(0, db.execute(_search_query(user_table, search_table, q, 0, after, limit)))
+    for year in partitions.archived_years(db, user_table):
+        query = _search_query(user_table, search_table, q, year, after, limit)
+        rows = list(heapq.merge(rows, page(year, partitions.execute(db, user_table, query, year))))[:limit]
+
+    next_cursor = encode_cursor(*rows[-1][:3]) if len(rows) == limit else None
+    items = []
+    for *_, row in rows:
+        item = {column.name: getattr(row, column.name) for column in user_table.columns}
+        item["score"] = -row.rank
+        items.append(item)
+    return items, next_cursor
+
+
+def rebuild(user_name: str):
+    """Regenerates the user's search index (in shared storage, everyone's) from the table."""
+    user_table = DatabaseManager.get_table(user_name)
+    if user_table is None:
+        return
+    search_table = get_search_table(user_name)
+    with user_table.shard.engine.begin() as conn:
+        _rebuild(conn, search_table.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the full-text search indexes")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", help="Only process this user (default: every user)")
+    args = parser.parse_args()
+
+    if STORAGE_MODE == "shared":
+        # One index covers every user of a shard
+        for shard in [get_shard(args.user)] if args.user else shards:
+            user_names = DatabaseManager.user_names(shard)
+            if user_names:
+                rebuild(user_names[0])
+                print(f"transactions_search (shard {shard.index}): rebuilt")
+        return
+    for user_name in [args.user] if args.user else DatabaseManager.user_names():
+        rebuild(user_name)
+        print(f"{user_name}: rebuilt")
+
+if __name__ == "__main__":
+    main()
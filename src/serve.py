@@ -0,0 +1,114 @@
+"""Prefork launcher: WEB_WORKERS uvicorn worker processes sharing one listening socket.
+
+The parent imports the app once and forks the workers from it, so they start without
+importing it again and share its memory pages. Nothing in the parent opens a database
+connection, and each forked child drops the engine pools it inherited (see
+``database._dispose_inherited_pools``), so no SQLite connection is ever used on both
+sides of a fork. Every worker then runs the app's lifespan itself: schema creation,
+pool warm-up and, in the background, table preloading.
+
+A worker that dies is replaced. SIGTERM or SIGINT stops the workers gracefully; they
+run in their own process groups, so a Ctrl-C reaches them once, through the parent.
+
+    python -m src.serve --workers 4 --host 0.0.0.0 --port 8001
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import uvicorn
+from uvicorn.importer import import_from_string
+
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Pause before replacing a worker that died, so a crash on startup doesn't spin
+WORKER_RESTART_DELAY_SECONDS = 1.0
+
+
+def bind_socket(host: str, port: int):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level: str):
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork_worker(app, sock, log_level: str):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        run_worker(app, sock, log_level)
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(app, host: str = "127.0.0.1", port: int = 8001, workers: int = WEB_WORKERS, log_level: str = "info"):
+    """Serves ``app`` (an ASGI app or an ``"module:attribute"`` string) from ``workers`` processes."""
+    if isinstance(app, str):
+        app = import_from_string(app)
+    sock = bind_socket(host, port)
+    if workers <= 1:
+        run_worker(app, sock, log_level)
+        return
+
+    worker_pids = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(worker_pids):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        worker_pids.add(_fork_worker(app, sock, log_level))
+
+    while worker_pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_pids.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; starting a new one", file=sys.stderr)
+            time.sleep(WORKER_RESTART_DELAY_SECONDS)
+            if not stopping:
+                worker_pids.add(_fork_worker(app, sock, log_level))
+    sock.close()
+
+
+def main(app=None):
+    parser = argparse.ArgumentParser(description="Serve the API from one or more forked worker processes")
+    parser.add_argument("--app", default="fast_api:app", help="ASGI app to serve (default: fast_api:app)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="Worker processes (default: WEB_WORKERS)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    serve(app or args.app, args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
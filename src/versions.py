@@ -0,0 +1,68 @@
+"""Per-user data versions, bumped in the same transaction as every transaction write.
+
+Readers that hold derived data (the dashboards' figure caches) compare the version
+they built it from with ``GET /transactions/version`` instead of re-reading rows.
+The counter lives in the database, so it is shared by every API worker process.
+"""
+import threading
+from sqlalchemy import Column, Integer, String, Table, select
+from src.database import DatabaseManager, get_shard, metadata
+
+
+_versions_table = None
+_versions_lock = threading.Lock()
+
+
+def get_versions_table():
+    """The ``data_versions`` table, created on first use.
+
+    Writers resolve it before they start their transaction, so the CREATE never has
+    to wait on their own write lock.
+    """
+    global _versions_table
+    if _versions_table is None:
+        with _versions_lock:
+            if _versions_table is None:
+                table = Table(
+                    "data_versions",
+                    metadata,
+                    Column("username", String, primary_key=True),
+                    Column("version", Integer, nullable=False, default=0),
+                    extend_existing=True,
+                )
+                DatabaseManager.ensure_table_exists(table)
+                _versions_table = table
+    return _versions_table
+
+
+def bump(db, user_name: str):
+    """Increments the user's version inside the caller's transaction."""
+    versions = get_versions_table()
+    # UPDATE, then INSERT for a first write, rather than an upsert: SQLAlchemy caches
+    # the compiled form of these, and this runs on every write
+    bumped = db.execute(
+        versions.update().where(versions.c.username == user_name).values(version=versions.c.version + 1)
+    )
+    if not bumped.rowcount:
+        db.execute(versions.insert().values(username=user_name, version=1))
+
+
+def current(db, user_name: str):
+    versions = get_versions_table()
+    version = db.execute(select(versions.c.version).where(versions.c.username == user_name)).scalar()
+    return version or 0
+
+
+def current_by_user(user_names):
+    """``{user_name: version}`` for every one of ``user_names``, one query per shard."""
+    versions = get_versions_table()
+    by_shard = {}
+    for user_name in user_names:
+        by_shard.setdefault(get_shard(user_name), []).append(user_name)
+    latest = dict.fromkeys(user_names, 0)
+    for shard, names in by_shard.items():
+        with shard.engine.connect() as conn:
+            latest.update(conn.execute(
+                select(versions.c.username, versions.c.version).where(versions.c.username.in_(names))
+            ).all())
+    return latest
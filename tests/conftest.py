@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+# The database modules read their URLs at import, so point them at a scratch
+# directory before any test imports them
+tmp_dir = tempfile.mkdtemp(prefix="tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/transactions.db"
+os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{tmp_dir}/auth.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def client():
+    """A ``TestClient`` on the app, logged in as a user of its own (the token is sent
+    as a default query parameter)."""
+    from fastapi.testclient import TestClient
+    from fast_api import app
+
+    with TestClient(app) as client:
+        user_name = f"user-{uuid.uuid4().hex[:8]}"
+        client.post("/signup/", json={"username": user_name, "password": "pw"})
+        token = client.post("/login/", json={"username": user_name, "password": "pw"}).json()["access_token"]
+        client.params = {"token": token}
+        client.user_name = user_name
+        yield client
@@ -0,0 +1,52 @@
+"""Archived years stay readable and writable through the API, and the derived data
+stays consistent across compaction."""
+import csv
+import io
+from src import archive, balance, rollup
+
+ROWS = [
+    {"date": f"{year}-{month:02d}-15", "details": f"rent {year}", "debit": 10 * month, "credit": 100}
+    for year in (2018, 2019, 2025) for month in (3, 9)
+]
+
+
+def snapshot(client):
+    listing = client.get("/transactions/", params={"limit": 1000}).json()["items"]
+    return {
+        "list": [item["reference_no"] for item in listing],
+        "search": sorted(item["reference_no"] for item in client.get(
+            "/transactions/search", params={"q": "rent", "limit": 100}
+        ).json()["items"]),
+        "export": [row["reference_no"] for row in csv.DictReader(io.StringIO(
+            client.get("/transactions/export", params={"format": "csv"}).text
+        ))],
+        "balances": [client.get("/transactions/balance", params={"as_of": as_of}).json()["balance"]
+                     for as_of in ("2018-06-30", "2019-12-31", "2025-12-31")],
+        "monthly": client.get("/transactions/summary/monthly").json(),
+    }
+
+
+def test_archived_years_stay_readable_and_writable(client):
+    reference_nos = client.post("/transactions/bulk", json=ROWS).json()["reference_nos"]
+    before = snapshot(client)
+    assert len(before["list"]) == len(before["search"]) == len(before["export"]) == len(ROWS)
+
+    moved = archive.compact([client.user_name])[client.user_name]
+    assert moved == {2018: 2, 2019: 2}
+    assert snapshot(client) == before
+    assert rollup.check(client.user_name) == [] and balance.check(client.user_name) == []
+
+    # An update of an archived row takes it back into the hot table
+    archived = reference_nos[0]
+    response = client.put(f"/transactions/{archived}", json={"date": "2018-03-20", "details": "rent", "debit": 55})
+    assert response.status_code == 200
+    assert client.get(f"/transactions/{archived}").json()["debit"] == 55.0
+    assert client.delete(f"/transactions/{reference_nos[2]}").status_code == 200
+    assert client.get(f"/transactions/{reference_nos[2]}").status_code == 404
+    assert rollup.check(client.user_name) == [] and balance.check(client.user_name) == []
+
+    after_writes = snapshot(client)
+    assert len(after_writes["list"]) == len(ROWS) - 1
+    assert archive.compact([client.user_name])[client.user_name] == {2018: 1}
+    assert snapshot(client) == after_writes
+    assert rollup.check(client.user_name) == [] and balance.check(client.user_name) == []
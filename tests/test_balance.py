@@ -0,0 +1,41 @@
+"""The balance checkpoints follow every insert, update and delete through their triggers."""
+import datetime
+from src import balance
+
+ROWS = [
+    {"date": "2024-01-10", "details": "salary", "credit": 100},
+    {"date": "2024-01-20", "details": "rent", "debit": 40},
+    {"date": "2024-03-05", "details": "salary", "credit": 100},
+    {"date": "2024-04-15", "details": "fuel", "debit": 25},
+]
+
+
+def balance_as_of(client, as_of: str):
+    return client.get("/transactions/balance", params={"as_of": as_of}).json()["balance"]
+
+
+def month_ends(client):
+    return {(item["year"], item["month"]): item["balance"] for item in client.get("/transactions/balance/monthly").json()}
+
+
+def test_checkpoints_follow_writes(client):
+    assert balance_as_of(client, "2024-12-31") == 0.0
+    reference_nos = client.post("/transactions/bulk", json=ROWS).json()["reference_nos"]
+
+    assert month_ends(client) == {(2024, 1): 60.0, (2024, 2): 60.0, (2024, 3): 160.0, (2024, 4): 135.0}
+    assert balance_as_of(client, "2024-01-15") == 100.0
+    assert balance_as_of(client, "2024-12-31") == 135.0
+    running = client.get("/transactions/balance/running").json()["items"]
+    assert [item["balance"] for item in running] == [100.0, 60.0, 160.0, 135.0]
+    assert balance.check(client.user_name) == []
+
+    # Backdated into another month, with a new amount
+    client.put(f"/transactions/{reference_nos[3]}", json={"date": "2024-02-01", "details": "fuel", "debit": 30})
+    assert month_ends(client) == {(2024, 1): 60.0, (2024, 2): 30.0, (2024, 3): 130.0, (2024, 4): 130.0}
+    assert balance.check(client.user_name) == []
+
+    client.patch(f"/transactions/{reference_nos[0]}", json={"credit": 90})
+    client.delete(f"/transactions/{reference_nos[2]}")
+    assert balance_as_of(client, "2024-12-31") == 20.0
+    assert balance_as_of(client, datetime.date(2024, 1, 31).isoformat()) == 50.0
+    assert balance.check(client.user_name) == []
@@ -0,0 +1,21 @@
+"""Bulk ingest reports malformed bodies as 400s."""
+import pytest
+
+
+@pytest.mark.parametrize("content_type", ["application/json", "application/x-ndjson"])
+@pytest.mark.parametrize("body", [b"\xff\xfe\xfa", b'[{"date": "2024-01-01", '], ids=["not utf-8", "truncated"])
+def test_malformed_body_is_rejected(client, content_type, body):
+    response = client.post("/transactions/bulk", content=body, headers={"content-type": content_type})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Malformed JSON")
+
+
+def test_valid_and_invalid_items(client):
+    response = client.post("/transactions/bulk", json=[
+        {"date": "2024-01-01", "details": "rent", "debit": 5},
+        {"date": "not a date"},
+    ])
+    assert response.status_code == 201
+    result = response.json()
+    assert result["inserted"] == 1
+    assert [error["index"] for error in result["errors"]] == [1]
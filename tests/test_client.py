@@ -0,0 +1,47 @@
+"""The client SDKs against the app served by uvicorn on a local port."""
+import asyncio
+import socket
+import threading
+import time
+import uuid
+import pytest
+import uvicorn
+from request_api import AsyncTransactionsClient, TransactionsClient
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    from fast_api import app
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
+
+
+def test_create_and_update_without_details(base_url):
+    with TransactionsClient(base_url, f"client-{uuid.uuid4().hex[:8]}", "pw") as client:
+        client.signup()
+        reference_no = client.create_transaction("2024-03-01", debit=5)
+        assert client.get_transaction(reference_no)["details"] == "None"
+        updated = client.update_transaction(reference_no, "2024-03-02", credit=7)
+        assert (updated["date"], updated["debit"], updated["credit"]) == ("2024-03-02", 0.0, 7.0)
+
+
+def test_async_create_and_update_without_details(base_url):
+    async def run():
+        async with AsyncTransactionsClient(base_url, f"client-{uuid.uuid4().hex[:8]}", "pw") as client:
+            await client.signup()
+            reference_no = await client.create_transaction("2024-03-01", debit=5)
+            assert (await client.get_transaction(reference_no))["details"] == "None"
+            updated = await client.update_transaction(reference_no, "2024-03-02", credit=7)
+            assert (updated["date"], updated["debit"], updated["credit"]) == ("2024-03-02", 0.0, 7.0)
+
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+"""Exports stream every row in the requested format, and an empty file for a user
+without transactions."""
+import csv
+import io
+import pytest
+
+
+def test_export_without_transactions(client):
+    response = client.get("/transactions/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert list(csv.reader(io.StringIO(response.text))) == [["reference_no", "date", "details", "debit", "credit"]]
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+def test_binary_export_without_transactions(client, format):
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/transactions/export", params={"format": format})
+    assert response.status_code == 200
+    if format == "arrow":
+        table = pa.ipc.open_stream(response.content).read_all()
+    else:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(pa.BufferReader(response.content))
+    assert table.num_rows == 0
+    assert table.column_names == ["reference_no", "date", "details", "debit", "credit"]
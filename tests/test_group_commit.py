@@ -0,0 +1,72 @@
+"""Concurrent writes through the group-commit writer share a transaction, and a write
+that fails in it is rolled back alone and its error goes back to its own caller."""
+import asyncio
+import datetime
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from src import crud, group_commit, versions
+from src.database import DatabaseManager, shards
+
+USER = "group_commit"
+
+
+def row(reference_no: str):
+    return {"reference_no": reference_no, "date": datetime.date(2024, 1, 1), "details": "rent",
+            "debit": 1.0, "credit": 0.0}
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    # A wait long enough that every write of a test lands in one batch
+    writer = group_commit.GroupCommitWriter(shards[0], max_rows=256, max_wait_seconds=0.2)
+    monkeypatch.setattr(group_commit, "WRITE_COALESCING", True)
+    monkeypatch.setattr(group_commit, "writers", [writer])
+    return writer
+
+
+def submit(*writes):
+    async def run():
+        return await asyncio.gather(
+            *(group_commit.write(None, fn, USER, *args) for fn, *args in writes), return_exceptions=True
+        )
+    return asyncio.run(run())
+
+
+def stored_reference_nos():
+    user_table = DatabaseManager.get_table(USER)
+    with user_table.shard.engine.connect() as conn:
+        return set(conn.execute(select(user_table.c.reference_no)).scalars())
+
+
+def test_concurrent_writes_share_one_batch(writer):
+    results = submit(*((crud.insert_transactions, [row(f"batch-{i}")]) for i in range(20)))
+
+    assert results == [None] * 20
+    assert (writer.batches, writer.writes) == (1, 20)
+    assert {f"batch-{i}" for i in range(20)} <= stored_reference_nos()
+
+
+def test_failed_write_is_rolled_back_alone(writer):
+    submit((crud.insert_transactions, [row("existing")]))
+    with shards[0].SessionLocal() as db:
+        version = versions.current(db, USER)
+
+    results = submit(
+        (crud.insert_transactions, [row("kept-1")]),
+        (crud.update_transaction, "missing", {"debit": 2.0}),
+        (crud.insert_transactions, [row("existing")]),
+        (crud.update_transaction, "existing", {"debit": 3.0}),
+        (crud.insert_transactions, [row("kept-2")]),
+    )
+
+    assert writer.batches == 2
+    assert results[0] is None and results[4] is None
+    assert isinstance(results[1], HTTPException) and results[1].status_code == 404
+    assert isinstance(results[2], IntegrityError)
+    assert results[3]["debit"] == 3.0
+    assert {"kept-1", "kept-2", "existing"} <= stored_reference_nos()
+    with shards[0].SessionLocal() as db:
+        # One bump per write that committed
+        assert versions.current(db, USER) == version + 3
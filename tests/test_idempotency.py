@@ -0,0 +1,86 @@
+"""``Idempotency-Key`` retries get the first response back instead of inserting again."""
+import time
+from sqlalchemy import func, select
+from src import idempotency
+from src.database import shards
+
+TRANSACTION = {"date": "2024-01-01", "details": "rent", "debit": 5}
+
+
+def count_rows(client):
+    return len(client.get("/transactions/", params={"limit": 1000}).json()["items"])
+
+
+def test_retry_replays_the_first_response(client):
+    headers = {"Idempotency-Key": "create-once"}
+    first = client.post("/transactions/", json=TRANSACTION, headers=headers)
+    rows = count_rows(client)
+    retry = client.post("/transactions/", json=TRANSACTION, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert count_rows(client) == rows
+
+
+def test_bulk_retry_replays_the_first_response(client):
+    headers = {"Idempotency-Key": "bulk-once"}
+    body = [TRANSACTION, {**TRANSACTION, "debit": 6}]
+    first = client.post("/transactions/bulk", json=body, headers=headers)
+    rows = count_rows(client)
+    retry = client.post("/transactions/bulk", json=body, headers=headers)
+
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert count_rows(client) == rows
+
+
+def test_key_reused_with_a_different_body_is_rejected(client):
+    headers = {"Idempotency-Key": "reused"}
+    client.post("/transactions/", json=TRANSACTION, headers=headers)
+    rows = count_rows(client)
+    response = client.post("/transactions/", json={**TRANSACTION, "debit": 6}, headers=headers)
+
+    assert response.status_code == 422
+    assert count_rows(client) == rows
+
+
+def test_expired_key_is_claimed_again(client, monkeypatch):
+    headers = {"Idempotency-Key": "expires"}
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_KEY_TTL_SECONDS", 0)
+    first = client.post("/transactions/", json=TRANSACTION, headers=headers)
+    monkeypatch.undo()
+    retry = client.post("/transactions/", json=TRANSACTION, headers=headers)
+
+    assert retry.json() != first.json()
+    assert "Idempotent-Replayed" not in retry.headers
+    assert client.post("/transactions/", json=TRANSACTION, headers=headers).json() == retry.json()
+
+
+def test_sweep_deletes_expired_keys_in_batches(monkeypatch):
+    keys = idempotency.get_keys_table()
+    now = int(time.time())
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_SWEEP_BATCH", 2)
+    monkeypatch.setattr(idempotency, "_next_sweep", {})
+    with shards[0].SessionLocal() as db:
+        db.execute(keys.insert(), [
+            {"username": "sweep", "key": f"{state}-{i}", "fingerprint": "", "response": "{}",
+             "expires_at": now - 1 if state == "expired" else now + 3600}
+            for state in ("expired", "live") for i in range(3)
+        ])
+
+        def remaining():
+            state = func.substr(keys.c.key, 1, 4)
+            return dict(db.execute(
+                select(state, func.count()).where(keys.c.username == "sweep").group_by(state)
+            ).all())
+
+        idempotency._sweep(db, keys, now)
+        assert remaining() == {"expi": 1, "live": 3}
+        # Not again until IDEMPOTENCY_SWEEP_SECONDS have passed
+        idempotency._sweep(db, keys, now + 1)
+        assert remaining() == {"expi": 1, "live": 3}
+        idempotency._sweep(db, keys, now + idempotency.IDEMPOTENCY_SWEEP_SECONDS)
+        assert remaining() == {"live": 3}
+        db.rollback()
@@ -0,0 +1,48 @@
+"""The listing queries are driven by the date / details indexes, in listing order,
+so a page never sorts every matching row."""
+import datetime
+import pytest
+from sqlalchemy import text
+from src import database, listing
+from src.database import DatabaseManager
+
+
+def query_plan(conn, query):
+    sql = str(query.compile(conn.engine, compile_kwargs={"literal_binds": True}))
+    return " | ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+@pytest.fixture(scope="module", params=["per_user", "shared"])
+def user_table(request):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(database, "STORAGE_MODE", request.param)
+        user_table = DatabaseManager.get_table(f"explain_{request.param}", create=True)
+    # Realistic statistics for the planner: many dates, a few dozen details values
+    with user_table.shard.engine.begin() as conn:
+        conn.execute(user_table.insert(), [
+            {
+                "reference_no": f"ref-{i}",
+                "date": datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+                "details": f"item-{i % 40}",
+                "debit": float(i % 100),
+                "credit": 0.0,
+            }
+            for i in range(5000)
+        ])
+        conn.execute(text(f"ANALYZE {user_table.name}"))
+    return user_table
+
+
+@pytest.mark.parametrize("filters, after, index", [
+    ({"date_from": datetime.date(2024, 1, 1), "date_to": datetime.date(2024, 6, 30)}, None, "_date"),
+    ({"date_from": datetime.date(2024, 1, 1)}, (datetime.date(2024, 2, 1), "ref"), "_date"),
+    ({"details": "item-7"}, None, "_details_date"),
+    ({"details": "item-7"}, (datetime.date(2021, 2, 1), "ref"), "_details_date"),
+    ({"details": "item-7", "date_from": datetime.date(2021, 1, 1)}, None, "_details_date"),
+], ids=["date range", "date range after cursor", "details", "details after cursor", "details and date"])
+def test_listing_uses_index_in_order(user_table, filters, after, index):
+    query = listing.seek(user_table, listing.build_listing_query(user_table, **filters), after).limit(100)
+    with user_table.shard.engine.connect() as conn:
+        plan = query_plan(conn, query)
+    assert f"{user_table.name}{index} " in plan.replace("_username", "")
+    assert "TEMP B-TREE FOR ORDER BY" not in plan
@@ -0,0 +1,44 @@
+"""The response cache drops only the rows this process's writes change, and everything
+once another worker's write moves the user's data version."""
+from src.response_cache import ResponseCache, serialize
+
+
+def cached(cache, user_name, reference_no, version):
+    cache.put(user_name, reference_no, cache.generation(user_name), version, serialize({"reference_no": reference_no}))
+
+
+def test_own_writes_drop_only_the_rows_they_change():
+    cache = ResponseCache(100, revalidate_seconds=0)
+    cached(cache, "amy", "a", 1)
+    cached(cache, "amy", "b", 1)
+
+    cache.record_write("amy")  # a create: version 2
+    cache.invalidate("amy", "a")  # an update of a: version 3
+    cached(cache, "amy", "c", 3)
+
+    cache.revalidate_seconds = 60
+    assert cache.get("amy", "a") is None
+    assert cache.get("amy", "b") is not None
+    assert cache.get("amy", "c") is not None
+
+
+def test_another_workers_write_drops_the_users_rows():
+    cache = ResponseCache(100, revalidate_seconds=0)
+    cached(cache, "amy", "a", 1)
+    cached(cache, "bob", "a", 1)
+
+    cache.record_write("amy")  # version 2; another worker's write makes it 3
+    cached(cache, "amy", "b", 3)
+
+    cache.revalidate_seconds = 60
+    assert cache.get("amy", "a") is None
+    assert cache.get("amy", "b") is not None
+    assert cache.get("bob", "a") is not None
+
+
+def test_read_racing_a_write_is_not_stored():
+    cache = ResponseCache(100, revalidate_seconds=60)
+    generation = cache.generation("amy")
+    cache.invalidate("amy", "a")
+    cache.put("amy", "a", generation, 1, serialize({"reference_no": "a"}))
+    assert cache.get("amy", "a") is None
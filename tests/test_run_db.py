@@ -0,0 +1,20 @@
+"""``run_db`` keeps sync session work off the event loop's thread."""
+import asyncio
+import threading
+from src.database import SessionLocal, run_db
+
+
+def test_sync_session_runs_on_a_worker_thread():
+    def where(db, tag):
+        return tag, threading.get_ident()
+
+    async def run():
+        db = SessionLocal()
+        try:
+            return threading.get_ident(), await run_db(db, where, "tag")
+        finally:
+            db.close()
+
+    loop_thread, (tag, fn_thread) = asyncio.run(run())
+    assert tag == "tag"
+    assert fn_thread != loop_thread
@@ -0,0 +1,47 @@
+"""Search ranks matches best first across the hot table and the archived years."""
+import datetime
+from src import archive, crud, search
+from src.database import DatabaseManager
+
+USER = "search_archived"
+
+
+def all_pages(db, user_table, search_table, q, limit):
+    items, cursor = [], None
+    while True:
+        after = search.decode_cursor(cursor) if cursor else None
+        page, cursor = search.search(db, user_table, search_table, q, after, limit)
+        items += page
+        if cursor is None:
+            return items
+
+
+def test_rank_order_spans_archived_years():
+    filler = " ".join(f"word{i}" for i in range(30))
+    rows = [
+        {"reference_no": "archived-strong", "date": datetime.date(2015, 3, 1), "details": "coffee",
+         "debit": 1.0, "credit": 0.0},
+        # Enough other rows that "coffee" is as rare in the archive's index as in the hot one
+        *({"reference_no": f"archived-{i}", "date": datetime.date(2015, 4, 1 + i % 28), "details": f"rent {filler}",
+           "debit": 1.0, "credit": 0.0} for i in range(60)),
+        *({"reference_no": f"hot-weak-{i}", "date": datetime.date.today(), "details": f"coffee {filler}",
+           "debit": 1.0, "credit": 0.0} for i in range(5)),
+    ]
+    user_table = DatabaseManager.get_table(USER, create=True)
+    db = user_table.shard.SessionLocal()
+    try:
+        crud.insert_transactions(db, USER, rows)
+        db.commit()
+        search_table = search.get_search_table(USER)
+        before = [item["reference_no"] for item in all_pages(db, user_table, search_table, "coffee", 2)]
+        db.rollback()
+
+        assert archive.compact([USER])[USER] == {2015: 61}
+        items = all_pages(db, user_table, search_table, "coffee", 2)
+    finally:
+        db.close()
+
+    assert before[0] == "archived-strong"
+    assert [item["reference_no"] for item in items] == before
+    scores = [item["score"] for item in items]
+    assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,73 @@
+"""Tenants map to shards by consistent hashing, and ``rebalance_shards`` moves a tenant
+with everything derived from its rows."""
+import datetime
+from collections import Counter
+from sqlalchemy import select
+from src import balance, crud, database, idempotency, partitions, rebalance_shards, rollup, search, versions
+from src.database import DatabaseManager, HashRing, Shard, shard_url
+
+USERS = [f"tenant-{i}" for i in range(4000)]
+
+
+def test_ring_spreads_tenants_evenly():
+    ring, same_ring = HashRing(4), HashRing(4)
+    assert [ring.lookup(user_name) for user_name in USERS] == [same_ring.lookup(user_name) for user_name in USERS]
+    counts = Counter(ring.lookup(user_name) for user_name in USERS)
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert all(700 < count < 1300 for count in counts.values())
+    one_shard = HashRing(1)
+    assert {one_shard.lookup(user_name) for user_name in USERS} == {0}
+
+
+def test_adding_a_shard_only_moves_tenants_onto_it():
+    before, after = HashRing(3), HashRing(4)
+    moved = [user_name for user_name in USERS if before.lookup(user_name) != after.lookup(user_name)]
+    assert {after.lookup(user_name) for user_name in moved} == {3}
+    assert 0.15 < len(moved) / len(USERS) < 0.35
+
+
+def test_move_tenant(monkeypatch):
+    old_shard = Shard(1, shard_url(1))
+    two_shards = HashRing(2)
+    user_name = next(name for name in USERS if two_shards.lookup(name) == 1)
+
+    # Write the tenant while the ring puts it on shard 1
+    monkeypatch.setattr(database, "shards", [database.shards[0], old_shard])
+    monkeypatch.setattr(database, "shard_ring", two_shards)
+    # Tables every tenant shares were created before this shard existed
+    for table in (versions.get_versions_table(), idempotency.get_keys_table(), partitions.get_catalogue_table(),
+                  DatabaseManager.get_tenants_table(), *DatabaseManager._shared_tables.values()):
+        DatabaseManager.ensure_table_exists(table, old_shard)
+    db = old_shard.SessionLocal()
+    try:
+        crud.insert_transactions(db, user_name, [
+            {"reference_no": f"ref-{i}", "date": datetime.date(2024, 1 + i % 12, 1), "details": f"rent {i}",
+             "debit": float(i), "credit": 10.0}
+            for i in range(50)
+        ], "key", "fingerprint", {"inserted": 50})
+        db.commit()
+    finally:
+        db.close()
+    DatabaseManager.invalidate_table(user_name)
+
+    # Back to one shard: the tenant belongs on shard 0
+    monkeypatch.setattr(database, "shard_ring", HashRing(1))
+    assert rebalance_shards.move_tenant(user_name, old_shard, database.shards[0]) == 50
+
+    user_table = DatabaseManager.get_table(user_name)
+    assert user_table.shard is database.shards[0]
+    db = user_table.shard.SessionLocal()
+    try:
+        assert len(db.execute(user_table.select()).all()) == 50
+        assert versions.current(db, user_name) == 1
+        assert idempotency.claim(db, user_name, "key", "fingerprint", {})[1] == {"inserted": 50}
+        items, _ = search.search(db, user_table, search.get_search_table(user_name), "rent", None, 100)
+        assert len(items) == 50
+        db.rollback()
+    finally:
+        db.close()
+    assert rollup.check(user_name) == [] and balance.check(user_name) == []
+    with old_shard.engine.connect() as conn:
+        assert DatabaseManager.user_names(old_shard) == []
+        assert conn.execute(select(versions.get_versions_table().c.username)).all() == []
+    old_shard.engine.dispose()
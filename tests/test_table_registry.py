@@ -0,0 +1,19 @@
+"""The table registry counts every lookup, however many threads make them."""
+from concurrent.futures import ThreadPoolExecutor
+from src.database import DatabaseManager
+
+
+def test_hits_are_counted_across_threads():
+    DatabaseManager.get_table("registry", create=True)
+    before = DatabaseManager.table_cache_stats()
+
+    def lookups(_):
+        for _ in range(5000):
+            DatabaseManager.get_table("registry")
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lookups, range(8)))
+
+    after = DatabaseManager.table_cache_stats()
+    assert after["hits"] - before["hits"] == 8 * 5000
+    assert after["misses"] == before["misses"]